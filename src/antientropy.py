@@ -0,0 +1,117 @@
+import events
+
+
+class AntiEntropy:
+    def __init__(self, consensus, interval_ms=20, event_sink=None, metrics=None):
+        """
+        Background repair of stale replicas, run as a periodic event on the clock of the consensus
+        Each round compares the (version, hash) digest of every operational server and copies the newest
+        version to the servers behind it; only the chunks a stale replica does not already hold are sent
+        The client write path never waits for the repair, so a partial-quorum update returns once the quorum
+        has ACKed however many replicas are lagging
+        Rounds draw nothing from the random generator, so seeded runs stay reproducible
+        params:
+        consensus: the ConsensusAlgorithm whose servers and clock are used
+        interval_ms: time in milliseconds between two rounds
+        event_sink: optional EventSink receiving the repair events (defaults to the sink of the consensus)
+        metrics: optional Metrics recording the rounds, repairs and bytes sent (defaults to the consensus metrics)
+        """
+        self.consensus = consensus
+        self.servers = consensus.servers
+        self.clock = consensus.clock
+        self.interval_ms = interval_ms
+        self.event_sink = event_sink if event_sink is not None else consensus.event_sink
+        self.metrics = metrics if metrics is not None else consensus.metrics
+        self.running = False
+        self.rounds = 0
+        self.repairs = 0
+        self.bytes_sent = 0
+        self._generation = 0  # Identifies the scheduled round, so a stopped task ignores its pending event
+
+    def _emit(self, type, **fields):
+        self.event_sink.emit(type, "anti-entropy", self.clock.now_ms(), **fields)
+
+    def start(self):
+        """
+        Schedules the first round after one interval
+        """
+        if not self.running:
+            self.running = True
+            self._generation += 1
+            self.clock.call_later(self.interval_ms, self._tick, self._generation)
+
+    def stop(self):
+        """
+        Stops the periodic rounds; the event already scheduled does nothing
+        """
+        self.running = False
+
+    def _tick(self, generation):
+        if not self.running or generation != self._generation:
+            return
+        self.run_round()
+        self.clock.call_later(self.interval_ms, self._tick, generation)
+
+    def _target(self, operational):
+        """
+        Return the server holding the newest version, or None if no server holds a file
+        Servers disagreeing on the content of the newest version are resolved by total weight
+        params:
+        operational: the operational servers, in the order of the cluster
+        """
+        newest = max((server.file_version for server in operational if server.file_version is not None),
+                     default=None)
+        if newest is None:
+            return None
+        groups = {}  # hash -> [total weight, first server]
+        for server in operational:
+            if server.file_version == newest:
+                group = groups.setdefault(server.file_hash, [0, server])
+                group[0] += server.weight
+        return max(groups.values(), key=lambda group: group[0])[1]
+
+    def run_round(self):
+        """
+        Compares the digests of the operational servers and repairs the stale ones
+        Return the number of servers repaired
+        """
+        current_time_ms = self.clock.now_ms()
+        operational = [server for server in self.servers
+                       if server.operational or current_time_ms >= server.recovery_time_ms]
+        self.rounds += 1
+        if self.metrics.enabled:
+            self.metrics.incr("anti_entropy_rounds")
+        source = self._target(operational)
+        if source is None:
+            return 0
+        version = source.file_version
+        stale = [server for server in operational
+                 if server.file_version is None or server.file_version < version
+                 or (server.file_version == version and server.file_hash != source.file_hash)]
+        if not stale:
+            return 0
+
+        manifest = source.store.manifest(version)
+        entry = source.store.entry(version)
+        repaired = 0
+        for server in stale:
+            # Only the chunks the replica does not hold are sent
+            chunks = {digest: source.store.chunks[digest] for digest in server.store.missing_chunks(set(manifest))}
+            if not server.apply_repair(version, manifest, chunks, entry, current_time_ms):
+                continue
+            sent_bytes = sum(len(chunk) for chunk in chunks.values())
+            repaired += 1
+            self.bytes_sent += sent_bytes
+            self.consensus.unresponsive_servers.discard(server)
+            self.consensus.unavailable_servers.discard(server)
+            if self.event_sink.enabled:
+                self._emit(events.REPAIR, server=server.id, source_server=source.id, version=version,
+                           chunks=len(chunks), bytes=sent_bytes)
+            if self.metrics.enabled:
+                self.metrics.incr("anti_entropy_repairs")
+                self.metrics.incr("anti_entropy_chunks_sent", len(chunks))
+                self.metrics.incr("anti_entropy_bytes_sent", sent_bytes)
+        self.repairs += repaired
+        if self.event_sink.enabled:
+            self._emit(events.ANTI_ENTROPY_ROUND, version=version, stale=len(stale), repaired=repaired)
+        return repaired
@@ -0,0 +1,300 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from clock import VirtualClock
+from cluster import Cluster, generate_server_settings
+from consensus import ConsensusAlgorithm
+from file import File
+from quorum import QUORUM_MODES
+from server import Server
+from wal import DurableVersionLog
+
+OPERATIONS = ["update_consensus", "retry_unresponsive_servers", "restore_consensus"]
+
+# Default sweep; file sizes go up to the 100 KB limit of File.is_valid
+CLUSTER_SIZES = [3, 11, 101]
+FILE_SIZES = [64, 10_000, 100_000]
+FAILURE_PROBS = [0.0, 0.1, 0.3]
+RETRY_SETTINGS = [(3, 5), (5, 10)]  # (retry_limit, retry_period_ms)
+
+QUICK_SWEEP = {
+    "cluster_sizes": [3, 11],
+    "file_sizes": [64, 10_000],
+    "failure_probs": [0.1],
+    "retry_settings": [(3, 5)],
+}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    params:
+    sorted_values: the measurements, sorted
+    fraction: the percentile as a fraction (0.95 for p95)
+    """
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(durations_s):
+    """
+    Return the throughput and latency figures of a list of call durations in seconds
+    """
+    latencies_ms = sorted(d * 1000 for d in durations_s)
+    total_s = sum(durations_s)
+    return {
+        "iterations": len(durations_s),
+        "ops_per_sec": len(durations_s) / total_s if total_s > 0 else None,
+        "mean_ms": total_s * 1000 / len(durations_s) if durations_s else None,
+        "p50_ms": percentile(latencies_ms, 0.50),
+        "p95_ms": percentile(latencies_ms, 0.95),
+        "p99_ms": percentile(latencies_ms, 0.99),
+    }
+
+
+def make_content(version, file_size):
+    """
+    Return file content of exactly file_size bytes that differs between versions
+    """
+    prefix = f"Updated content for version {version}."
+    filler = "abcdefghijklmnopqrstuvwxyz0123456789\n"
+    return (prefix + filler * (file_size // len(filler) + 1))[:file_size]
+
+
+def bench_case(num_servers, file_size, failure_prob, retry_limit, retry_period_ms, iterations=50, seed=0,
+               fanout="sequential", quorum="all", network=None, sync_every=None):
+    """
+    Measures the consensus operations on one cluster configuration
+    Every iteration creates a new version, commits it with update_consensus, retries the unresponsive
+    servers and restores the file; each call is timed with the wall clock while the protocol waits run
+    on a virtual clock
+    Return a list of result dictionaries, one per operation
+    params:
+    num_servers: number of servers in the generated cluster
+    file_size: size of every version in bytes
+    failure_prob: update failure probability of every server
+    retry_limit: retry limit of the update and restore phases
+    retry_period_ms: time between two retries
+    iterations: number of versions committed and restored
+    seed: seed of the cluster settings and of the simulated failures
+    fanout: "sequential" or "concurrent"
+    quorum: the quorum mode
+    network: None for in-memory servers, or "tcp" / "unix" for the networked mode
+    sync_every: if set, every server keeps its versions in a DurableVersionLog fsynced once every sync_every
+                commits, and the time a replica takes to reload its log after a crash is measured too
+    """
+    if network is not None and sync_every is not None:
+        raise ValueError("Durable stores are not supported in the networked mode")
+    random.seed(seed)
+    clock = VirtualClock()
+    settings = generate_server_settings(num_servers, failure_prob=failure_prob, seed=seed)
+    networked_cluster = None
+    store_directory = None
+    if network is not None:
+        from network import NetworkedCluster
+        networked_cluster = NetworkedCluster(settings, family=network)
+        servers = networked_cluster.servers
+    elif sync_every is not None:
+        store_directory = tempfile.mkdtemp(prefix="bench-wal-")
+        servers = Cluster(settings, clock=clock, store_factory=lambda s: DurableVersionLog(
+            os.path.join(store_directory, f"server-{s['id']}"), sync_every=sync_every))
+    else:
+        servers = Cluster(settings, clock=clock)
+    consensus = ConsensusAlgorithm(servers, clock=clock, fanout=fanout, quorum=quorum)
+
+    durations = {operation: [] for operation in OPERATIONS}
+    restored = 0
+    try:
+        initial = File("bench.txt", make_content(1, file_size), version=1)
+        for server in servers:
+            server.store_file(version=1, file=initial)
+
+        for version in range(2, iterations + 2):
+            file = File(f"bench_v{version}.txt", make_content(version, file_size), version=version)
+            clock.sleep(random.randint(10, 30))
+
+            start = time.perf_counter()
+            consensus.update_consensus(file, retry_limit=retry_limit, retry_period_ms=retry_period_ms)
+            durations["update_consensus"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            consensus.retry_unresponsive_servers(file)
+            durations["retry_unresponsive_servers"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            result = consensus.restore_consensus(retry_limit=retry_limit, retry_period_ms=retry_period_ms)
+            durations["restore_consensus"].append(time.perf_counter() - start)
+            if isinstance(result, dict) and result["version"] == version:
+                restored += 1
+
+        if store_directory is not None:
+            # Crash every replica and time its restart from the log
+            durations["replica_recovery"] = []
+            for server, server_settings in zip(servers, settings):
+                server.store.simulate_crash()
+                start = time.perf_counter()
+                Server(id=server_settings["id"], weight=server_settings["weight"],
+                       failure_prob=server_settings["failure_prob"],
+                       recovery_delay_min=server_settings["recovery_delay_min"],
+                       recovery_delay_max=server_settings["recovery_delay_max"],
+                       store=DurableVersionLog(server.store.directory, sync_every=sync_every)).store.close()
+                durations["replica_recovery"].append(time.perf_counter() - start)
+    finally:
+        consensus.close()
+        if networked_cluster is not None:
+            networked_cluster.close()
+        if store_directory is not None:
+            shutil.rmtree(store_directory, ignore_errors=True)
+
+    case = {
+        "num_servers": num_servers,
+        "file_size": file_size,
+        "failure_prob": failure_prob,
+        "retry_limit": retry_limit,
+        "retry_period_ms": retry_period_ms,
+        "fanout": fanout,
+        "quorum": quorum,
+        "network": network,
+        "sync_every": sync_every,
+    }
+    results = []
+    for operation in durations:
+        row = dict(case, operation=operation)
+        row.update(summarize(durations[operation]))
+        if operation == "restore_consensus":
+            row["restore_accuracy"] = restored / iterations
+        results.append(row)
+    return results
+
+
+def run_suite(cluster_sizes=None, file_sizes=None, failure_probs=None, retry_settings=None, iterations=50, seed=0,
+              fanout="sequential", quorum="all", network=None, sync_every=None):
+    """
+    Runs bench_case over the cartesian product of the sweep parameters
+    Return the report dictionary (environment metadata and results)
+    """
+    cluster_sizes = cluster_sizes or CLUSTER_SIZES
+    file_sizes = file_sizes or FILE_SIZES
+    failure_probs = failure_probs if failure_probs is not None else FAILURE_PROBS
+    retry_settings = retry_settings or RETRY_SETTINGS
+
+    results = []
+    for num_servers, file_size, failure_prob, (retry_limit, retry_period_ms) in itertools.product(
+            cluster_sizes, file_sizes, failure_probs, retry_settings):
+        results.extend(bench_case(num_servers, file_size, failure_prob, retry_limit, retry_period_ms,
+                                  iterations=iterations, seed=seed, fanout=fanout, quorum=quorum, network=network,
+                                  sync_every=sync_every))
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": iterations,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def _case_key(row):
+    return tuple(row.get(field) for field in ("num_servers", "file_size", "failure_prob", "retry_limit",
+                                              "retry_period_ms", "fanout", "quorum", "network", "sync_every",
+                                              "operation"))
+
+
+def compare(baseline, current, threshold=0.10, metric="p50_ms"):
+    """
+    Compares two benchmark reports case by case
+    Return a list of (case key, baseline value, current value, relative change, regressed) tuples
+    params:
+    baseline: the reference report (dictionary as written by run_suite)
+    current: the new report
+    threshold: relative slowdown above which a case is reported as a regression
+    metric: latency figure compared ("mean_ms", "p50_ms", "p95_ms" or "p99_ms")
+    """
+    baseline_rows = {_case_key(row): row for row in baseline["results"]}
+    comparison = []
+    for row in current["results"]:
+        key = _case_key(row)
+        reference = baseline_rows.get(key)
+        if reference is None or not reference[metric]:
+            continue
+        change = (row[metric] - reference[metric]) / reference[metric]
+        comparison.append((key, reference[metric], row[metric], change, change > threshold))
+    return comparison
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line
+    params:
+    argv: the arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="Latency and throughput benchmark of the consensus protocol")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark sweep and write a JSON report")
+    run_parser.add_argument("--output", default=os.path.join("benchmarks", "results.json"))
+    run_parser.add_argument("--iterations", type=int, default=50)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--fanout", default="sequential", choices=["sequential", "concurrent"])
+    run_parser.add_argument("--quorum", default="all", choices=QUORUM_MODES)
+    run_parser.add_argument("--network", default=None, choices=["tcp", "unix"])
+    run_parser.add_argument("--sync-every", type=int, default=None,
+                            help="store the replicas in write-ahead logs fsynced every N commits")
+    run_parser.add_argument("--quick", action="store_true", help="run a reduced sweep")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+    compare_parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        sweep = QUICK_SWEEP if args.quick else {}
+        report = run_suite(iterations=args.iterations, seed=args.seed, fanout=args.fanout, quorum=args.quorum,
+                           network=args.network, sync_every=args.sync_every, **sweep)
+        output_dir = os.path.dirname(args.output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        for row in report["results"]:
+            print(f"{row['operation']:<28} n={row['num_servers']:<4} size={row['file_size']:<6} "
+                  f"fail={row['failure_prob']:<4} retry={row['retry_limit']}/{row['retry_period_ms']}ms  "
+                  f"{row['ops_per_sec']:>10.1f} ops/s  p50={row['p50_ms']:.3f}  p95={row['p95_ms']:.3f}  "
+                  f"p99={row['p99_ms']:.3f} ms")
+        print(f"Report written to {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        comparison = compare(baseline, current, threshold=args.threshold, metric=args.metric)
+        regressions = 0
+        for key, before, after, change, regressed in comparison:
+            regressions += regressed
+            flag = "REGRESSION" if regressed else ""
+            print(f"{key[-1]:<28} n={key[0]:<4} size={key[1]:<6} fail={key[2]:<4} retry={key[3]}/{key[4]}ms  "
+                  f"{before:.3f} -> {after:.3f} ms ({change:+.1%}) {flag}")
+        print(f"{regressions} regression(s) above {args.threshold:.0%} in {len(comparison)} cases")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,156 @@
-from file import File
-
-
-class Client:
-    def __init__(self, servers, consensus):
-        """
-        Represents the client
-	params:
-        servers: A list of server objects
-        consensus: The consensus algorithm object
-        """
-        self.servers = servers
-        self.consensus = consensus
-        self.current_file = None
-
-    def create_initial_file(self, file_name, content):
-        """
-        Creates the initial file
-	params:
-        file_name: Name of the file
-        content: Content of the file
-        """
-        self.current_file = File(file_name=file_name, content=content)
-        print(f"Client: Initial file created - {self.current_file.file_name}, Version: {self.current_file.version}\n")
-
-    def distribute_file(self):
-        """
-        Distributes the initial file to all servers
-        """
-        print("Client: Distributing the initial file to all servers.\n")
-        for server in self.servers:
-            server.store_file(version=self.current_file.version, file=self.current_file)
-
-    def update_file(self):
-        """
-        Updates the current file by creating a new version
-        The file name and content are updated based on the version
-        """
-        if not self.current_file:
-            print("Client: No file exists to update.\n")
-            return
-        new_version = self.current_file.version + 1
-        new_name = f"updated_file_v{new_version}.txt"
-        new_content = f"Updated content for version {new_version}."
-        self.current_file = File(file_name=new_name, content=new_content, version=new_version)
-        print(f"Client: File updated - {self.current_file.file_name}, Version: {self.current_file.version}\n")
-
-    def apply_update(self):
-        """
-        Applies the update to the servers using the consensus algorithm
-        """
-        print("Client: Applying update to servers via consensus.\n")
-        success = self.consensus.update_consensus(self.current_file)
-        if success:
-            print("Client: Update successfully applied to all servers.\n")
-
-    def restore_file(self):
-        """
-        Attempts to restore the correct file from the servers using the consensus algorithm
-        """
-        print("Client: Attempting to restore the file.\n")
-        restored_file = self.consensus.restore_consensus()
-        if isinstance(restored_file, dict):
-            print(
-                f"Client: File restored successfully - {restored_file['file_name']}, Version: {restored_file['version']}\n")
-        else:
-            print(f"Client: Restore failed. Multiple versions received:\n{restored_file}\n")
+import events
+from events import NULL_SINK
+from file import File
+
+
+class Client:
+    def __init__(self, servers, consensus, event_sink=None, batch_size=1, batch_window_ms=None):
+        """
+        Represents the client
+	params:
+        servers: A list of server objects
+        consensus: The consensus algorithm object
+        event_sink: optional EventSink receiving the client events (discarded by default)
+        batch_size: number of versions grouped in one update round (1 commits every version)
+        batch_window_ms: optional maximum time a version waits in the batch before it is committed; the batch
+                         is committed by a clock event once the window expires, even if no other version is queued
+        """
+        self.servers = servers
+        self.consensus = consensus
+        self.current_file = None
+        self.event_sink = event_sink if event_sink is not None else NULL_SINK
+        self.batch_size = batch_size
+        self.batch_window_ms = batch_window_ms
+        self.pending_updates = []  # Versions waiting to be committed in the next batch
+        self._batch_started_ms = None
+        self._batch_generation = 0  # Identifies the open batch, so the window event of a committed batch is ignored
+        self.files = {}  # File key -> latest File of the keyed files
+        self.pending_files = {}  # File key -> newest version not committed yet
+
+    def _emit(self, type, **fields):
+        """
+        Sends an event to the event sink, stamped with the consensus clock time
+        """
+        self.event_sink.emit(type, "client", self.consensus.clock.now_ms(), **fields)
+
+    def create_initial_file(self, file_name, content):
+        """
+        Creates the initial file
+	params:
+        file_name: Name of the file
+        content: Content of the file
+        """
+        self.current_file = File(file_name=file_name, content=content)
+        if self.event_sink.enabled:
+            self._emit(events.FILE_CREATED, file_name=self.current_file.file_name, version=self.current_file.version)
+
+    def distribute_file(self):
+        """
+        Distributes the initial file to all servers
+        """
+        for server in self.servers:
+            server.store_file(version=self.current_file.version, file=self.current_file)
+
+    def update_file(self):
+        """
+        Updates the current file by creating a new version
+        The file name and content are updated based on the version
+        """
+        if not self.current_file:
+            if self.event_sink.enabled:
+                self._emit(events.ERROR, error="no file exists to update")
+            return
+        new_version = self.current_file.version + 1
+        new_name = f"updated_file_v{new_version}.txt"
+        new_content = f"Updated content for version {new_version}."
+        self.current_file = File(file_name=new_name, content=new_content, version=new_version)
+        if self.event_sink.enabled:
+            self._emit(events.FILE_CREATED, file_name=self.current_file.file_name, version=self.current_file.version)
+
+    def apply_update(self):
+        """
+        Applies the update to the servers using the consensus algorithm
+        With batching, the version is queued and the batch is committed once it holds batch_size
+        versions or its oldest version has waited batch_window_ms
+        Return the result of the consensus round, or None if the update was queued
+        """
+        if self.batch_size <= 1:
+            return self.consensus.update_consensus(self.current_file)
+
+        current_time_ms = self.consensus.clock.now_ms()
+        if not self.pending_updates:
+            self._batch_started_ms = current_time_ms
+            if self.batch_window_ms is not None:
+                self.consensus.clock.call_later(self.batch_window_ms, self._window_expired, self._batch_generation)
+        self.pending_updates.append(self.current_file)
+        window_elapsed = (self.batch_window_ms is not None
+                          and current_time_ms - self._batch_started_ms >= self.batch_window_ms)
+        if len(self.pending_updates) >= self.batch_size or window_elapsed:
+            return self.flush_updates()
+        return None
+
+    def flush_updates(self):
+        """
+        Commits the queued versions in one update round
+        Return the result of the consensus round, or None if no version was queued
+        """
+        if not self.pending_updates:
+            return None
+        files = self.pending_updates
+        self.pending_updates = []
+        self._batch_generation += 1
+        return self.consensus.update_batch(files)
+
+    def _window_expired(self, generation):
+        """
+        Clock event committing the batch whose window has expired, unless it was already committed
+        """
+        if generation == self._batch_generation:
+            self.flush_updates()
+
+    def write_file(self, key, file_name, content):
+        """
+        Creates a keyed file, or its next version, to be committed with the other pending files by commit_files
+        Writing a key again before the commit replaces its pending version, only the newest one is sent
+        Return the new File
+        params:
+        key: the file key
+        file_name: Name of the file
+        content: Content of the file
+        """
+        previous = self.files.get(key)
+        file = File(file_name=file_name, content=content, version=previous.version + 1 if previous else 1)
+        self.files[key] = file
+        self.pending_files[key] = file
+        if self.event_sink.enabled:
+            self._emit(events.FILE_CREATED, key=key, file_name=file.file_name, version=file.version)
+        return file
+
+    def commit_files(self):
+        """
+        Commits the pending keyed files together, sharing the round trips to each server
+        (see ConsensusAlgorithm.update_files)
+        Return a dictionary file key -> True if the file was committed
+        """
+        if not self.pending_files:
+            return {}
+        files = self.pending_files
+        self.pending_files = {}
+        return self.consensus.update_files(files)
+
+    def restore_file(self, key=None):
+        """
+        Attempts to restore the correct file from the servers using the consensus algorithm
+        params:
+        key: optional key of a keyed file to restore instead of the single file
+        """
+        # The queued versions are committed first, so the restore reads the latest written version
+        if key is None:
+            self.flush_updates()
+        restored_file = self.consensus.restore_consensus(key=key)
+        if self.event_sink.enabled:
+            if isinstance(restored_file, dict):
+                self._emit(events.RESTORE_RESULT, file_name=restored_file["file_name"], version=restored_file["version"])
+            else:
+                self._emit(events.RESTORE_RESULT, file_name=None, version=None)
+        return restored_file
@@ -0,0 +1,128 @@
+import heapq
+import itertools
+import time
+
+
+class Clock:
+    realtime = False  # True if waiting on the clock takes real time
+
+    def __init__(self):
+        """
+        Base class for the clocks used by servers, client and consensus
+        Keeps an event queue of callbacks scheduled at a given time in milliseconds
+        """
+        self._events = []
+        self._sequence = itertools.count()  # Keeps events scheduled at the same time in FIFO order
+
+    def now_ms(self):
+        """
+        Return the current time in milliseconds
+        """
+        raise NotImplementedError
+
+    def sleep(self, duration_ms):
+        """
+        Waits for the given amount of time, running the events that become due
+        params:
+        duration_ms: time to wait in milliseconds
+        """
+        raise NotImplementedError
+
+    def call_at(self, time_ms, callback, *args):
+        """
+        Schedules a callback to be run when the clock reaches the given time
+        params:
+        time_ms: the time in milliseconds at which the callback is run
+        callback: the function to call
+        args: positional arguments passed to the callback
+        """
+        heapq.heappush(self._events, (time_ms, next(self._sequence), callback, args))
+
+    def call_later(self, delay_ms, callback, *args):
+        """
+        Schedules a callback to be run after the given delay
+        params:
+        delay_ms: delay in milliseconds from the current time
+        callback: the function to call
+        args: positional arguments passed to the callback
+        """
+        self.call_at(self.now_ms() + delay_ms, callback, *args)
+
+    def pending_events(self):
+        """
+        Return the number of events still waiting in the queue
+        """
+        return len(self._events)
+
+    def _run_events_until(self, time_ms):
+        """
+        Runs, in time order, every event scheduled at or before the given time
+        Return the time of the last event that was run, or None
+        """
+        last_time_ms = None
+        while self._events and self._events[0][0] <= time_ms:
+            event_time_ms, _, callback, args = heapq.heappop(self._events)
+            last_time_ms = event_time_ms
+            self._on_event(event_time_ms)
+            callback(*args)
+        return last_time_ms
+
+    def _on_event(self, event_time_ms):
+        """
+        Hook called right before an event is run
+        """
+
+
+class WallClock(Clock):
+    """
+    Clock backed by the real time: sleeps block the caller
+    """
+    realtime = True
+
+    def now_ms(self):
+        return time.time() * 1000
+
+    def sleep(self, duration_ms):
+        if duration_ms > 0:
+            time.sleep(duration_ms / 1000.0)
+        self._run_events_until(self.now_ms())
+
+
+class VirtualClock(Clock):
+    def __init__(self, start_ms=0):
+        """
+        Discrete-event clock: sleeping advances the simulated time instantly
+        Scheduled events are run in time order while the time advances, so a run is
+        reproducible and does not depend on the speed of the machine
+        params:
+        start_ms: the initial simulated time in milliseconds
+        """
+        super().__init__()
+        self._now_ms = start_ms
+
+    def now_ms(self):
+        return self._now_ms
+
+    def sleep(self, duration_ms):
+        target_ms = self._now_ms + max(duration_ms, 0)
+        self._run_events_until(target_ms)
+        self._now_ms = target_ms
+
+    def advance_to(self, time_ms):
+        """
+        Moves the simulated time forward to the given time, running the due events
+        params:
+        time_ms: the target time in milliseconds
+        """
+        self.sleep(time_ms - self._now_ms)
+
+    def run_pending(self):
+        """
+        Runs every scheduled event, advancing the time to the last one
+        """
+        while self._events:
+            self.advance_to(self._events[0][0])
+
+    def _on_event(self, event_time_ms):
+        if event_time_ms > self._now_ms:
+            self._now_ms = event_time_ms
@@ -0,0 +1,75 @@
+import random
+
+from server import Server
+
+
+def Cluster(server_settings, clock=None, event_sink=None, metrics=None, store_factory=None, faults=None):
+    """
+    Creates a cluster of servers
+    params:
+    server_settings: list of server dictionaries (id, failure_prob, weight, recovery_delay_min, recovery_delay_max)
+    clock: optional Clock shared by the servers
+    event_sink: optional EventSink shared by the servers
+    metrics: optional Metrics shared by the servers
+    store_factory: optional callable taking the settings of a server and returning its replica store
+                   (e.g. a DurableVersionLog in a directory per server)
+    faults: optional fault source shared by the servers (e.g. RandomFaults(seed) or TraceReplay(trace))
+    """
+    return [
+        Server(
+            id=s["id"],
+            weight=s["weight"],
+            failure_prob=s["failure_prob"],
+            recovery_delay_min=s["recovery_delay_min"],
+            recovery_delay_max=s["recovery_delay_max"],
+            clock=clock,
+            event_sink=event_sink,
+            metrics=metrics,
+            faults=faults,
+            store=store_factory(s) if store_factory is not None else None
+        )
+        for s in server_settings
+    ]
+
+
+def _draw(distribution, rng, integer=False):
+    """
+    Draws a value from a distribution given as a constant, a (low, high) uniform range or a callable
+    params:
+    distribution: the constant, range or callable taking the random generator
+    rng: a random.Random instance
+    integer: if True, ranges are sampled as integers (bounds included)
+    """
+    if callable(distribution):
+        return distribution(rng)
+    if isinstance(distribution, tuple):
+        low, high = distribution
+        return rng.randint(low, high) if integer else rng.uniform(low, high)
+    return distribution
+
+
+def generate_server_settings(num_servers, failure_prob=(0.05, 0.3), weight=(1, 10), recovery_delay_min=(5, 30),
+                             recovery_delay_spread=(5, 30), seed=None):
+    """
+    Generates the settings of a cluster of any size, in the format used by Cluster and the batch configurations
+    Each parameter is a constant, a (low, high) uniform range or a callable taking a random.Random
+    params:
+    num_servers: number of servers
+    failure_prob: distribution of the update failure probability
+    weight: distribution of the server weight (integer ranges)
+    recovery_delay_min: distribution of the minimum recovery delay in ms (integer ranges)
+    recovery_delay_spread: distribution of recovery_delay_max - recovery_delay_min in ms (integer ranges)
+    seed: seed of the generator, for reproducible clusters
+    """
+    rng = random.Random(seed)
+    settings = []
+    for server_id in range(1, num_servers + 1):
+        delay_min = _draw(recovery_delay_min, rng, integer=True)
+        settings.append({
+            "id": server_id,
+            "failure_prob": _draw(failure_prob, rng),
+            "weight": _draw(weight, rng, integer=True),
+            "recovery_delay_min": delay_min,
+            "recovery_delay_max": delay_min + _draw(recovery_delay_spread, rng, integer=True),
+        })
+    return settings
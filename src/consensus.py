@@ -1,203 +1,1187 @@
-import time
-import hashlib
-
-class ConsensusAlgorithm:
-    def __init__(self, servers):
-        """
-	Represents the consensus algorithm logic
-	params:
-        servers: a list of Server objects forming the cluster
-        """
-        self.servers = servers
-        self.unresponsive_servers = set()
-        self.unavailable_servers = set()
-
-    def validate_file(self, file):
-        """
-        Validates a file before it is sent to the servers
-	Return True if the file is valid, otherwise False
-	params:
-        file: a File object
-        """
-        is_valid, message = file.is_valid()
-        if not is_valid:
-            print(f"Consensus: Validation failed - {message} \n")
-            return False
-        return True
-
-    def update_consensus(self, file, timeout_ms=2, retry_limit=3, retry_period_ms=5):
-        """
-        Handles the update phase with a client-side timeout for ACKs
-        Retries sending updates if ACKs are not received, respecting retry limits and periods
-        Simulates server failures and recovery
-	Return True if consensus was reached (all servers responded with ACKs), False otherwise
-	params:
-        file: the file to be updated
-        timeout_ms: maximum time in milliseconds to wait for ACKs
-        retry_limit: Maximum number of retries for unresponsive servers
-        retry_period_ms: Period in milliseconds between retries for unresponsive servers
-        current_time_ms: The current simulation time in milliseconds
-        """
-        print(f"Consensus: Starting update for file {file.file_name}, version {file.version}\n")
-        current_time_ms = int(time.time() * 1000)
-        remaining_servers = set(self.servers)  # Start with all servers
-        retries = {server: 0 for server in remaining_servers}
-
-        while remaining_servers:
-            for server in list(remaining_servers):
-                try:
-                    if retries[server] >= retry_limit:
-                        print(f"Consensus: Server {server.id} has reached max retries. Marking as unresponsive.\n")
-                        self.unresponsive_servers.add(server)
-                        remaining_servers.remove(server)
-                        continue
-
-                    # Send the update to the server
-                    update_applied = server.update_file(file, current_time_ms)
-                    if not update_applied:
-                        print(f"Consensus: Server {server.id} failed to apply the update.\n")
-                        retries[server] += 1
-                        continue
-                    start_time = time.time()
-
-                    # Wait for ACK
-                    while time.time() - start_time < timeout_ms / 1000.0:
-                        ack = server.send_ack()
-                        if ack:
-                            print(f"Consensus: ACK received from Server {server.id}.\n")
-                            remaining_servers.remove(server)
-                            break
-                        time.sleep(0.001)
-                    else:
-                        print(f"Consensus: Timeout waiting for ACK from Server {server.id}. Retrying...\n")
-                        retries[server] += 1
-                except Exception as e:
-                    print(f"Consensus: Server {server.id} encountered an error: {e}\n")
-                    retries[server] += 1
-
-            if remaining_servers:
-                print(f"Consensus: Waiting {retry_period_ms} ms before next retry for remaining servers.\n")
-                time.sleep(retry_period_ms / 1000)  # Convert ms to seconds for sleep
-
-            # Log the current state of retries
-            print(f"Consensus: Current retries: {[f'Server {s.id}: {retries[s]} retries' for s in remaining_servers]}\n")
-
-            # Break if retry limits are exhausted
-            if all(retries[s] >= retry_limit for s in remaining_servers):
-                print("Consensus: Retry limit reached for all remaining servers.\n")
-                break
-
-        # Return True if all servers have sent ACKs (remaining_servers is empty)
-        if not remaining_servers:
-            print("Consensus: All servers responded with ACKs. Update successful.\n")
-            return True
-
-        # Return False if some servers are still unresponsive
-        print("Consensus: Some servers did not respond with ACKs.\n")
-        return False
-
-
-    def retry_unresponsive_servers(self, file, long_retry_limit=5, retry_interval=0.02):
-        """
-        Periodically retries to update temporarily unavailable servers
-	params:
-        file: The file to be updated
-        long_retry_limit: Maximum number of retries for unresponsive servers
-        retry_interval: Time in seconds between retries
-        """
-        retries = 0
-        while self.unresponsive_servers and retries < long_retry_limit:
-            print(f"Consensus: Retry {retries + 1} for unresponsive servers: {[s.id for s in self.unresponsive_servers]}\n")
-            for server in self.unresponsive_servers.copy():
-                try:
-                    update_applied = server.update_file(file)
-                    if update_applied:
-                        ack = server.send_ack()
-                        if ack:
-                            self.unresponsive_servers.remove(server)
-                            print(f"Consensus: Server {server.id} successfully updated.\n")
-                except Exception as e:
-                    print(f"Consensus: Server {server.id} is still unavailable: {e}\n")
-
-            retries += 1
-            if self.unresponsive_servers:
-                print(f"Consensus: Waiting {retry_interval * 1000:.2f} ms before next retry...\n")
-                time.sleep(retry_interval)
-
-        if self.unresponsive_servers:
-            print(f"Consensus: Following servers are permanently unavailable: {[s.id for s in self.unresponsive_servers]}\n")
-            self.unavailable_servers.update(self.unresponsive_servers)
-            self.unresponsive_servers.clear()
-
-    def restore_consensus(self, retry_limit=2, retry_period_ms=5):
-        """
-        Handles the restore phase with majority rule and weighted fallback
-	Return the file with the highest weight or consensus result
-	params:
-        retry_limit: Maximum number of retries if consensus is not reached
-        retry_period_ms: Time in milliseconds between retries
-        """
-        print("Consensus: Starting restore phase with weighted fallback.\n")
-
-        remaining_servers = set(self.servers)
-        retries = {server: 0 for server in remaining_servers}
-        all_responses = []
-
-        for attempt in range(retry_limit):
-            print(f"Consensus: Attempt {attempt + 1} to retrieve files from servers.\n")
-            responses = []
-
-            for server in list(remaining_servers):
-                response = server.retrieve_file()
-                if response:
-                    responses.append((server.weight, response)) # Include server weight
-                    remaining_servers.remove(server)
-                else:
-                    retries[server] += 1
-                    if retries[server] >= retry_limit:
-                        print(f"Consensus: Server {server.id} marked as unavailable.\n")
-                        self.unresponsive_servers.add(server)
-                        remaining_servers.remove(server)
-
-            all_responses.extend(responses)
-
-            if not remaining_servers:
-                break
-
-            print(f"Consensus: Waiting {retry_period_ms} ms before retrying.\n")
-            time.sleep(retry_period_ms / 1000.0)
-
-        if not all_responses:
-            print("Consensus: No files retrieved from any server.\n")
-            return None
-
-        # Group files by hash and calculate weights
-        weighted_files = {}
-        for weight, response in all_responses:
-            file_hash = hashlib.sha256(response["content"].encode()).hexdigest()
-            if file_hash not in weighted_files:
-                weighted_files[file_hash] = {"total_weight": 0, "file": response}
-            weighted_files[file_hash]["total_weight"] += weight
-
-        # Apply majority rule based on hash
-        majority_file = None
-        total_servers = len(self.servers) - len(self.unresponsive_servers)
-        for file_hash, data in weighted_files.items():
-            count = sum(1 for _, response in all_responses if hashlib.sha256(response["content"].encode()).hexdigest() == file_hash)
-            if count > total_servers / 2:  # Majority rule
-                majority_file = data["file"]
-                print(f"Consensus: Majority file selected: {majority_file['file_name']} (Hash: {file_hash}).\n")
-                return {
-                    "version": majority_file["version"],
-                    "content": majority_file["content"],
-                    "file_name": majority_file["file_name"],
-                }
-
-        # Fallback to highest weight if no majority
-        most_weighted_file = max(weighted_files.values(), key=lambda x: x["total_weight"])
-        print(f"Consensus: No majority. Falling back to file with highest weight: {most_weighted_file['file']['file_name']}, Total weight: {most_weighted_file['total_weight']}.\n")
-        return {
-            "version": most_weighted_file["file"]["version"],
-            "content": most_weighted_file["file"]["content"],
-            "file_name": most_weighted_file["file"]["file_name"],
-        }
\ No newline at end of file
+import heapq
+import time
+
+import events
+from clock import WallClock
+from events import NULL_SINK
+from metrics import NULL_METRICS
+from quorum import Quorum
+from retry import FixedRetryPolicy
+
+
+def _content_bytes(server):
+    """
+    Return the content bytes a server has received so far: the chunks streamed to a networked server, or for an
+    in-memory server (which shares the File object) the chunks it did not already hold
+    """
+    sent_bytes = getattr(server, "content_bytes_sent", None)
+    return sent_bytes if sent_bytes is not None else server.bytes_received
+
+
+class ConsensusAlgorithm:
+    def __init__(self, servers, clock=None, fanout="sequential", max_workers=None, quorum="all",
+                 event_sink=None, retry_policy=None, metrics=None, read_router=None, placement=None):
+        """
+	Represents the consensus algorithm logic
+	params:
+        servers: a list of Server objects forming the cluster
+        clock: the Clock used for timeouts and retry periods (defaults to the wall clock)
+        fanout: "sequential" visits the servers one at a time, "concurrent" sends the
+                requests to all the servers at once from a thread pool
+        max_workers: size of the thread pool used by the concurrent fan-out (defaults to one per server)
+        quorum: "all", "majority" or "weighted" (see Quorum); with a partial quorum an update commits
+                and a restore returns as soon as the quorum is reached
+        event_sink: optional EventSink receiving the consensus events (discarded by default)
+        retry_policy: optional policy scheduling the retries of each server (e.g. BackoffRetryPolicy);
+                      by default servers are retried after the fixed retry period of each phase
+        metrics: optional Metrics recording the phase timings, RPCs, retries and votes (discarded by default)
+        read_router: optional ReadRouter; the restore then reads only the best-ranked servers able to decide
+                     and more servers on failure or disagreement, instead of every server
+        placement: optional HashRing placing each keyed file on a subset of the servers (see update_files);
+                   by default every server holds every keyed file
+        """
+        if fanout not in ("sequential", "concurrent"):
+            raise ValueError(f"Unknown fan-out mode: {fanout}")
+        self.servers = servers
+        self._positions = {server: position for position, server in enumerate(servers)}
+        self.clock = clock if clock is not None else WallClock()
+        self.fanout = fanout
+        self.max_workers = max_workers
+        self._thread_pool = None
+        self.quorum = Quorum(servers, quorum)
+        self.event_sink = event_sink if event_sink is not None else NULL_SINK
+        self.retry_policy = retry_policy
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.read_router = read_router
+        self.placement = placement
+        self.unresponsive_servers = set()
+        self.unresponsive_files = {}  # Server -> keys of the keyed files it missed, see retry_unresponsive_files
+        self.unavailable_servers = set()
+        self._background_retries = {}  # Server -> time of its scheduled retry, see retry_unresponsive_servers_later
+        self._retry_generation = 0  # Identifies the scheduled retries, so the events of cancelled ones do nothing
+
+    def _emit(self, type, **fields):
+        """
+        Sends an event to the event sink, stamped with the clock time
+        Callers check event_sink.enabled first, so disabled events cost no formatting
+        """
+        self.event_sink.emit(type, "consensus", self.clock.now_ms(), **fields)
+
+    def _executor(self):
+        """
+        Return the thread pool used by the concurrent fan-out, creating it on first use
+        """
+        if self._thread_pool is None:
+            # Imported on first use: the sequential fan-out does not need concurrent.futures
+            from concurrent.futures import ThreadPoolExecutor
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_workers or max(len(self.servers), 1))
+        return self._thread_pool
+
+    def close(self):
+        """
+        Releases the thread pool of the concurrent fan-out
+        """
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=True)
+            self._thread_pool = None
+
+    def _in_cluster_order(self, servers):
+        """
+        Return the given servers as a list, in the order of the cluster
+        Sets of servers iterate in memory-address order, which would make seeded runs irreproducible
+        params:
+        servers: a set of Server objects
+        """
+        return sorted(servers, key=self._positions.__getitem__)
+
+    def _send_update(self, server, file, current_time_ms):
+        """
+        Sends an update to a server, recording the RPC count, latency and bytes when metrics are enabled
+        Return the result of update_file
+        """
+        if not self.metrics.enabled:
+            return server.update_file(file, current_time_ms)
+        self.metrics.incr("update_rpcs")
+        sent_bytes = _content_bytes(server)
+        started = time.perf_counter()
+        try:
+            return server.update_file(file, current_time_ms)
+        finally:
+            self.metrics.observe("update_rpc_ms", (time.perf_counter() - started) * 1000)
+            self.metrics.incr("update_bytes_sent", _content_bytes(server) - sent_bytes)
+
+    def validate_file(self, file):
+        """
+        Validates a file before it is sent to the servers
+	Return True if the file is valid, otherwise False
+	params:
+        file: a File object
+        """
+        is_valid, message = file.is_valid()
+        if not is_valid:
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, version=file.version, reason=message)
+            return False
+        return True
+
+    def update_consensus(self, file, timeout_ms=2, retry_limit=3, retry_period_ms=5):
+        """
+        Handles the update phase with a client-side timeout for ACKs
+        Retries sending updates if ACKs are not received, respecting retry limits and periods
+        Simulates server failures and recovery
+	Return True if consensus was reached (the quorum of servers responded with ACKs), False otherwise
+        Servers still missing when a partial quorum is reached are left to retry_unresponsive_servers (or to
+        retry_unresponsive_servers_later); the background retries of the previous version are cancelled
+	params:
+        file: the file to be updated
+        timeout_ms: maximum time in milliseconds to wait for ACKs
+        retry_limit: Maximum number of retries for unresponsive servers
+        retry_period_ms: Period in milliseconds between retries, used when no retry policy is set
+        """
+        # The round contacts every server again with the newer version
+        self._cancel_background_retries()
+        with self.metrics.span("update_phase", self.clock):
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_STARTED, file_name=file.file_name, version=file.version)
+            # Servers to retry, as a heap of (next attempt time, position in the cluster, server):
+            # each round only touches the servers that are due. Every server is due in the first round,
+            # which takes them in cluster order without going through the heap
+            pending = []
+            due = list(self.servers)
+            retries = dict.fromkeys(self.servers, 0)
+            policy = self.retry_policy or FixedRetryPolicy(retry_period_ms)
+            acks = self.quorum.tally()
+            exhausted = 0  # Pending servers that reached the retry limit
+
+            while due:
+                exhausted -= sum(1 for server in due if retries[server] >= retry_limit)
+                if self.metrics.enabled:
+                    self.metrics.incr("update_rounds")
+                if self.fanout == "concurrent":
+                    retry = self._update_round_concurrent(file, due, acks, retries, timeout_ms, retry_limit)
+                else:
+                    retry = self._update_round_sequential(file, due, acks, retries, timeout_ms, retry_limit)
+
+                current_time_ms = self.clock.now_ms()
+                if acks.reached():
+                    # The phase ends: the servers left are stragglers, never retried here, so no delay is drawn
+                    # and no server is asked for a hint
+                    for server in retry:
+                        heapq.heappush(pending, (current_time_ms, self._positions[server], server))
+                    break
+                for server in retry:
+                    delay_ms = self._retry_delay_ms(policy, retries[server], current_time_ms, server)
+                    heapq.heappush(pending, (current_time_ms + delay_ms, self._positions[server], server))
+                exhausted += sum(1 for server in retry if retries[server] >= retry_limit)
+                if self.metrics.enabled:
+                    self.metrics.incr("update_retries", len(retry))
+
+                if pending:
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_WAIT, phase="update", wait_ms=pending[0][0] - current_time_ms)
+                    self.clock.sleep(pending[0][0] - current_time_ms)
+
+                # Log the current state of retries
+                if self.event_sink.enabled:
+                    self._emit(events.RETRY_STATE, retries={s.id: retries[s] for s in self._pending_servers(pending)})
+
+                # Break if retry limits are exhausted
+                if exhausted == len(pending):
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_STATE, retry_limit_reached=True)
+                    break
+                due = self._pop_due(pending)
+
+            # Return True if all servers have sent ACKs (no server is pending)
+            if not pending:
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_RESULT, version=file.version, success=True, stragglers=[])
+                if self.metrics.enabled:
+                    self.metrics.incr("update_commits")
+                return True
+
+            # Return True if a quorum has sent ACKs, the stragglers are retried later
+            stragglers = self._pending_servers(pending)
+            if acks.reached():
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_RESULT, version=file.version, success=True, quorum=self.quorum.mode,
+                               stragglers=[s.id for s in stragglers])
+                self.unresponsive_servers.update(stragglers)
+                if self.metrics.enabled:
+                    self.metrics.incr("update_commits")
+                    self.metrics.observe("update_stragglers", len(stragglers))
+                return True
+
+            # Return False if some servers are still unresponsive
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_RESULT, version=file.version, success=False,
+                           stragglers=[s.id for s in stragglers])
+            if self.metrics.enabled:
+                self.metrics.incr("update_failed_commits")
+            return False
+
+    def update_batch(self, files, timeout_ms=2, retry_limit=3, retry_period_ms=5):
+        """
+        Commits several pending versions of the file in one update round
+        Servers only accept versions newer than the one they hold, so only the newest version is sent
+	Return the result of update_consensus for the newest version
+	params:
+        files: the pending File objects
+        timeout_ms: maximum time in milliseconds to wait for ACKs
+        retry_limit: Maximum number of retries for unresponsive servers
+        retry_period_ms: Period in milliseconds between retries, used when no retry policy is set
+        """
+        newest = max(files, key=lambda file: file.version)
+        if self.event_sink.enabled:
+            self._emit(events.UPDATE_BATCH, versions=[file.version for file in files], sent=newest.version)
+        return self.update_consensus(newest, timeout_ms, retry_limit, retry_period_ms)
+
+    def replicas(self, key=None):
+        """
+        Return the servers holding a keyed file, in the order of the cluster (every server without placement)
+        params:
+        key: the file key, None for the single file
+        """
+        if key is None or self.placement is None:
+            return self.servers
+        return self.placement.replicas(key)
+
+    def _quorum_of(self, servers):
+        """
+        Return the quorum of a replica set, with the quorum mode of the cluster
+        """
+        return self.quorum if servers is self.servers else Quorum(servers, self.quorum.mode)
+
+    def update_files(self, files, timeout_ms=2, retry_limit=3, retry_period_ms=5):
+        """
+        Commits new versions of several keyed files together
+        Each round sends every due server the files it still misses in a single round trip
+        (Server.update_files), so the files share the round trips instead of running one update phase each.
+        A file commits once a quorum of its replicas applied it; a server that failed is retried on the
+        retry policy with the files it still misses, up to retry_limit times
+        Replicas still missing a file at the end of the phase are moved to unresponsive_files, so that
+        retry_unresponsive_files brings them up to date
+        Return a dictionary file key -> True if the file was committed
+        params:
+        files: dictionary file key -> File, the newest version of each file
+        timeout_ms: maximum time in milliseconds to wait for a round trip with the concurrent fan-out
+        retry_limit: Maximum number of retries of a server
+        retry_period_ms: Period in milliseconds between retries, used when no retry policy is set
+        """
+        with self.metrics.span("update_phase", self.clock):
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_STARTED, files={key: file.version for key, file in files.items()})
+            tallies = {}
+            owed = {}  # Server -> keys of the files it has not applied yet
+            for key in files:
+                replicas = self.replicas(key)
+                tallies[key] = self._quorum_of(replicas).tally()
+                for server in replicas:
+                    owed.setdefault(server, []).append(key)
+            pending = []
+            due = self._in_cluster_order(owed)
+            retries = dict.fromkeys(owed, 0)
+            policy = self.retry_policy or FixedRetryPolicy(retry_period_ms)
+
+            while due:
+                if self.metrics.enabled:
+                    self.metrics.incr("update_rounds")
+                retry = self._keyed_update_round(files, due, owed, tallies, retries, timeout_ms)
+
+                if all(tally.reached() for tally in tallies.values()):
+                    break  # The servers still owing files are stragglers, no retry is scheduled for them
+                current_time_ms = self.clock.now_ms()
+                retry = [server for server in retry if retries[server] < retry_limit]
+                for server in retry:
+                    delay_ms = self._retry_delay_ms(policy, retries[server], current_time_ms, server)
+                    heapq.heappush(pending, (current_time_ms + delay_ms, self._positions[server], server))
+                if self.metrics.enabled:
+                    self.metrics.incr("update_retries", len(retry))
+
+                if pending:
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_WAIT, phase="update", wait_ms=pending[0][0] - current_time_ms)
+                    self.clock.sleep(pending[0][0] - current_time_ms)
+                due = self._pop_due(pending)
+
+            committed = {}
+            for key, file in files.items():
+                committed[key] = tallies[key].reached()
+                stragglers = [server for server in self.replicas(key) if key in owed[server]]
+                for server in stragglers:
+                    missed = self.unresponsive_files.setdefault(server, [])
+                    if key not in missed:
+                        missed.append(key)
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_RESULT, key=key, version=file.version, success=committed[key],
+                               stragglers=[s.id for s in stragglers])
+                if self.metrics.enabled:
+                    self.metrics.incr("update_commits" if committed[key] else "update_failed_commits")
+                    if committed[key]:
+                        self.metrics.observe("update_stragglers", len(stragglers))
+            return committed
+
+    def _keyed_update_round(self, files, due, owed, tallies, retries, timeout_ms):
+        """
+        Sends each due server the files it misses and whose quorum is not reached yet, in one round trip
+        The round trips are made one at a time or all at once depending on the fan-out mode
+        Return the servers that still miss some of the files they were sent
+        params:
+        files: dictionary file key -> File
+        due: list of servers to contact in this round
+        owed: dictionary server -> keys of the files it has not applied yet, updated in place
+        tallies: dictionary file key -> QuorumTally of its replicas that applied it, updated in place
+        retries: dictionary of retries per server, updated in place
+        timeout_ms: maximum time in milliseconds to wait for a round trip with the concurrent fan-out
+        """
+        batches = []
+        for server in due:
+            owed[server] = [key for key in owed[server] if not tallies[key].reached()]
+            if owed[server]:
+                batches.append((server, {key: files[key] for key in owed[server]}))
+        if not batches:
+            return []
+
+        current_time_ms = self.clock.now_ms()
+        if self.event_sink.enabled:
+            for server, batch in batches:
+                self._emit(events.UPDATE_SENT, server=server.id, files={key: f.version for key, f in batch.items()})
+        if self.fanout == "concurrent":
+            futures = [self._executor().submit(server.update_files, batch, current_time_ms)
+                       for server, batch in batches]
+            from concurrent.futures import wait
+            wait(futures, timeout=timeout_ms / 1000.0 if self.clock.realtime else None)
+        else:
+            futures = None
+
+        retry = []
+        for index, (server, batch) in enumerate(batches):
+            if self.metrics.enabled:
+                self.metrics.incr("update_round_trips")
+                self.metrics.observe("update_round_trip_files", len(batch))
+            try:
+                if futures is None:
+                    applied = server.update_files(batch, self.clock.now_ms())
+                elif futures[index].done():
+                    applied = futures[index].result()
+                else:
+                    if self.event_sink.enabled:
+                        self._emit(events.TIMEOUT, server=server.id, waiting_for="update")
+                    if self.metrics.enabled:
+                        self.metrics.incr("update_timeouts")
+                    applied = []
+            except Exception as e:
+                if self.event_sink.enabled:
+                    self._emit(events.ERROR, server=server.id, error=str(e))
+                if self.metrics.enabled:
+                    self.metrics.incr("rpc_errors")
+                applied = []
+
+            for key in applied:
+                tallies[key].add(server)
+            if applied:
+                if self.event_sink.enabled:
+                    self._emit(events.ACK, server=server.id, files={key: batch[key].version for key in applied})
+                if self.metrics.enabled:
+                    self.metrics.incr("acks", len(applied))
+            applied = set(applied)
+            missed = self.unresponsive_files.get(server)
+            if missed and applied:
+                # Files missed in an earlier phase and sent again with a newer version are up to date
+                missed[:] = [key for key in missed if key not in applied]
+                if not missed:
+                    del self.unresponsive_files[server]
+            missing = [key for key in batch if key not in applied]
+            owed[server] = missing
+            if missing:
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_FAILED, server=server.id, keys=missing)
+                if self.metrics.enabled:
+                    self.metrics.incr("update_rejected", len(missing))
+                retries[server] += 1
+                retry.append(server)
+        return retry
+
+    def _retry_delay_ms(self, policy, attempt, current_time_ms, server):
+        """
+        Return the time to wait before the next attempt on a server
+        The server is asked for its recovery hint only if the policy uses hints; a server that cannot be
+        asked (e.g. its process is gone) gives no hint
+        params:
+        policy: the retry policy
+        attempt: number of failed attempts so far
+        current_time_ms: the current clock time
+        server: the server to retry
+        """
+        hint_ms = None
+        if getattr(policy, "use_hints", True):
+            try:
+                hint_ms = server.retry_hint_ms()
+            except Exception as e:
+                if self.event_sink.enabled:
+                    self._emit(events.ERROR, server=server.id, error=str(e))
+                if self.metrics.enabled:
+                    self.metrics.incr("rpc_errors")
+        return policy.delay_ms(attempt, current_time_ms, hint_ms)
+
+    def _pop_due(self, pending):
+        """
+        Removes from the heap the servers whose next attempt time has come
+        Return them ordered by attempt time, then by position in the cluster
+        params:
+        pending: heap of (next attempt time, position, server)
+        """
+        current_time_ms = self.clock.now_ms()
+        due = []
+        while pending and pending[0][0] <= current_time_ms:
+            due.append(heapq.heappop(pending)[2])
+        return due
+
+    @staticmethod
+    def _pending_servers(pending):
+        """
+        Return the servers of a pending heap in the order of the cluster
+        params:
+        pending: heap of (next attempt time, position, server)
+        """
+        return [server for _, _, server in sorted(pending, key=lambda entry: entry[1])]
+
+    def _update_round_sequential(self, file, due, acks, retries, timeout_ms, retry_limit):
+        """
+        Sends the update to the due servers one at a time, waiting for each ACK
+        The round lasts the sum of the per-server latencies, and stops early once the quorum is reached
+	Return the servers to retry in the next round
+        params:
+        file: the file to be updated
+        due: list of servers to contact in this round
+        acks: QuorumTally of the servers that sent an ACK, updated in place
+        retries: dictionary of retries per server, updated in place
+        timeout_ms: maximum time in milliseconds to wait for each ACK
+        retry_limit: Maximum number of retries for unresponsive servers
+        """
+        retry = []
+        for index, server in enumerate(due):
+            try:
+                if retries[server] >= retry_limit:
+                    if self.event_sink.enabled:
+                        self._emit(events.UNRESPONSIVE, server=server.id, phase="update")
+                    if self.metrics.enabled:
+                        self.metrics.incr("unresponsive_servers")
+                    self.unresponsive_servers.add(server)
+                    continue
+
+                # Send the update to the server
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_SENT, server=server.id, version=file.version)
+                update_applied = self._send_update(server, file, self.clock.now_ms())
+                if not update_applied:
+                    if self.event_sink.enabled:
+                        self._emit(events.UPDATE_FAILED, server=server.id, version=file.version)
+                    if self.metrics.enabled:
+                        self.metrics.incr("update_rejected")
+                    retries[server] += 1
+                    retry.append(server)
+                    continue
+                deadline_ms = self.clock.now_ms() + timeout_ms
+
+                # Wait for ACK
+                while self.clock.now_ms() < deadline_ms:
+                    ack = server.send_ack()
+                    if ack:
+                        if self.event_sink.enabled:
+                            self._emit(events.ACK, server=server.id, version=file.version)
+                        if self.metrics.enabled:
+                            self.metrics.incr("acks")
+                        acks.add(server)
+                        break
+                    self.clock.sleep(1)
+                else:
+                    if self.event_sink.enabled:
+                        self._emit(events.TIMEOUT, server=server.id, version=file.version, waiting_for="ack")
+                    if self.metrics.enabled:
+                        self.metrics.incr("update_timeouts")
+                    retries[server] += 1
+                    retry.append(server)
+            except Exception as e:
+                if self.event_sink.enabled:
+                    self._emit(events.ERROR, server=server.id, error=str(e))
+                if self.metrics.enabled:
+                    self.metrics.incr("rpc_errors")
+                retries[server] += 1
+                retry.append(server)
+
+            if acks.count and acks.reached():
+                retry.extend(due[index + 1:])
+                break
+        return retry
+
+    def _update_round_concurrent(self, file, due, acks, retries, timeout_ms, retry_limit):
+        """
+        Sends the update to all the due servers at once and gathers the ACKs as they arrive
+        Each server has its own ACK deadline, so the round lasts about one slowest-server timeout
+        Stops gathering as soon as the quorum is reached
+	Return the servers to retry in the next round
+        params:
+        file: the file to be updated
+        due: list of servers to contact in this round
+        acks: QuorumTally of the servers that sent an ACK, updated in place
+        retries: dictionary of retries per server, updated in place
+        timeout_ms: maximum time in milliseconds to wait for each ACK
+        retry_limit: Maximum number of retries for unresponsive servers
+        """
+        targets = []
+        for server in due:
+            if retries[server] >= retry_limit:
+                if self.event_sink.enabled:
+                    self._emit(events.UNRESPONSIVE, server=server.id, phase="update")
+                if self.metrics.enabled:
+                    self.metrics.incr("unresponsive_servers")
+                self.unresponsive_servers.add(server)
+            else:
+                targets.append(server)
+        if not targets:
+            return []
+
+        # Send the update to every server
+        current_time_ms = self.clock.now_ms()
+        if self.event_sink.enabled:
+            for server in targets:
+                self._emit(events.UPDATE_SENT, server=server.id, version=file.version)
+        futures = [self._executor().submit(self._send_update, server, file, current_time_ms) for server in targets]
+        from concurrent.futures import wait
+        wait(futures, timeout=timeout_ms / 1000.0 if self.clock.realtime else None)
+
+        retry = []
+        ack_deadlines = {}
+        for server, future in zip(targets, futures):
+            if not future.done():
+                if self.event_sink.enabled:
+                    self._emit(events.TIMEOUT, server=server.id, version=file.version, waiting_for="update")
+                if self.metrics.enabled:
+                    self.metrics.incr("update_timeouts")
+                retries[server] += 1
+                retry.append(server)
+                continue
+            try:
+                update_applied = future.result()
+            except Exception as e:
+                if self.event_sink.enabled:
+                    self._emit(events.ERROR, server=server.id, error=str(e))
+                if self.metrics.enabled:
+                    self.metrics.incr("rpc_errors")
+                retries[server] += 1
+                retry.append(server)
+                continue
+            if not update_applied:
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_FAILED, server=server.id, version=file.version)
+                if self.metrics.enabled:
+                    self.metrics.incr("update_rejected")
+                retries[server] += 1
+                retry.append(server)
+                continue
+            ack_deadlines[server] = self.clock.now_ms() + timeout_ms
+
+        # Gather the ACKs as they arrive
+        while ack_deadlines:
+            for server in list(ack_deadlines):
+                try:
+                    ack = server.send_ack()
+                except Exception as e:
+                    if self.event_sink.enabled:
+                        self._emit(events.ERROR, server=server.id, error=str(e))
+                    if self.metrics.enabled:
+                        self.metrics.incr("rpc_errors")
+                    ack = None
+                if ack:
+                    if self.event_sink.enabled:
+                        self._emit(events.ACK, server=server.id, version=file.version)
+                    if self.metrics.enabled:
+                        self.metrics.incr("acks")
+                    acks.add(server)
+                    del ack_deadlines[server]
+                elif self.clock.now_ms() >= ack_deadlines[server]:
+                    if self.event_sink.enabled:
+                        self._emit(events.TIMEOUT, server=server.id, version=file.version, waiting_for="ack")
+                    if self.metrics.enabled:
+                        self.metrics.incr("update_timeouts")
+                    retries[server] += 1
+                    retry.append(server)
+                    del ack_deadlines[server]
+            if ack_deadlines and not acks.reached():
+                self.clock.sleep(1)
+            else:
+                break
+
+        # Servers still expected to ACK when the quorum was reached stay pending
+        retry.extend(ack_deadlines)
+        return retry
+
+    def _probe_round(self, servers, version=None, key=None):
+        """
+        Asks the given servers for the metadata of their file (version, hash, name, size), one at a time or
+        all at once depending on the fan-out mode
+        Return an iterator of (server, response) pairs in the order of the given servers; with the sequential
+        fan-out a server is only read when its pair is reached, so a caller that stops early skips the rest
+        params:
+        servers: list of Server objects to query
+        version: optional version to describe instead of the current one
+        key: optional key of the keyed file to describe
+        """
+        if self.fanout == "concurrent":
+            return zip(servers, self._executor().map(lambda server: server.probe_file(version, key), servers))
+        return ((server, server.probe_file(version, key)) for server in servers)
+
+    def retry_unresponsive_servers(self, file, long_retry_limit=5, retry_interval=0.02):
+        """
+        Periodically retries to update temporarily unavailable servers
+        Each server is retried when the retry policy schedules it, up to long_retry_limit attempts
+	params:
+        file: The file to be updated
+        long_retry_limit: Maximum number of retries for unresponsive servers
+        retry_interval: Time in seconds between retries, used when no retry policy is set
+        """
+        with self.metrics.span("retry_phase", self.clock):
+            policy = self.retry_policy or FixedRetryPolicy(retry_interval * 1000)
+            pending = []  # Heap of the servers to retry, the first round takes every unresponsive server
+            due = self._in_cluster_order(self.unresponsive_servers)
+            attempts = {}
+            round_number = 0
+
+            while due:
+                round_number += 1
+                if self.event_sink.enabled:
+                    self._emit(events.RETRY_STATE, phase="long retry", attempt=round_number,
+                               servers=[s.id for s in due])
+                current_time_ms = self.clock.now_ms()
+                for server in due:
+                    try:
+                        if self.event_sink.enabled:
+                            self._emit(events.UPDATE_SENT, server=server.id, version=file.version)
+                        update_applied = self._send_update(server, file, current_time_ms)
+                        if update_applied and server.send_ack():
+                            self.unresponsive_servers.remove(server)
+                            if self.event_sink.enabled:
+                                self._emit(events.ACK, server=server.id, version=file.version)
+                            if self.metrics.enabled:
+                                self.metrics.incr("acks")
+                                self.metrics.incr("retry_recovered")
+                            continue
+                    except Exception as e:
+                        if self.event_sink.enabled:
+                            self._emit(events.ERROR, server=server.id, error=str(e))
+                        if self.metrics.enabled:
+                            self.metrics.incr("rpc_errors")
+
+                    attempts[server] = attempts.get(server, 0) + 1
+                    if attempts[server] < long_retry_limit:
+                        delay_ms = self._retry_delay_ms(policy, attempts[server], current_time_ms, server)
+                        heapq.heappush(pending, (current_time_ms + delay_ms, self._positions[server], server))
+
+                if pending:
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_WAIT, phase="long retry", wait_ms=pending[0][0] - current_time_ms)
+                    self.clock.sleep(pending[0][0] - self.clock.now_ms())
+                due = self._pop_due(pending)
+
+            if self.unresponsive_servers:
+                if self.event_sink.enabled:
+                    for server in self._in_cluster_order(self.unresponsive_servers):
+                        self._emit(events.UNAVAILABLE, server=server.id)
+                if self.metrics.enabled:
+                    self.metrics.incr("unavailable_servers", len(self.unresponsive_servers))
+                self.unavailable_servers.update(self.unresponsive_servers)
+                self.unresponsive_servers.clear()
+
+    def retry_unresponsive_servers_later(self, file, long_retry_limit=5, retry_interval=0.02):
+        """
+        Schedules the retries of retry_unresponsive_servers as events on the clock instead of waiting for them
+        The caller returns at once; each unresponsive server is retried by an event when the retry policy
+        schedules it, so the retries run while the client waits on the clock. The next update round cancels
+        the retries still scheduled, and wait_for_background_retries waits for them before a restore
+        params:
+        file: The file to be updated
+        long_retry_limit: Maximum number of retries for unresponsive servers
+        retry_interval: Time in seconds between retries, used when no retry policy is set
+        """
+        policy = self.retry_policy or FixedRetryPolicy(retry_interval * 1000)
+        current_time_ms = self.clock.now_ms()
+        for server in self._in_cluster_order(self.unresponsive_servers):
+            if server not in self._background_retries:
+                self._schedule_retry(server, file, 1, current_time_ms, long_retry_limit, policy)
+
+    def _schedule_retry(self, server, file, attempt, time_ms, long_retry_limit, policy):
+        self._background_retries[server] = time_ms
+        self.clock.call_at(time_ms, self._background_retry, server, file, attempt, long_retry_limit, policy,
+                           self._retry_generation)
+
+    def _background_retry(self, server, file, attempt, long_retry_limit, policy, generation):
+        """
+        Clock event sending one retry of the update to an unresponsive server
+        A failed attempt schedules the next one; after long_retry_limit attempts the server is unavailable
+        """
+        if generation != self._retry_generation or server not in self._background_retries:
+            return
+        del self._background_retries[server]
+        current_time_ms = self.clock.now_ms()
+        try:
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_SENT, server=server.id, version=file.version)
+            update_applied = self._send_update(server, file, current_time_ms)
+            if update_applied and server.send_ack():
+                self.unresponsive_servers.discard(server)
+                if self.event_sink.enabled:
+                    self._emit(events.ACK, server=server.id, version=file.version)
+                if self.metrics.enabled:
+                    self.metrics.incr("acks")
+                    self.metrics.incr("retry_recovered")
+                return
+        except Exception as e:
+            if self.event_sink.enabled:
+                self._emit(events.ERROR, server=server.id, error=str(e))
+            if self.metrics.enabled:
+                self.metrics.incr("rpc_errors")
+
+        if attempt < long_retry_limit:
+            delay_ms = self._retry_delay_ms(policy, attempt, current_time_ms, server)
+            self._schedule_retry(server, file, attempt + 1, current_time_ms + delay_ms, long_retry_limit, policy)
+            return
+        self.unresponsive_servers.discard(server)
+        self.unavailable_servers.add(server)
+        if self.event_sink.enabled:
+            self._emit(events.UNAVAILABLE, server=server.id)
+        if self.metrics.enabled:
+            self.metrics.incr("unavailable_servers")
+
+    def wait_for_background_retries(self):
+        """
+        Waits on the clock until every retry scheduled by retry_unresponsive_servers_later has finished
+        """
+        while self._background_retries:
+            self.clock.sleep(min(self._background_retries.values()) - self.clock.now_ms())
+
+    def _cancel_background_retries(self):
+        """
+        Drops the scheduled retries; their servers are no longer counted as unresponsive, the caller contacts them
+        """
+        if self._background_retries:
+            self.unresponsive_servers.difference_update(self._background_retries)
+            self._background_retries.clear()
+            self._retry_generation += 1
+
+    def retry_unresponsive_files(self, files, long_retry_limit=5, retry_interval=0.02):
+        """
+        Periodically retries to send the keyed files missed by the servers of unresponsive_files
+        Each server receives all the files it misses in one round trip per attempt, when the retry policy
+        schedules it, up to long_retry_limit attempts; servers still missing files are then unavailable
+        params:
+        files: dictionary file key -> File, the newest version of each file (e.g. Client.files)
+        long_retry_limit: Maximum number of retries for each server
+        retry_interval: Time in seconds between retries, used when no retry policy is set
+        """
+        with self.metrics.span("retry_phase", self.clock):
+            policy = self.retry_policy or FixedRetryPolicy(retry_interval * 1000)
+            pending = []  # Heap of the servers to retry, the first round takes every server missing files
+            due = self._in_cluster_order(self.unresponsive_files)
+            attempts = {}
+
+            while due:
+                current_time_ms = self.clock.now_ms()
+                for server in due:
+                    batch = {key: files[key] for key in self.unresponsive_files[server] if key in files}
+                    if self.event_sink.enabled:
+                        self._emit(events.UPDATE_SENT, server=server.id,
+                                   files={key: file.version for key, file in batch.items()})
+                    if self.metrics.enabled:
+                        self.metrics.incr("update_round_trips")
+                    try:
+                        applied = set(server.update_files(batch, current_time_ms)) if batch else set()
+                    except Exception as e:
+                        if self.event_sink.enabled:
+                            self._emit(events.ERROR, server=server.id, error=str(e))
+                        if self.metrics.enabled:
+                            self.metrics.incr("rpc_errors")
+                        applied = set()
+                    missing = [key for key in batch if key not in applied]
+                    if applied:
+                        if self.event_sink.enabled:
+                            self._emit(events.ACK, server=server.id,
+                                       files={key: batch[key].version for key in batch if key in applied})
+                        if self.metrics.enabled:
+                            self.metrics.incr("acks", len(applied))
+                    if not missing:
+                        del self.unresponsive_files[server]
+                        if self.metrics.enabled:
+                            self.metrics.incr("retry_recovered")
+                        continue
+                    self.unresponsive_files[server] = missing
+
+                    attempts[server] = attempts.get(server, 0) + 1
+                    if attempts[server] < long_retry_limit:
+                        delay_ms = self._retry_delay_ms(policy, attempts[server], current_time_ms, server)
+                        heapq.heappush(pending, (current_time_ms + delay_ms, self._positions[server], server))
+
+                if pending:
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_WAIT, phase="long retry", wait_ms=pending[0][0] - current_time_ms)
+                    self.clock.sleep(pending[0][0] - self.clock.now_ms())
+                due = self._pop_due(pending)
+
+            if self.unresponsive_files:
+                if self.event_sink.enabled:
+                    for server in self._in_cluster_order(self.unresponsive_files):
+                        self._emit(events.UNAVAILABLE, server=server.id, keys=self.unresponsive_files[server])
+                if self.metrics.enabled:
+                    self.metrics.incr("unavailable_servers", len(self.unresponsive_files))
+                self.unavailable_servers.update(self.unresponsive_files)
+                self.unresponsive_files.clear()
+
+    def restore_consensus(self, retry_limit=2, retry_period_ms=5, version=None, fetch_retry_limit=5, key=None):
+        """
+        Handles the restore phase with majority rule and weighted fallback
+        The servers first vote with the metadata of their file (version and hash, see Server.probe_file);
+        the content is then fetched once, from one server of the winning hash group
+        With a partial quorum, returns as soon as one file is held by a quorum of servers
+	Return the file with the highest weight or consensus result
+	params:
+        retry_limit: Maximum number of retries if consensus is not reached
+        retry_period_ms: Time in milliseconds between retries
+        version: optional recent version to restore instead of the current one
+        fetch_retry_limit: Maximum number of passes over the winning group to fetch the content; these servers
+                           just answered, so a failed fetch is retried on its own budget
+        key: optional key of a keyed file (see update_files) to restore; only its replicas are read
+        """
+        servers = self.replicas(key)
+        quorum = self._quorum_of(servers)
+        # Servers left out of the majority rule: for a keyed file, the servers known to miss it and those whose
+        # reads of it failed, so a failed read of one file does not lower the majority threshold of the others
+        if key is None:
+            unresponsive = self.unresponsive_servers
+        else:
+            unresponsive = {server for server, keys in self.unresponsive_files.items() if key in keys}
+        with self.metrics.span("restore_phase", self.clock):
+            if self.event_sink.enabled:
+                if key is None:
+                    self._emit(events.RESTORE_STARTED, quorum=quorum.mode)
+                else:
+                    self._emit(events.RESTORE_STARTED, quorum=quorum.mode, key=key)
+            if self.read_router is not None:
+                return self._routed_restore(retry_limit, retry_period_ms, version, fetch_retry_limit, servers, quorum,
+                                            unresponsive, key)
+
+            remaining_servers = set(servers)
+            retries = {server: 0 for server in remaining_servers}
+            weighted_files = {}  # Files grouped by hash, with their count, total weight and servers
+
+            for attempt in range(retry_limit):
+                if self.event_sink.enabled:
+                    self._emit(events.RESTORE_ATTEMPT, attempt=attempt + 1)
+                if self.metrics.enabled:
+                    self.metrics.incr("restore_attempts")
+
+                for server, response in self._probe_round(self._in_cluster_order(remaining_servers), version, key):
+                    if self.metrics.enabled:
+                        self.metrics.incr("restore_reads")
+                    if response:
+                        remaining_servers.remove(server)
+                        group = self._add_vote(weighted_files, server, response)
+                        # Stop as soon as a quorum agrees on one file, whichever round it happens in
+                        if self._quorum_reached(group, quorum):
+                            return self._fetch_content(group, fetch_retry_limit, retry_period_ms, key)
+                    elif not self._read_failed(server, retries, retry_limit, unresponsive):
+                        remaining_servers.remove(server)
+
+                if not remaining_servers:
+                    break
+
+                if self.event_sink.enabled:
+                    self._emit(events.RETRY_WAIT, phase="restore", wait_ms=retry_period_ms)
+                self.clock.sleep(retry_period_ms)
+
+            with self.metrics.span("restore_tally"):
+                winner = self._tally_votes(weighted_files, servers, unresponsive)
+            if winner is None:
+                return None
+            return self._fetch_content(winner, fetch_retry_limit, retry_period_ms, key)
+
+    def _add_vote(self, weighted_files, server, response):
+        """
+        Adds the answer of a server to its hash group
+        Return the hash group
+        params:
+        weighted_files: the responses grouped by hash, with their count, total weight and servers
+        server: the Server that answered
+        response: the metadata returned by Server.probe_file
+        """
+        file_hash = response["hash"]  # Digest computed by the server when the file was stored
+        if file_hash not in weighted_files:
+            weighted_files[file_hash] = {"total_weight": 0, "count": 0, "file": response, "servers": []}
+        weighted_files[file_hash]["total_weight"] += server.weight
+        weighted_files[file_hash]["count"] += 1
+        weighted_files[file_hash]["servers"].append(server)
+        if self.event_sink.enabled:
+            self._emit(events.RESTORE_VOTE, server=server.id, version=response["version"],
+                       hash=file_hash, weight=server.weight)
+        if self.metrics.enabled:
+            self.metrics.incr("restore_votes")
+        return weighted_files[file_hash]
+
+    def _quorum_reached(self, group, quorum):
+        """
+        Return True if a hash group is held by a partial quorum ("majority" or "weighted") of the servers
+        The group then wins the restore: a quorum cannot be outvoted by the servers that did not answer, and
+        only one group can hold it. The result is recorded as the "<mode> quorum" rule
+        params:
+        group: a hash group, with its count and total weight
+        quorum: the Quorum of the servers read
+        """
+        if quorum.mode == "all" or not quorum.reached(group["count"], group["total_weight"]):
+            return False
+        if self.event_sink.enabled:
+            self._emit(events.RESTORE_RESULT, rule=f"{quorum.mode} quorum", version=group["file"]["version"],
+                       hash=group["file"]["hash"])
+        if self.metrics.enabled:
+            self.metrics.incr("restore_rule_quorum")
+        return True
+
+    def _read_failed(self, server, retries, retry_limit, unresponsive):
+        """
+        Counts a failed restore read of a server
+        Return True if the server may be read again, False once it is marked unresponsive
+        params:
+        server: the Server whose read failed
+        retries: dictionary server -> number of failed reads, updated in place
+        retry_limit: Maximum number of reads of a server
+        unresponsive: the set of unresponsive servers of the restore, updated in place
+        """
+        if self.metrics.enabled:
+            self.metrics.incr("restore_read_failures")
+        retries[server] = retries.get(server, 0) + 1
+        if retries[server] < retry_limit:
+            return True
+        if self.event_sink.enabled:
+            self._emit(events.UNRESPONSIVE, server=server.id, phase="restore")
+        if self.metrics.enabled:
+            self.metrics.incr("unresponsive_servers")
+        unresponsive.add(server)
+        return False
+
+    def _decisive(self, count, weight, quorum):
+        """
+        Return True if a hash group wins the restore whatever the servers not read yet answer, by the rules of
+        the full restore: with a partial quorum the group holds the quorum (see _quorum_reached); with the
+        "all" quorum it holds more than half of the servers, so the majority rule of _tally_votes picks it
+        params:
+        count: number of servers of the group
+        weight: total weight of the servers of the group
+        quorum: the Quorum of the servers read
+        """
+        if quorum.mode != "all":
+            return quorum.reached(count, weight)
+        return count > quorum.cluster_size / 2
+
+    def _read_expansion(self, ranked, start, weighted_files, waiting, quorum):
+        """
+        Return the next servers of the ranking to read: as few as needed for the leading hash group to become
+        decisive if every one of them, and every server waiting for a retry, agreed with it
+        params:
+        ranked: the servers of the cluster, best first
+        start: number of servers of the ranking already read
+        weighted_files: the responses grouped by hash
+        waiting: servers that failed a read and will be read again
+        quorum: the Quorum of the servers read
+        """
+        weighted = quorum.mode == "weighted"
+        measure = (lambda server: server.weight) if weighted else (lambda server: 1)
+        leader = max((data["total_weight"] if weighted else data["count"] for data in weighted_files.values()),
+                     default=0)
+        reachable = leader + sum(measure(server) for server in waiting)
+        end = start
+        # reachable is a weight with the weighted quorum, a number of servers otherwise
+        while end < len(ranked) and not self._decisive(reachable, reachable, quorum):
+            reachable += measure(ranked[end])
+            end += 1
+        return ranked[start:end]
+
+    def _timed_probe_round(self, servers, version=None, key=None):
+        """
+        Same as _probe_round, with the duration of each read on the clock
+        Return a list of (server, response, latency_ms) tuples in the order of the given servers
+        """
+        def probe(server):
+            start_ms = self.clock.now_ms()
+            response = server.probe_file(version, key)
+            return response, self.clock.now_ms() - start_ms
+
+        if self.fanout == "concurrent":
+            results = self._executor().map(probe, servers)
+        else:
+            results = map(probe, servers)
+        return [(server, response, latency_ms) for server, (response, latency_ms) in zip(servers, results)]
+
+    def _routed_restore(self, retry_limit, retry_period_ms, version, fetch_retry_limit, servers, quorum, unresponsive,
+                        key=None):
+        """
+        Restore rounds driven by the read router: the best-ranked servers that could form a decisive hash
+        group are read first; a failed read or a disagreement reads the next servers of the ranking, and a
+        server whose read failed is read again after retry_period_ms, up to retry_limit reads
+        When every server has been read and no group is decisive, the votes are tallied as in a full read
+        Return the restored file, or None
+        params:
+        servers: the servers holding the file
+        quorum: the Quorum of these servers
+        unresponsive: the set of unresponsive servers of the restore (see restore_consensus)
+        key: optional key of the keyed file to restore
+        """
+        router = self.read_router
+        ranked = router.rank(servers, avoid=unresponsive | self.unavailable_servers)
+        weighted_files = {}
+        retries = {}
+        waiting = []  # Servers whose read failed, read again after the retry period
+        due = self._read_expansion(ranked, 0, weighted_files, waiting, quorum)
+        servers_read = len(due)
+        attempt = 0
+
+        while due:
+            attempt += 1
+            if self.event_sink.enabled:
+                self._emit(events.RESTORE_ATTEMPT, attempt=attempt, servers=[s.id for s in due])
+            if self.metrics.enabled:
+                self.metrics.incr("restore_attempts")
+                self.metrics.incr("restore_reads", len(due))
+
+            for server, response, latency_ms in self._timed_probe_round(due, version, key):
+                router.record(server, bool(response), latency_ms)
+                if response:
+                    self._add_vote(weighted_files, server, response)
+                elif self._read_failed(server, retries, retry_limit, unresponsive):
+                    waiting.append(server)
+
+            for file_hash, data in weighted_files.items():
+                if self._decisive(data["count"], data["total_weight"], quorum):
+                    if self.event_sink.enabled:
+                        self._emit(events.RESTORE_RESULT, rule="routed read", version=data["file"]["version"],
+                                   hash=file_hash)
+                    if self.metrics.enabled:
+                        self.metrics.incr("restore_rule_routed")
+                        self.metrics.observe("restore_servers_read", servers_read)
+                    return self._fetch_content(data, fetch_retry_limit, retry_period_ms, key)
+
+            # Read more servers right away if the leading group cannot become decisive otherwise,
+            # then the servers waiting for a retry
+            due = self._read_expansion(ranked, servers_read, weighted_files, waiting, quorum)
+            servers_read += len(due)
+            if due:
+                if self.metrics.enabled:
+                    self.metrics.incr("restore_read_expansions")
+            elif waiting:
+                if self.event_sink.enabled:
+                    self._emit(events.RETRY_WAIT, phase="restore", wait_ms=retry_period_ms)
+                self.clock.sleep(retry_period_ms)
+                due, waiting = self._in_cluster_order(waiting), []
+
+        if self.metrics.enabled:
+            self.metrics.observe("restore_servers_read", servers_read)
+        with self.metrics.span("restore_tally"):
+            winner = self._tally_votes(weighted_files, servers, unresponsive)
+        if winner is None:
+            return None
+        return self._fetch_content(winner, fetch_retry_limit, retry_period_ms, key)
+
+    def _tally_votes(self, weighted_files, servers, unresponsive):
+        """
+        Decides the restored file once the restore rounds are over: majority rule, then weighted fallback
+        With a partial quorum, a group held by the quorum has already won (see _quorum_reached)
+        Return the winning hash group, or None if no server answered
+        params:
+        weighted_files: the responses grouped by hash, with their count and total weight
+        servers: the servers holding the file
+        unresponsive: the servers left out of the majority rule (see restore_consensus)
+        """
+        if self.metrics.enabled:
+            self.metrics.observe("restore_hash_groups", len(weighted_files))
+        if not weighted_files:
+            if self.event_sink.enabled:
+                self._emit(events.RESTORE_RESULT, rule=None, version=None)
+            if self.metrics.enabled:
+                self.metrics.incr("restore_rule_none")
+            return None
+
+        # Apply majority rule based on hash
+        majority_file = None
+        total_servers = len(servers) - len(unresponsive.intersection(servers))
+        for file_hash, data in weighted_files.items():
+            if data["count"] > total_servers / 2:  # Majority rule
+                majority_file = data["file"]
+                if self.event_sink.enabled:
+                    self._emit(events.RESTORE_RESULT, rule="majority", version=majority_file["version"], hash=file_hash)
+                if self.metrics.enabled:
+                    self.metrics.incr("restore_rule_majority")
+                return data
+
+        # Fallback to highest weight if no majority; equal weights go to the larger group, then to the newer
+        # version (then to the higher digest), so the result does not depend on the order of the answers
+        most_weighted_file = max(weighted_files.values(),
+                                 key=lambda x: (x["total_weight"], x["count"], x["file"]["version"], x["file"]["hash"]))
+        if self.event_sink.enabled:
+            self._emit(events.RESTORE_RESULT, rule="weighted fallback", version=most_weighted_file["file"]["version"],
+                       total_weight=most_weighted_file["total_weight"])
+        if self.metrics.enabled:
+            self.metrics.incr("restore_rule_weighted_fallback")
+        return most_weighted_file
+
+    def _fetch_content(self, group, retry_limit, retry_period_ms, key=None):
+        """
+        Fetches the content of the winning file from one server of its hash group, failing over to the next
+        server of the group when a read fails; the group is tried up to retry_limit times
+        Return the restored file, or None if no server of the group returned the content
+        params:
+        group: the winning hash group, with the servers that voted for it
+        retry_limit: Maximum number of passes over the group
+        retry_period_ms: Time in milliseconds between two passes
+        key: optional key of the keyed file to fetch
+        """
+        metadata = group["file"]
+        with self.metrics.span("restore_fetch", self.clock):
+            for attempt in range(retry_limit):
+                if attempt:
+                    if self.event_sink.enabled:
+                        self._emit(events.RETRY_WAIT, phase="restore fetch", wait_ms=retry_period_ms)
+                    self.clock.sleep(retry_period_ms)
+                for server in group["servers"]:
+                    if self.metrics.enabled:
+                        self.metrics.incr("restore_fetches")
+                    try:
+                        response = server.retrieve_file(metadata["version"], key)
+                    except Exception as e:
+                        if self.event_sink.enabled:
+                            self._emit(events.ERROR, server=server.id, error=str(e))
+                        response = None
+                    # The content must be the one the group voted for, the server may have moved on
+                    if response and response["hash"] == metadata["hash"]:
+                        if self.event_sink.enabled:
+                            self._emit(events.RESTORE_FETCH, server=server.id, version=response["version"],
+                                       hash=response["hash"])
+                        if self.metrics.enabled:
+                            content = response["content"]
+                            self.metrics.incr("restore_bytes_received",
+                                              len(content.encode() if isinstance(content, str) else content))
+                        return self._restored_file(response)
+                    if self.metrics.enabled:
+                        self.metrics.incr("restore_fetch_failures")
+        if self.event_sink.enabled:
+            self._emit(events.RESTORE_RESULT, rule="fetch failed", version=metadata["version"], hash=metadata["hash"])
+        return None
+
+    @staticmethod
+    def _restored_file(response):
+        """
+        Return the restored file built from a server response
+        params:
+        response: the dictionary returned by Server.retrieve_file
+        """
+        return {
+            "version": response["version"],
+            "content": response["content"],
+            "file_name": response["file_name"],
+        }
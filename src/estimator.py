@@ -0,0 +1,143 @@
+import argparse
+import math
+
+import numpy as np
+
+from faults import READ_FAILURE_PROB
+
+
+def wilson_interval(successes, trials, z=1.96):
+    """
+    Return the Wilson score confidence interval (low, high) of a success rate
+    params:
+    successes: number of successful trials
+    trials: total number of trials
+    z: quantile of the normal distribution (1.96 for a 95% interval)
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (rate + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def _simulate_batch(rng, settings, trials, retry_limit, num_updates,
+                    update_retry_limit, update_retry_period_ms, read_failure_prob):
+    """
+    Simulates a batch of trials as (trials x servers) arrays
+    Return a boolean array, True where the restore returned the latest version
+    """
+    failure_prob = np.array([s["failure_prob"] for s in settings], dtype=float)
+    delay_min = np.array([s["recovery_delay_min"] for s in settings], dtype=np.int64)
+    delay_max = np.array([s["recovery_delay_max"] for s in settings], dtype=np.int64)
+    weights = np.array([s["weight"] for s in settings], dtype=float)
+    num_servers = len(settings)
+    shape = (trials, num_servers)
+
+    now_ms = np.zeros(trials)
+    recovery_time_ms = np.zeros(shape)  # A server is down while the time is before its recovery time
+    versions = np.ones(shape, dtype=np.int64)  # Version 1 is distributed to every server
+
+    # Update phase: one round every update_retry_period_ms while some server did not ACK
+    for update in range(num_updates):
+        now_ms += rng.integers(10, 31, size=trials)  # Client wait before the update
+        new_version = update + 2
+        pending = np.ones(shape, dtype=bool)
+        for _ in range(update_retry_limit):
+            attempt_time_ms = now_ms[:, None]
+            reachable = pending & (attempt_time_ms >= recovery_time_ms)
+            failed = reachable & (rng.random(shape) < failure_prob)
+            delays = rng.integers(delay_min, delay_max + 1, size=shape)
+            recovery_time_ms = np.where(failed, attempt_time_ms + delays, recovery_time_ms)
+            applied = reachable & ~failed
+            versions[applied] = new_version
+            pending &= ~applied
+            now_ms += np.where(pending.any(axis=1), update_retry_period_ms, 0)
+
+    # Restore phase: every server is asked until it answers or fails retry_limit reads
+    responded = np.zeros(shape, dtype=bool)
+    response_order = np.full(shape, np.iinfo(np.int64).max)
+    server_index = np.arange(num_servers)
+    for attempt in range(retry_limit):
+        answered = ~responded & (rng.random(shape) >= read_failure_prob)
+        responded |= answered
+        response_order = np.where(answered, attempt * num_servers + server_index, response_order)
+
+    # Tally votes per version: count, total weight and order of the first response
+    latest = num_updates + 1
+    candidates = np.arange(1, latest + 1)
+    votes = responded[:, :, None] & (versions[:, :, None] == candidates)  # trials x servers x versions
+    counts = votes.sum(axis=1)
+    total_weights = (votes * weights[None, :, None]).sum(axis=1)
+    first_response = np.where(votes, response_order[:, :, None], np.iinfo(np.int64).max).min(axis=1)
+
+    # Majority rule among the servers that answered
+    total_servers = responded.sum(axis=1)
+    majority = counts > total_servers[:, None] / 2
+    has_majority = majority.any(axis=1)
+    majority_version = candidates[majority.argmax(axis=1)]
+
+    # Weighted fallback, ties broken by the first group that answered
+    heaviest = (total_weights == total_weights.max(axis=1, keepdims=True)) & (counts > 0)
+    fallback_version = candidates[np.where(heaviest, first_response, np.iinfo(np.int64).max).argmin(axis=1)]
+
+    restored_version = np.where(has_majority, majority_version, fallback_version)
+    return (total_servers > 0) & (restored_version == latest)
+
+
+def estimate_accuracy(server_settings, retry_limit, trials=100_000, num_updates=5, seed=0, batch_size=100_000,
+                      update_retry_limit=3, update_retry_period_ms=5, read_failure_prob=READ_FAILURE_PROB):
+    """
+    Estimates the restore accuracy of a configuration with a vectorised Monte-Carlo simulation
+    Models the same failures as the object simulator (run_simulation with the default sequential fan-out
+    and "all" quorum): Bernoulli update failures with a uniform recovery delay, update rounds every
+    update_retry_period_ms up to update_retry_limit attempts, reads failing with read_failure_prob,
+    majority rule and weighted fallback. Exact random streams differ, the distributions do not
+    Return a dictionary with the accuracy and its 95% confidence interval
+    params:
+    server_settings: list of server dictionaries, as in the simulation_runner configurations
+    retry_limit: maximum number of read attempts per server in the restore phase
+    trials: number of simulated runs
+    num_updates: number of updates per run
+    seed: seed of the NumPy generator
+    batch_size: number of trials simulated at once, bounds the memory used
+    update_retry_limit: attempts per server in the update phase (ConsensusAlgorithm.update_consensus default)
+    update_retry_period_ms: time between update rounds (ConsensusAlgorithm.update_consensus default)
+    read_failure_prob: failure probability of each read
+    """
+    rng = np.random.default_rng(seed)
+    successes = 0
+    for start in range(0, trials, batch_size):
+        batch = min(batch_size, trials - start)
+        successes += int(_simulate_batch(rng, server_settings, batch, retry_limit, num_updates,
+                                         update_retry_limit, update_retry_period_ms, read_failure_prob).sum())
+    ci_low, ci_high = wilson_interval(successes, trials)
+    return {
+        "trials": trials,
+        "successes": successes,
+        "restore_accuracy": successes / trials,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+    }
+
+
+def main():
+    from simulation_runner import configs
+
+    parser = argparse.ArgumentParser(description="Estimate the restore accuracy of the batch configurations.")
+    parser.add_argument("--trials", type=int, default=100_000, help="Number of simulated runs per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the NumPy generator")
+    parser.add_argument("--num-updates", type=int, default=5, help="Number of updates per run")
+    args = parser.parse_args()
+
+    for config in configs:
+        result = estimate_accuracy(config["server_settings"], config["retry_limit"], args.trials,
+                                   args.num_updates, args.seed)
+        print(f"{config['name']}: accuracy {result['restore_accuracy']:.4f} "
+              f"(95% CI {result['ci_low']:.4f} - {result['ci_high']:.4f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import collections
+import sys
+
+# Event types emitted by the servers, the client and the consensus algorithm
+FILE_CREATED = "file_created"
+STORED = "stored"
+UPDATE_STARTED = "update_started"
+UPDATE_BATCH = "update_batch"
+UPDATE_SENT = "update_sent"
+UPDATE_APPLIED = "update_applied"
+UPDATE_REJECTED = "update_rejected"
+UPDATE_FAILED = "update_failed"
+UPDATE_RESULT = "update_result"
+ACK = "ack"
+TIMEOUT = "timeout"
+FAILURE = "failure"
+RECOVERY = "recovery"
+ERROR = "error"
+RETRY_WAIT = "retry_wait"
+RETRY_STATE = "retry_state"
+UNRESPONSIVE = "unresponsive"
+UNAVAILABLE = "unavailable"
+CLIENT_WAIT = "client_wait"
+RESTORE_STARTED = "restore_started"
+RESTORE_ATTEMPT = "restore_attempt"
+READ = "read"
+READ_FAILURE = "read_failure"
+RESTORE_VOTE = "restore_vote"
+RESTORE_RESULT = "restore_result"
+RESTORE_FETCH = "restore_fetch"
+REPAIR = "repair"
+ANTI_ENTROPY_ROUND = "anti_entropy_round"
+
+Event = collections.namedtuple("Event", ["type", "source", "time_ms", "fields"])
+
+
+class EventSink:
+    """
+    Receives the events of a simulation
+    Emitters check `enabled` before building an event, so a disabled sink costs one attribute lookup
+    """
+    enabled = True
+
+    def emit(self, type, source, time_ms=None, **fields):
+        """
+        Records an event
+        params:
+        type: one of the event types defined in this module
+        source: the emitter, e.g. "consensus", "client" or "server 2"
+        time_ms: the clock time of the event, if the emitter has a clock
+        fields: event-specific values
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes out any buffered event
+        """
+
+    def close(self):
+        """
+        Flushes the sink and releases its resources
+        """
+        self.flush()
+
+
+class NullSink(EventSink):
+    """
+    Discards every event (the default sink)
+    """
+    enabled = False
+
+    def emit(self, type, source, time_ms=None, **fields):
+        pass
+
+
+NULL_SINK = NullSink()
+
+
+class RingBufferSink(EventSink):
+    def __init__(self, capacity=10_000):
+        """
+        Keeps the most recent events in memory
+        params:
+        capacity: maximum number of events kept, older events are dropped
+        """
+        self.events = collections.deque(maxlen=capacity)
+
+    def emit(self, type, source, time_ms=None, **fields):
+        self.events.append(Event(type, source, time_ms, fields))
+
+    def of_type(self, type):
+        """
+        Return the buffered events of the given type
+        """
+        return [event for event in self.events if event.type == type]
+
+
+class JsonLinesSink(EventSink):
+    def __init__(self, target, buffer_size=1000):
+        """
+        Writes events as JSON lines, in batches
+        params:
+        target: a path or an open text stream
+        buffer_size: number of events buffered before they are written
+        """
+        if isinstance(target, str):
+            self.stream = open(target, "a", encoding="utf-8")
+            self._owns_stream = True
+        else:
+            self.stream = target
+            self._owns_stream = False
+        self.buffer_size = buffer_size
+        self._buffer = []
+
+    def emit(self, type, source, time_ms=None, **fields):
+        self._buffer.append({"type": type, "source": source, "time_ms": time_ms, **fields})
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            import json  # Only this sink needs json, the other sinks do not load it
+            self.stream.write("".join(json.dumps(record, default=str) + "\n" for record in self._buffer))
+            self._buffer.clear()
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        if self._owns_stream:
+            self.stream.close()
+
+
+class ConsoleSink(EventSink):
+    def __init__(self, stream=None):
+        """
+        Prints every event as a human-readable line, for interactive runs
+        params:
+        stream: the text stream to write to (defaults to stdout)
+        """
+        self.stream = stream if stream is not None else sys.stdout
+
+    def emit(self, type, source, time_ms=None, **fields):
+        timestamp = f"[{time_ms:>8.1f} ms] " if time_ms is not None else ""
+        details = ", ".join(f"{key}={value}" for key, value in fields.items())
+        print(f"{timestamp}{source.capitalize()}: {type}" + (f" ({details})" if details else ""), file=self.stream)
@@ -0,0 +1,178 @@
+import collections
+import random
+
+READ_FAILURE_PROB = 0.2  # Failure probability of a read (Server.probe_file and Server.retrieve_file)
+TRACE_FORMAT = "failure-trace"
+TRACE_VERSION = 1
+
+# Trace record operations
+UPDATE = "update"  # An update attempt that reached a server: recovery_delay_ms is None if it did not fail
+READ = "read"  # A read of a server: failed is True for a simulated read failure
+WAIT = "wait"  # A client wait before an update
+
+
+class RandomFaults:
+    def __init__(self, seed=None, rng=None):
+        """
+        Draws the injected faults (update failures, recovery delays, read failures) and the client waits
+        By default every draw comes from the random module, as in a simulation seeded with random.seed.
+        With a seed, each server draws from its own stream derived from the seed and its id, and the client
+        from another one: a server sees the same faults whatever the order in which the servers are
+        contacted (concurrent fan-out, reordered or parallel runs)
+        params:
+        seed: optional seed of the per-server streams
+        rng: random generator used when no seed is given (defaults to the random module)
+        """
+        self.seed = seed
+        self.rng = rng if rng is not None else random
+        self._streams = {}
+
+    def _stream(self, key):
+        if self.seed is None:
+            return self.rng
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = self._streams[key] = random.Random(f"{self.seed}:{key}")
+        return stream
+
+    def update_failure(self, server):
+        """
+        Decides whether an update attempt on a server fails
+        Return the recovery delay in milliseconds if it fails, None otherwise
+        params:
+        server: the Server receiving the update
+        """
+        rng = self._stream(f"server {server.id}")
+        if rng.random() < server.failure_prob:
+            return rng.randint(server.recovery_delay_min, server.recovery_delay_max)
+        return None
+
+    def read_failure(self, server):
+        """
+        Return True if a read of the server fails
+        params:
+        server: the Server being read
+        """
+        return self._stream(f"server {server.id}").random() < READ_FAILURE_PROB
+
+    def wait_ms(self, low, high):
+        """
+        Return the time the client waits before an update, drawn uniformly in [low, high]
+        """
+        return self._stream("client").randint(low, high)
+
+
+class FailureTrace:
+    def __init__(self, records=None):
+        """
+        Recorded fault schedule of a run: every update attempt outcome and recovery delay, read outcome and
+        client wait, in the order they were drawn
+        Saved as JSON lines: a header line, then one record per line, e.g.
+        {"op": "update", "server": 2, "recovery_delay_ms": 31}, {"op": "read", "server": 2, "failed": false},
+        {"op": "wait", "ms": 17}
+        params:
+        records: optional list of record dictionaries
+        """
+        self.records = records if records is not None else []
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, record):
+        self.records.append(record)
+
+    def save(self, path):
+        """
+        Writes the trace to a JSON lines file
+        """
+        import json  # Only traces need it, the simulation itself does not import json
+        with open(path, "w") as f:
+            f.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION}) + "\n")
+            for record in self.records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a trace written by save
+        """
+        import json
+        with open(path) as f:
+            header = json.loads(f.readline())
+            if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+                raise ValueError(f"Not a failure trace (version {TRACE_VERSION}): {path}")
+            return cls([json.loads(line) for line in f if line.strip()])
+
+
+class FaultRecorder:
+    def __init__(self, faults=None, trace=None):
+        """
+        Forwards the draws to another fault source and records their outcome in a FailureTrace
+        params:
+        faults: the fault source drawing the faults (defaults to RandomFaults())
+        trace: the FailureTrace receiving the records (defaults to a new one)
+        """
+        self.faults = faults if faults is not None else RandomFaults()
+        self.trace = trace if trace is not None else FailureTrace()
+
+    def update_failure(self, server):
+        delay_ms = self.faults.update_failure(server)
+        self.trace.append({"op": UPDATE, "server": server.id, "recovery_delay_ms": delay_ms})
+        return delay_ms
+
+    def read_failure(self, server):
+        failed = self.faults.read_failure(server)
+        self.trace.append({"op": READ, "server": server.id, "failed": failed})
+        return failed
+
+    def wait_ms(self, low, high):
+        wait_ms = self.faults.wait_ms(low, high)
+        self.trace.append({"op": WAIT, "ms": wait_ms})
+        return wait_ms
+
+
+class TraceReplay:
+    def __init__(self, trace):
+        """
+        Replays a recorded FailureTrace instead of drawing random numbers
+        Each server replays its own records in order, so the replay does not depend on the order in which
+        the servers are contacted. A run that asks for more draws than were recorded has diverged from the
+        recorded one (different settings or code) and raises ValueError
+        params:
+        trace: the FailureTrace to replay
+        """
+        self._queues = collections.defaultdict(collections.deque)  # (op, server id) -> outcomes
+        for record in trace.records:
+            if record["op"] == UPDATE:
+                self._queues[UPDATE, record["server"]].append(record["recovery_delay_ms"])
+            elif record["op"] == READ:
+                self._queues[READ, record["server"]].append(record["failed"])
+            elif record["op"] == WAIT:
+                self._queues[WAIT, None].append(record["ms"])
+            else:
+                raise ValueError(f"Unknown trace record: {record}")
+
+    def _next(self, op, server_id):
+        queue = self._queues.get((op, server_id))
+        if not queue:
+            source = "the client" if server_id is None else f"server {server_id}"
+            raise ValueError(f"The trace has no more {op} records for {source}: the run diverged from the trace")
+        return queue.popleft()
+
+    def update_failure(self, server):
+        return self._next(UPDATE, server.id)
+
+    def read_failure(self, server):
+        return self._next(READ, server.id)
+
+    def wait_ms(self, low, high):
+        return self._next(WAIT, None)
+
+    def remaining(self):
+        """
+        Return the number of records not replayed yet
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+
+DEFAULT_FAULTS = RandomFaults()
@@ -1,26 +1,141 @@
-class File:
-    def __init__(self, file_name, content, version=1):
-        """
-        Represents a file with a name, content, size, and version
-	params:
-        file_name: The name of the file, including its extension
-        content: The content of the file
-        version: The version of the file
-        """
-        self.file_name = file_name
-        self.content = content
-        self.size = len(content.encode("utf-8"))  # File size in bytes
-        self.version = version
-
-    def is_valid(self, max_size=100_000):
-        """
-        Validates the file
-	params:
-        max_size: Maximum allowed file size in bytes
-        Return a tuple (bool, message). True if the file is valid, otherwise False with an explanation
-        """
-        if not self.file_name.endswith(".txt"):
-            return False, "File must have a .txt extension."
-        if self.size > max_size:
-            return False, f"File size exceeds the limit of {max_size} bytes (actual: {self.size} bytes)."
-        return True, "File is valid."
+import hashlib
+import io
+import os
+
+DEFAULT_MAX_SIZE = 100_000  # Default size limit checked by is_valid, in bytes
+STREAM_CHUNK_SIZE = 64 * 1024  # Default size of the chunks read from the content
+
+
+class File:
+    def __init__(self, file_name, content, version=1, size=None, max_size=DEFAULT_MAX_SIZE, is_text=None):
+        """
+        Represents a file with a name, content, size, and version
+	params:
+        file_name: The name of the file, including its extension
+        content: The content of the file: a str, bytes, or a binary stream (a file-like object with read(),
+                 e.g. an open file), which is read chunk by chunk and never loaded as a whole
+        version: The version of the file
+        size: Size in bytes of a stream, if known (otherwise measured by seeking to its end)
+        max_size: Maximum allowed file size in bytes, checked by is_valid
+        is_text: True if the content is UTF-8 text (defaults to True for str content only)
+        """
+        self.file_name = file_name
+        self.version = version
+        self.max_size = max_size
+        self.is_text = isinstance(content, str) if is_text is None else is_text
+        self._text = content if isinstance(content, str) else None
+        self._stream = None
+        self._hash = None
+        self._chunk_digests = {}  # chunk size -> digests of the chunks, see chunk_digests
+        if self._text is not None:
+            self._data = content.encode("utf-8")  # Encoded once, reused for the size, hashing and transfer
+        elif isinstance(content, (bytes, bytearray, memoryview)):
+            self._data = memoryview(content).cast("B")
+        else:
+            self._data = None
+            self._stream = content
+            self._start = content.tell() if content.seekable() else None  # The content starts at this offset
+            if size is None:
+                if self._start is None:
+                    raise ValueError("The size of a non-seekable stream must be given")
+                size = content.seek(0, io.SEEK_END) - self._start
+                content.seek(self._start)
+        self.size = len(self._data) if self._data is not None else size  # File size in bytes
+
+    @classmethod
+    def from_path(cls, path, version=1, file_name=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        Return a File streaming the content of a file on disk
+        The caller closes the stream (file.close()) once the file has been replicated
+        params:
+        path: path of the file on disk
+        version: The version of the file
+        file_name: The name of the file (defaults to the base name of the path)
+        max_size: Maximum allowed file size in bytes
+        """
+        return cls(file_name or os.path.basename(path), open(path, "rb"), version, size=os.path.getsize(path),
+                   max_size=max_size)
+
+    @property
+    def content(self):
+        """
+        The whole content: a str for text files, bytes otherwise
+        Reading it loads a stream in memory, prefer iter_chunks for large files
+        """
+        if self._text is not None:
+            return self._text
+        data = b"".join(self.iter_chunks())
+        return data.decode("utf-8") if self.is_text else data
+
+    def iter_chunks(self, chunk_size=STREAM_CHUNK_SIZE):
+        """
+        Yields the content as consecutive bytes-like chunks of chunk_size bytes (the last one may be shorter)
+        In-memory content is sliced without copies; a seekable stream is rewound, so it can be read again,
+        while a non-seekable stream (e.g. a socket) can be read only once
+        params:
+        chunk_size: size of each chunk in bytes
+        """
+        if self._data is not None:
+            if isinstance(self._data, bytes) and 0 < len(self._data) <= chunk_size:
+                # A single chunk is the encoded text itself: replicas storing it keep a reference, not a copy
+                yield self._data
+                return
+            data = memoryview(self._data)
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+            return
+        if self._start is not None:
+            self._stream.seek(self._start)
+        remaining = self.size
+        while remaining > 0:
+            chunk = self._stream.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def sha256(self):
+        """
+        Return the SHA-256 digest of the content, hashed incrementally chunk by chunk (computed once)
+        """
+        if self._hash is None:
+            digest = hashlib.sha256()
+            for chunk in self.iter_chunks():
+                digest.update(chunk)
+            self._hash = digest.hexdigest()
+        return self._hash
+
+    def chunk_digests(self, chunk_size):
+        """
+        Return the SHA-256 digests (hex) of the chunks of chunk_size bytes, as a replica stores them
+        Computed once per chunk size, so a file sent to many servers is hashed once
+        params:
+        chunk_size: size of each chunk in bytes
+        """
+        digests = self._chunk_digests.get(chunk_size)
+        if digests is None:
+            digests = self._chunk_digests[chunk_size] = [hashlib.sha256(chunk).hexdigest()
+                                                         for chunk in self.iter_chunks(chunk_size)]
+        return digests
+
+    def close(self):
+        """
+        Closes the stream backing the content, if any
+        """
+        if self._stream is not None:
+            self._stream.close()
+
+    def is_valid(self, max_size=None):
+        """
+        Validates the file
+	params:
+        max_size: Maximum allowed file size in bytes (defaults to the limit of the file)
+        Return a tuple (bool, message). True if the file is valid, otherwise False with an explanation
+        """
+        if max_size is None:
+            max_size = self.max_size
+        if not self.file_name.endswith(".txt"):
+            return False, "File must have a .txt extension."
+        if self.size > max_size:
+            return False, f"File size exceeds the limit of {max_size} bytes (actual: {self.size} bytes)."
+        return True, "File is valid."
@@ -1,69 +1,166 @@
-from client import Client
-from consensus import ConsensusAlgorithm
-from server import Server
-import random
-import time
-
-# Create a cluster of servers
-
-def Cluster(server_settings):
-    return [
-        Server(
-            id=s["id"],
-            weight=s["weight"],
-            failure_prob=s["failure_prob"],
-            recovery_delay_min=s["recovery_delay_min"],
-            recovery_delay_max=s["recovery_delay_max"]
-        )
-        for s in server_settings
-    ]
-
-def run_simulation(server_settings, retry_limit, retry_period_ms, ack_timeout_ms, num_updates=5):
-    servers = Cluster(server_settings)
-    consensus = ConsensusAlgorithm(servers=servers)
-    client = Client(servers=servers, consensus=consensus)
-
-    # Create and distribute the initial file
-
-    client.create_initial_file(file_name="initial_file.txt", content="This is the initial content.")
-    client.distribute_file()
-
-    # Sequential updates
-
-    for _ in range(num_updates):
-        wait_time = random.randint(10, 30) / 1000.0
-        print(f"Waiting for {wait_time * 1000:.1f} ms before the next update\n")
-        time.sleep(wait_time)
-
-        client.update_file()
-        client.apply_update()
-        consensus.retry_unresponsive_servers(client.current_file)
-
-    # Retrieve the file
-
-    restored_file = client.consensus.restore_consensus(
-        retry_limit=retry_limit,
-        retry_period_ms=retry_period_ms
-    )
-
-    return restored_file, client.current_file
-
-
-if __name__ == "__main__":
-    servers = [
-        {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
-        {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 20, "recovery_delay_max": 35},
-        {"id": 3, "failure_prob": 0.4, "weight": 2,  "recovery_delay_min": 25, "recovery_delay_max": 45},
-    ]
-
-    restored, expected = run_simulation(
-        server_settings=servers,
-        retry_limit=3,
-        retry_period_ms=10,
-        ack_timeout_ms=5,
-        num_updates=5
-    )
-
-    print("\n========== FINAL RESTORE ==========")
-    print("RESTORED FILE:", restored)
-    print("EXPECTED VERSION:", expected.version)
+from client import Client
+from clock import VirtualClock
+from cluster import Cluster
+from consensus import ConsensusAlgorithm
+from events import CLIENT_WAIT, NULL_SINK, ConsoleSink
+from faults import DEFAULT_FAULTS, RandomFaults
+
+def run_simulation(server_settings, retry_limit, retry_period_ms, ack_timeout_ms, num_updates=5, clock=None,
+                   fanout="sequential", quorum="all", event_sink=None,
+                   retry_policy=None, batch_size=1, network=None, metrics=None, repair="retry",
+                   anti_entropy_interval_ms=20, seed=None, faults=None, read_router=None):
+    if repair not in ("retry", "background", "anti-entropy"):
+        raise ValueError(f"Unknown repair mode: {repair}")
+    if repair == "anti-entropy" and network is not None:
+        raise ValueError("Anti-entropy repair needs in-memory servers")
+    if faults is not None and network is not None:
+        raise ValueError("The server processes of the networked mode draw their own failures, pass a seed instead")
+    # Simulated time by default: waits advance the clock instead of sleeping
+    if clock is None:
+        clock = VirtualClock()
+    if event_sink is None:
+        event_sink = NULL_SINK
+    # Failures and client waits: drawn from the random module, from per-server streams of the seed, or
+    # replayed from a trace (faults=TraceReplay(trace))
+    if faults is None:
+        faults = RandomFaults(seed) if seed is not None else DEFAULT_FAULTS
+    # The retry jitter follows the seed as well, from a stream of its own
+    if seed is not None and hasattr(retry_policy, "reseed"):
+        retry_policy.reseed(seed)
+    if network is not None:
+        # Each server runs in its own process behind a local socket ("tcp" or "unix")
+        from network import NetworkedCluster
+        networked_cluster = NetworkedCluster(server_settings, family=network, seed=seed)
+        servers = networked_cluster.servers
+    else:
+        networked_cluster = None
+        servers = Cluster(server_settings, clock=clock, event_sink=event_sink, metrics=metrics, faults=faults)
+    consensus = ConsensusAlgorithm(servers=servers, clock=clock, fanout=fanout, quorum=quorum, event_sink=event_sink,
+                                   retry_policy=retry_policy, metrics=metrics, read_router=read_router)
+    client = Client(servers=servers, consensus=consensus, event_sink=event_sink, batch_size=batch_size)
+    # Stale replicas are retried after each update (blocking), retried by clock events while the client
+    # goes on ("background"), or repaired in the background by comparing the replicas
+    anti_entropy = None
+    if repair == "anti-entropy":
+        from antientropy import AntiEntropy
+        anti_entropy = AntiEntropy(consensus, interval_ms=anti_entropy_interval_ms)
+
+    # Create and distribute the initial file
+
+    client.create_initial_file(file_name="initial_file.txt", content="This is the initial content.")
+    client.distribute_file()
+    if anti_entropy is not None:
+        anti_entropy.start()
+
+    # Sequential updates
+
+    for _ in range(num_updates):
+        wait_time_ms = faults.wait_ms(10, 30)
+        if event_sink.enabled:
+            event_sink.emit(CLIENT_WAIT, "client", clock.now_ms(), wait_ms=wait_time_ms)
+        clock.sleep(wait_time_ms)
+
+        client.update_file()
+        if client.apply_update() is not None:
+            _retry_stragglers(consensus, client.current_file, repair)
+
+    # Commit the versions still queued in a batch
+    if client.flush_updates() is not None:
+        _retry_stragglers(consensus, client.current_file, repair)
+
+    # Retrieve the file, once the last retries or a last repair round have brought the lagging replicas up to date
+    if repair == "background":
+        consensus.wait_for_background_retries()
+    if anti_entropy is not None:
+        anti_entropy.run_round()
+
+    restored_file = client.consensus.restore_consensus(
+        retry_limit=retry_limit,
+        retry_period_ms=retry_period_ms
+    )
+    if anti_entropy is not None:
+        anti_entropy.stop()
+    consensus.close()
+    if networked_cluster is not None:
+        networked_cluster.close()
+
+    return restored_file, client.current_file
+
+
+def _retry_stragglers(consensus, file, repair):
+    """
+    Retries the servers that missed an update, according to the repair mode of run_simulation
+    """
+    if repair == "retry":
+        consensus.retry_unresponsive_servers(file)
+    elif repair == "background":
+        consensus.retry_unresponsive_servers_later(file)
+
+
+def run_multi_file_simulation(server_settings, retry_limit, retry_period_ms, num_files=10, num_updates=5, clock=None,
+                              fanout="sequential", quorum="all", event_sink=None, metrics=None, replication=None,
+                              seed=None, faults=None):
+    """
+    Replicates num_files keyed files at once: every round writes a new version of each file and commits
+    them together, then each file is restored from its replicas
+    Return a dictionary file key -> restored file, and a dictionary file key -> expected File
+    params:
+    replication: optional number of servers holding each file; the files are then placed on the servers by
+                 consistent hashing (see sharding.HashRing) instead of being held by every server
+    The other parameters are those of run_simulation
+    """
+    if clock is None:
+        clock = VirtualClock()
+    if event_sink is None:
+        event_sink = NULL_SINK
+    if faults is None:
+        faults = RandomFaults(seed) if seed is not None else DEFAULT_FAULTS
+    servers = Cluster(server_settings, clock=clock, event_sink=event_sink, metrics=metrics, faults=faults)
+    placement = None
+    if replication is not None:
+        from sharding import HashRing
+        placement = HashRing(servers, replication=replication)
+    consensus = ConsensusAlgorithm(servers=servers, clock=clock, fanout=fanout, quorum=quorum, event_sink=event_sink,
+                                   metrics=metrics, placement=placement)
+    client = Client(servers=servers, consensus=consensus, event_sink=event_sink)
+    keys = [f"file-{index}" for index in range(num_files)]
+
+    # The initial versions, then num_updates rounds of updates of every file
+    for update in range(num_updates + 1):
+        if update:
+            wait_time_ms = faults.wait_ms(10, 30)
+            if event_sink.enabled:
+                event_sink.emit(CLIENT_WAIT, "client", clock.now_ms(), wait_ms=wait_time_ms)
+            clock.sleep(wait_time_ms)
+        for key in keys:
+            client.write_file(key, f"{key}_v{update + 1}.txt", f"Content of {key}, version {update + 1}.")
+        client.commit_files()
+        consensus.retry_unresponsive_files(client.files)
+
+    restored_files = {
+        key: consensus.restore_consensus(retry_limit=retry_limit, retry_period_ms=retry_period_ms, key=key)
+        for key in keys
+    }
+    consensus.close()
+    return restored_files, client.files
+
+
+if __name__ == "__main__":
+    servers = [
+        {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+        {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 20, "recovery_delay_max": 35},
+        {"id": 3, "failure_prob": 0.4, "weight": 2,  "recovery_delay_min": 25, "recovery_delay_max": 45},
+    ]
+
+    restored, expected = run_simulation(
+        server_settings=servers,
+        retry_limit=3,
+        retry_period_ms=10,
+        ack_timeout_ms=5,
+        num_updates=5,
+        event_sink=ConsoleSink()
+    )
+
+    print("\n========== FINAL RESTORE ==========")
+    print("RESTORED FILE:", restored)
+    print("EXPECTED VERSION:", expected.version)
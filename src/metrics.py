@@ -0,0 +1,245 @@
+import bisect
+import collections
+import threading
+import time
+
+# Histogram bucket bounds: four buckets per decade from 1e-3 to 1e7
+BUCKET_BOUNDS = [10 ** (exponent / 4) for exponent in range(-12, 29)]
+
+
+class Histogram:
+    def __init__(self):
+        """
+        Distribution of observed values in fixed logarithmic buckets
+        Quantiles are approximated by the upper bound of their bucket, capped to the largest value
+        """
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def observe(self, value):
+        if not self.count:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+
+    def quantile(self, fraction):
+        """
+        Return the approximate value below which the given fraction of the observations fall
+        params:
+        fraction: the quantile as a fraction (0.95 for p95)
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                bound = BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other):
+        """
+        Adds the observations of another histogram
+        """
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def to_dict(self):
+        """
+        Return the histogram as a JSON-serialisable dictionary (only the non-empty buckets are listed)
+        """
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "buckets": {index: count for index, count in enumerate(self.buckets) if count}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a histogram saved with to_dict
+        """
+        histogram = cls()
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        for index, count in data["buckets"].items():
+            histogram.buckets[int(index)] = count
+        return histogram
+
+    def summary(self):
+        """
+        Return count, mean, p50, p95, p99 and max of the observations
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Span:
+    def __init__(self, metrics, name, clock=None):
+        """
+        Times a block of code: the wall time is recorded in the histogram <name>_ms and, when a clock is
+        given, the elapsed clock time (simulated time with a VirtualClock) in <name>_sim_ms
+        params:
+        metrics: the Metrics receiving the timings
+        name: name of the span
+        clock: optional Clock of the timed component
+        """
+        self.metrics = metrics
+        self.name = name
+        self.clock = clock
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._started_ms = self.clock.now_ms() if self.clock is not None else None
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(f"{self.name}_ms", (time.perf_counter() - self._started) * 1000)
+        if self.clock is not None:
+            self.metrics.observe(f"{self.name}_sim_ms", self.clock.now_ms() - self._started_ms)
+        self.metrics.incr(f"{self.name}_count")
+
+
+class Metrics:
+    """
+    Counters, histograms and spans recorded by the simulation components
+    Components check `enabled` before recording, so disabled metrics cost one attribute lookup
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = {}
+        self._lock = threading.Lock()  # The concurrent fan-out records from several threads
+
+    def incr(self, name, value=1):
+        """
+        Increments a counter
+        params:
+        name: name of the counter
+        value: amount added to the counter
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        """
+        Records a value in a histogram
+        params:
+        name: name of the histogram
+        value: the observed value
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def span(self, name, clock=None):
+        """
+        Return a context manager timing the enclosed block (see Span)
+        """
+        return Span(self, name, clock)
+
+    def merge(self, other):
+        """
+        Adds the counters and histograms of another Metrics, e.g. the metrics of another trial
+        """
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, histogram in other.histograms.items():
+            self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    def snapshot(self):
+        """
+        Return the metrics as a flat dictionary: the counters by name, and <histogram>_<statistic> for
+        the count, mean, p50, p95, p99 and max of each histogram
+        """
+        with self._lock:
+            snapshot = dict(sorted(self.counters.items()))
+            for name in sorted(self.histograms):
+                for statistic, value in self.histograms[name].summary().items():
+                    snapshot[f"{name}_{statistic}"] = value
+        return snapshot
+
+    def to_dict(self):
+        """
+        Return the counters and histograms as a JSON-serialisable dictionary, e.g. to cache a trial on disk
+        """
+        with self._lock:
+            return {"counters": dict(self.counters),
+                    "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds metrics saved with to_dict
+        """
+        metrics = cls()
+        metrics.counters.update(data["counters"])
+        metrics.histograms = {name: Histogram.from_dict(histogram) for name, histogram in data["histograms"].items()}
+        return metrics
+
+    def reset(self):
+        """
+        Clears every counter and histogram
+        """
+        with self._lock:
+            self.counters = collections.defaultdict(int)
+            self.histograms = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]  # Metrics are sent back from the worker processes of a sweep
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class NullMetrics(Metrics):
+    """
+    Discards every measurement (the default)
+    """
+    enabled = False
+
+    def incr(self, name, value=1):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def span(self, name, clock=None):
+        return _NULL_SPAN
+
+
+_NULL_SPAN = _NullSpan()
+NULL_METRICS = NullMetrics()
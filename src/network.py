@@ -0,0 +1,540 @@
+import math
+import multiprocessing
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+from faults import RandomFaults
+from file import DEFAULT_MAX_SIZE, STREAM_CHUNK_SIZE, File
+from server import Server
+from storage import DEFAULT_CHUNK_SIZE
+
+# Frame: message type (1 byte) + payload length (4 bytes), then the payload
+HEADER = struct.Struct("!BI")
+RESPONSE = 0x80  # Set on the type of the response to a request
+
+STORE = 1
+UPDATE = 2
+ACK = 3
+RETRIEVE = 4
+HINT = 5
+PROBE = 6
+MISSING = 7
+
+# Store requests are followed by the raw content (content size bytes), streamed in chunks. An update request carries
+# the manifest of the content (_MANIFEST, the raw digests of its chunks, then one flag byte per chunk) and is followed
+# by the chunks flagged as sent only: the client first asks which chunks the server misses with a MISSING request
+# (_MANIFEST then the raw digests), answered by the raw digests of the missing chunks
+
+_STORE = struct.Struct("!QH?Q")  # version, file name length, text flag, content size
+_UPDATE = struct.Struct("!QdH?Q")  # version, current time in ms, file name length, text flag, content size
+_MANIFEST = struct.Struct("!I")  # chunk size
+_RETRIEVE = struct.Struct("!q")  # requested version, -1 for the current one
+# The response to a retrieve request is followed by the raw content (content size bytes), streamed in chunks, so
+# a file larger than the 4-byte frame length can be read back
+_FILE = struct.Struct("!QH32s?Q")  # version, file name length (0xFFFF if unknown), raw SHA-256 digest, text flag,
+                                   # content size
+_PROBE = struct.Struct("!QH32sQ")  # version, file name length (0xFFFF if unknown), raw SHA-256 digest, size
+_BOOL = struct.Struct("!?")
+_TIME = struct.Struct("!d")
+NO_NAME = 0xFFFF
+
+
+def _recv_exactly(sock, size):
+    """
+    Reads exactly size bytes from a socket
+    Raises ConnectionError if the peer closes the connection first
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the peer")
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, message_type, payload=b""):
+    """
+    Sends a framed message
+    params:
+    sock: a connected socket
+    message_type: the message type
+    payload: the encoded payload
+    """
+    sock.sendall(HEADER.pack(message_type, len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """
+    Receives a framed message
+    Return a (message_type, payload) tuple
+    """
+    message_type, length = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return message_type, _recv_exactly(sock, length) if length else b""
+
+
+def _encode_name(file_name):
+    return (NO_NAME, b"") if file_name is None else (len(file_name.encode()), file_name.encode())
+
+
+def _decode_name(length, data, offset):
+    if length == NO_NAME:
+        return None, offset
+    return data[offset:offset + length].decode(), offset + length
+
+
+def _decode_digests(data, offset, count):
+    return [data[offset + 32 * index:offset + 32 * (index + 1)].hex() for index in range(count)]
+
+
+class _ContentReader:
+    """
+    Reads the content following a store or update request from the socket, as a non-seekable stream
+    """
+
+    def __init__(self, sock, size):
+        self.sock = sock
+        self.remaining = size
+
+    def seekable(self):
+        return False
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        if size <= 0:
+            return b""
+        data = _recv_exactly(self.sock, size)
+        self.remaining -= size
+        return data
+
+    def drain(self):
+        """
+        Discards the unread content (e.g. of a rejected update), so the next request starts at a frame
+        """
+        while self.remaining:
+            self.read(STREAM_CHUNK_SIZE)
+
+
+class _ManifestReader:
+    """
+    Reads the content of an update as a non-seekable stream: the chunks flagged as sent are read from the socket,
+    the others from the chunks the server already holds
+    """
+
+    def __init__(self, sock, segments, chunks, size):
+        """
+        params:
+        sock: the connection of the request
+        segments: list of (sent, digest, length) tuples, one per chunk of the content in order
+        chunks: the chunks held by the server (VersionLog.chunks)
+        size: content size in bytes
+        """
+        self.sock = sock
+        self._segments = iter(segments)
+        self._chunks = chunks
+        self._buffer = memoryview(b"")
+        self.remaining = size
+
+    def seekable(self):
+        return False
+
+    def read(self, size):
+        size = min(size, self.remaining)
+        parts = []
+        while size > 0:
+            if not self._buffer:
+                sent, digest, length = next(self._segments)
+                self._buffer = memoryview(_recv_exactly(self.sock, length) if sent else self._chunks[digest])
+            part = self._buffer[:size]
+            self._buffer = self._buffer[size:]
+            parts.append(part)
+            size -= len(part)
+            self.remaining -= len(part)
+        return b"".join(parts)
+
+    def drain(self):
+        """
+        Discards the chunks not read yet (e.g. of a rejected update), so the next request starts at a frame
+        """
+        for sent, _, length in self._segments:
+            if sent:
+                _recv_exactly(self.sock, length)
+        self._buffer = memoryview(b"")
+        self.remaining = 0
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of one persistent client connection until it is closed
+    """
+
+    def handle(self):
+        server = self.server.replica
+        lock = self.server.replica_lock
+        while True:
+            try:
+                message_type, payload = recv_frame(self.request)
+            except (ConnectionError, OSError):
+                return
+            with lock:
+                response = self._dispatch(server, message_type, payload, self.request, self.server.max_file_size)
+            content = ()
+            if isinstance(response, tuple):
+                response, content = response  # The chunks streamed after the response frame
+            send_frame(self.request, message_type | RESPONSE, response)
+            for chunk in content:
+                self.request.sendall(chunk)
+
+    @staticmethod
+    def _dispatch(server, message_type, payload, sock, max_file_size):
+        """
+        Serves one request
+        Return the response payload, or a (payload, chunks) tuple when content is streamed after the response
+        """
+        if message_type == STORE:
+            version, name_length, text, size = _STORE.unpack_from(payload)
+            file_name, _ = _decode_name(name_length, payload, _STORE.size)
+            reader = _ContentReader(sock, size)
+            if size > max_file_size:
+                reader.drain()  # Over the limit of this server process: discarded as it arrives, never stored
+                return b""
+            server.store_file(version, File(file_name, reader, version, size=size, max_size=max_file_size,
+                                            is_text=text))
+            reader.drain()
+            return b""
+        if message_type == MISSING:
+            (chunk_size,) = _MANIFEST.unpack_from(payload)
+            digests = _decode_digests(payload, _MANIFEST.size, (len(payload) - _MANIFEST.size) // 32)
+            # Chunks of another size never match the stored ones, they are all sent
+            missing = server.store.missing_chunks(digests) if chunk_size == server.store.chunk_size else digests
+            return b"".join(bytes.fromhex(digest) for digest in missing)
+        if message_type == UPDATE:
+            version, current_time_ms, name_length, text, size = _UPDATE.unpack_from(payload)
+            file_name, offset = _decode_name(name_length, payload, _UPDATE.size)
+            (chunk_size,) = _MANIFEST.unpack_from(payload, offset)
+            offset += _MANIFEST.size
+            count = -(-size // chunk_size)
+            digests = _decode_digests(payload, offset, count)
+            sent = payload[offset + 32 * count:offset + 33 * count]
+            segments = [(sent[index], digest, min(chunk_size, size - index * chunk_size))
+                        for index, digest in enumerate(digests)]
+            reader = _ManifestReader(sock, segments, server.store.chunks, size)
+            if size > max_file_size:
+                reader.drain()  # Over the limit of this server process: discarded as it arrives, never stored
+                return _BOOL.pack(False)
+            if server.store.missing_chunks(digest for digest, flag in zip(digests, sent) if not flag):
+                reader.drain()  # A chunk not sent was evicted since the MISSING request, the update is retried
+                return _BOOL.pack(False)
+            file = File(file_name, reader, version, size=size, max_size=max_file_size, is_text=text)
+            applied = server.update_file(file, current_time_ms)
+            reader.drain()
+            return _BOOL.pack(bool(applied))
+        if message_type == ACK:
+            return _BOOL.pack(bool(server.send_ack()))
+        if message_type == RETRIEVE:
+            (version,) = _RETRIEVE.unpack(payload)
+            # Same read as retrieve_file, but the stored chunks are streamed instead of joined into one payload
+            response = server.probe_file(None if version < 0 else version)
+            if not response:
+                return _BOOL.pack(False)
+            name_length, name = _encode_name(response["file_name"])
+            text = server.store.entry(response["version"])["text"]
+            header = _FILE.pack(response["version"], name_length, bytes.fromhex(response["hash"]), text,
+                                response["size"])
+            return _BOOL.pack(True) + header + name, list(server.store.iter_chunks(response["version"]))
+        if message_type == PROBE:
+            (version,) = _RETRIEVE.unpack(payload)
+            response = server.probe_file(None if version < 0 else version)
+            if not response:
+                return _BOOL.pack(False)
+            name_length, name = _encode_name(response["file_name"])
+            return (_BOOL.pack(True) + _PROBE.pack(response["version"], name_length, bytes.fromhex(response["hash"]),
+                                                    response["size"]) + name)
+        if message_type == HINT:
+            hint_ms = server.retry_hint_ms()
+            return _TIME.pack(math.nan if hint_ms is None else hint_ms)
+        raise ValueError(f"Unknown message type: {message_type}")
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def _serve(settings, family, address, ready, max_file_size, seed=None):
+    """
+    Entry point of a server process: hosts one Server behind a socket
+    params:
+    settings: the server settings dictionary
+    family: "tcp" or "unix"
+    address: the address to bind ((host, 0) picks a free port)
+    ready: connection on which the bound address is sent back
+    max_file_size: size limit of the received files
+    seed: optional seed of the failure streams of the server (see RandomFaults)
+    """
+    server_class = _ThreadingTCPServer if family == "tcp" else _ThreadingUnixServer
+    with server_class(address, _RequestHandler) as listener:
+        listener.replica = Server(
+            id=settings["id"],
+            weight=settings["weight"],
+            failure_prob=settings["failure_prob"],
+            recovery_delay_min=settings["recovery_delay_min"],
+            recovery_delay_max=settings["recovery_delay_max"],
+            faults=RandomFaults(seed) if seed is not None else None
+        )
+        listener.max_file_size = max_file_size
+        listener.replica_lock = threading.Lock()
+        ready.send(listener.server_address)
+        ready.close()
+        listener.serve_forever()
+
+
+class ConnectionPool:
+    def __init__(self, family, address, max_idle=4):
+        """
+        Pool of persistent connections to one server process
+        params:
+        family: "tcp" or "unix"
+        address: the address of the server process
+        max_idle: maximum number of idle connections kept open
+        """
+        self.family = family
+        self.address = address
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def _connect(self):
+        if self.family == "tcp":
+            sock = socket.create_connection(self.address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+        self.connections_opened += 1
+        return sock
+
+    def request(self, message_type, payload=b"", body=None, content_size=None):
+        """
+        Sends a request on an idle connection (or a new one) and waits for the response
+        Return the response payload, or a (payload, content) tuple when content_size is given
+        params:
+        message_type: the request type
+        payload: the encoded request
+        body: optional iterable of chunks streamed after the request frame
+        content_size: optional function returning, from the response payload, the size of the content
+                      streamed after the response frame
+        """
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        if sock is None:
+            sock = self._connect()
+        try:
+            send_frame(sock, message_type, payload)
+            if body is not None:
+                for chunk in body:
+                    sock.sendall(chunk)
+            response_type, response = recv_frame(sock)
+            content = None
+            if content_size is not None and response_type == message_type | RESPONSE:
+                content = _recv_exactly(sock, content_size(response))
+        except Exception:
+            sock.close()
+            raise
+        if response_type != message_type | RESPONSE:
+            sock.close()
+            raise ConnectionError(f"Unexpected response type {response_type} to request {message_type}")
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                sock = None
+        if sock is not None:
+            sock.close()
+        return response if content_size is None else (response, content)
+
+    def close(self):
+        """
+        Closes the idle connections
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            sock.close()
+
+
+def _retrieved_size(response):
+    """
+    Return the size of the content streamed after a retrieve response (none if the read failed)
+    """
+    if not _BOOL.unpack_from(response)[0]:
+        return 0
+    return _FILE.unpack_from(response, _BOOL.size)[4]
+
+
+class RemoteServer:
+    def __init__(self, settings, pool):
+        """
+        Client-side proxy of a server running in another process, with the interface of Server
+        params:
+        settings: the server settings dictionary (id and weight are known to the client)
+        pool: the ConnectionPool to the server process
+        """
+        self.id = settings["id"]
+        self.weight = settings["weight"]
+        self.pool = pool
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.content_bytes_sent = 0  # Content bytes streamed after the store and update requests
+
+    def _request(self, message_type, payload=b"", body=None, body_size=0, content_size=None):
+        result = self.pool.request(message_type, payload, body, content_size)
+        response, content = (result, None) if content_size is None else result
+        self.bytes_sent += HEADER.size + len(payload) + body_size
+        self.bytes_received += HEADER.size + len(response) + (len(content) if content is not None else 0)
+        self.content_bytes_sent += body_size
+        return result
+
+    def store_file(self, version, file, sender="client"):
+        name_length, name = _encode_name(file.file_name)
+        self._request(STORE, _STORE.pack(version, name_length, file.is_text, file.size) + name, file.iter_chunks(),
+                      file.size)
+
+    def update_file(self, file, current_time_ms, sender="client"):
+        """
+        Sends an update, streaming only the chunks the server does not hold (asked first with a MISSING request)
+        """
+        chunk_size = DEFAULT_CHUNK_SIZE
+        manifest = b"".join(bytes.fromhex(digest) for digest in file.chunk_digests(chunk_size))
+        response = self._request(MISSING, _MANIFEST.pack(chunk_size) + manifest)
+        missing = {response[offset:offset + 32] for offset in range(0, len(response), 32)}
+        sent = bytes(manifest[offset:offset + 32] in missing for offset in range(0, len(manifest), 32))
+        sent_size = sum(min(chunk_size, file.size - index * chunk_size) for index, flag in enumerate(sent) if flag)
+        body = (chunk for chunk, flag in zip(file.iter_chunks(chunk_size), sent) if flag)
+        name_length, name = _encode_name(file.file_name)
+        header = (_UPDATE.pack(file.version, current_time_ms, name_length, file.is_text, file.size) + name
+                  + _MANIFEST.pack(chunk_size) + manifest + sent)
+        return _BOOL.unpack(self._request(UPDATE, header, body, sent_size))[0]
+
+    def send_ack(self):
+        if _BOOL.unpack(self._request(ACK))[0]:
+            return {"status": "received", "server_id": self.id}
+        return None
+
+    def retrieve_file(self, version=None, key=None):
+        if key is not None:
+            raise ValueError("Keyed files are not replicated in the networked mode")
+        try:
+            response, content = self._request(RETRIEVE, _RETRIEVE.pack(-1 if version is None else version),
+                                               content_size=_retrieved_size)
+        except (ConnectionError, OSError):
+            return None  # An unreachable server is a failed read
+        if not _BOOL.unpack_from(response)[0]:
+            return None
+        file_version, name_length, digest, text, _ = _FILE.unpack_from(response, _BOOL.size)
+        file_name, _ = _decode_name(name_length, response, _BOOL.size + _FILE.size)
+        return {
+            "server_id": self.id,
+            "version": file_version,
+            "content": content.decode() if text else content,
+            "file_name": file_name,
+            "hash": digest.hex(),
+        }
+
+    def probe_file(self, version=None, key=None):
+        if key is not None:
+            raise ValueError("Keyed files are not replicated in the networked mode")
+        try:
+            response = self._request(PROBE, _RETRIEVE.pack(-1 if version is None else version))
+        except (ConnectionError, OSError):
+            return None
+        if not _BOOL.unpack_from(response)[0]:
+            return None
+        file_version, name_length, digest, size = _PROBE.unpack_from(response, _BOOL.size)
+        file_name, _ = _decode_name(name_length, response, _BOOL.size + _PROBE.size)
+        return {
+            "server_id": self.id,
+            "version": file_version,
+            "file_name": file_name,
+            "hash": digest.hex(),
+            "size": size,
+        }
+
+    def retry_hint_ms(self):
+        try:
+            (hint_ms,) = _TIME.unpack(self._request(HINT))
+        except (ConnectionError, OSError):
+            return None  # An unreachable server gives no hint
+        return None if math.isnan(hint_ms) else hint_ms
+
+
+class NetworkedCluster:
+    def __init__(self, server_settings, family="tcp", max_idle=4, max_file_size=DEFAULT_MAX_SIZE, seed=None):
+        """
+        Runs every server of a cluster in its own process behind a local socket
+        The servers attribute holds RemoteServer proxies usable in place of Server objects
+        params:
+        server_settings: list of server dictionaries
+        family: "tcp" (localhost) or "unix" (Unix domain sockets)
+        max_idle: idle connections kept open per server
+        max_file_size: size limit of the files accepted by the servers
+        seed: optional seed of the failures drawn by the server processes; each server draws from its own
+              stream (see RandomFaults), so a seeded run is reproducible
+        """
+        if family not in ("tcp", "unix"):
+            raise ValueError(f"Unknown socket family: {family}")
+        self.family = family
+        self.processes = []
+        self.servers = []
+        self._socket_dir = tempfile.mkdtemp(prefix="consensus-") if family == "unix" else None
+        context = multiprocessing.get_context("spawn")
+        try:
+            for settings in server_settings:
+                if family == "tcp":
+                    address = ("127.0.0.1", 0)
+                else:
+                    address = os.path.join(self._socket_dir, f"server-{settings['id']}.sock")
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(target=_serve,
+                                          args=(settings, family, address, sender, max_file_size, seed), daemon=True)
+                process.start()
+                sender.close()
+                bound_address = receiver.recv()
+                receiver.close()
+                self.processes.append(process)
+                self.servers.append(RemoteServer(settings, ConnectionPool(family, bound_address, max_idle)))
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Closes the connections and stops the server processes
+        """
+        for server in self.servers:
+            server.pool.close()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.servers = []
+        self.processes = []
+        if self._socket_dir is not None:
+            for name in os.listdir(self._socket_dir):
+                os.unlink(os.path.join(self._socket_dir, name))
+            os.rmdir(self._socket_dir)
+            self._socket_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,63 @@
+QUORUM_MODES = ("all", "majority", "weighted")
+
+
+class Quorum:
+    def __init__(self, servers, mode="all"):
+        """
+        Decides whether a group of servers is large enough to commit an update or a restore
+        params:
+        servers: the list of Server objects forming the cluster
+        mode: "all" requires every server, "majority" more than half of the servers,
+              "weighted" more than half of the total Server.weight
+        """
+        if mode not in QUORUM_MODES:
+            raise ValueError(f"Unknown quorum mode: {mode}")
+        self.mode = mode
+        self.cluster_size = len(servers)
+        self.total_weight = sum(server.weight for server in servers)
+
+    def reached(self, count, weight):
+        """
+        Return True if a group with the given number of servers and total weight forms a quorum
+        params:
+        count: number of servers in the group
+        weight: sum of the weights of the servers in the group
+        """
+        if self.mode == "majority":
+            return count > self.cluster_size / 2
+        if self.mode == "weighted":
+            return weight > self.total_weight / 2
+        return count == self.cluster_size
+
+    def tally(self):
+        """
+        Return an empty QuorumTally for this quorum
+        """
+        return QuorumTally(self)
+
+
+class QuorumTally:
+    def __init__(self, quorum):
+        """
+        Running count and weight of the servers that answered, checked against a quorum in constant time
+        params:
+        quorum: the Quorum to reach
+        """
+        self.quorum = quorum
+        self.count = 0
+        self.weight = 0
+
+    def add(self, server):
+        """
+        Counts a server that answered
+        params:
+        server: a Server object
+        """
+        self.count += 1
+        self.weight += server.weight
+
+    def reached(self):
+        """
+        Return True if the servers counted so far form a quorum
+        """
+        return self.quorum.reached(self.count, self.weight)
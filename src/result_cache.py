@@ -0,0 +1,133 @@
+import glob
+import hashlib
+import json
+import os
+
+from metrics import Metrics
+
+CACHE_VERSION = 1  # Bump when the meaning of a cached trial changes (e.g. how run_trials seeds a trial)
+# Modules that only drive or analyse the simulations: editing them does not invalidate the cached trials.
+# How a trial is seeded and run lives in trials.py, which is part of the code version
+_RUNNER_MODULES = ("simulation_runner.py", "benchmark.py", "estimator.py", "result_cache.py")
+
+
+def code_version(directory=None):
+    """
+    Return a digest of the simulation code: the modules of the source directory (trials.py included), except
+    the runner, benchmark and estimator modules
+    params:
+    directory: the source directory (defaults to the directory of this module)
+    """
+    directory = directory or os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(directory, "*.py"))):
+        name = os.path.basename(path)
+        if name in _RUNNER_MODULES:
+            continue
+        with open(path, "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory, version=None):
+        """
+        On-disk cache of the trial outcomes of simulation_runner, one JSON lines file per configuration
+        A configuration is identified by a canonical hash of the whole configuration dictionary (its name
+        included, as it seeds the trials), the number of updates, the sweep seed and the code version, so
+        a changed point of the grid or a change of the simulation code gets a new entry
+        Trials are appended as they complete: an interrupted sweep keeps what it ran, and a sweep asking for
+        more trials than cached only runs the missing ones
+        params:
+        directory: directory of the cache files (created if needed)
+        version: the code version in the key (defaults to code_version())
+        """
+        self.directory = directory
+        self.version = version if version is not None else code_version()
+        self._files = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, config, num_updates, base_seed):
+        """
+        Return the cache key of a configuration
+        params:
+        config: a configuration dictionary
+        num_updates: number of updates per simulation
+        base_seed: the seed of the sweep
+        """
+        material = {"config": config, "num_updates": num_updates, "seed": base_seed, "code_version": self.version,
+                    "cache_version": CACHE_VERSION}
+        canonical = json.dumps(material, sort_keys=True, separators=(",", ":"), default=repr)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.jsonl")
+
+    def load(self, config, num_updates, base_seed, with_metrics=True):
+        """
+        Return the cached trials of a configuration as a dictionary trial -> (success, metrics)
+        A truncated last line (interrupted write) is ignored
+        params:
+        config: a configuration dictionary
+        num_updates: number of updates per simulation
+        base_seed: the seed of the sweep
+        with_metrics: if True, trials cached without metrics are left out, so they are run again
+        """
+        path = self._path(self.key(config, num_updates, base_seed))
+        trials = {}
+        if not os.path.exists(path):
+            return trials
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "trial" not in record:
+                    continue  # Header
+                metrics = record.get("metrics")
+                if with_metrics and metrics is None:
+                    continue
+                trials[record["trial"]] = (record["success"], Metrics.from_dict(metrics) if with_metrics else None)
+        return trials
+
+    def append(self, config, num_updates, base_seed, trial, success, metrics=None):
+        """
+        Records the outcome of a trial
+        params:
+        config: a configuration dictionary
+        num_updates: number of updates per simulation
+        base_seed: the seed of the sweep
+        trial: index of the trial
+        success: True if the trial restored the expected version
+        metrics: optional Metrics of the trial
+        """
+        key = self.key(config, num_updates, base_seed)
+        f = self._files.get(key)
+        if f is None:
+            path = self._path(key)
+            new = not os.path.exists(path)
+            f = self._files[key] = open(path, "a")
+            if new:
+                f.write(json.dumps({"name": config["name"], "num_updates": num_updates, "seed": base_seed,
+                                    "code_version": self.version}) + "\n")
+        record = {"trial": trial, "success": success, "metrics": metrics.to_dict() if metrics is not None else None}
+        f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        """
+        Closes the cache files
+        """
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
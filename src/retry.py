@@ -0,0 +1,69 @@
+import random
+
+
+class FixedRetryPolicy:
+    use_hints = False  # The hints are ignored, so the servers are not asked for them
+
+    def __init__(self, period_ms):
+        """
+        Retries every server after the same fixed period
+        params:
+        period_ms: time in milliseconds between two attempts
+        """
+        self.period_ms = period_ms
+
+    def delay_ms(self, attempt, current_time_ms, hint_ms=None):
+        """
+        Return the time to wait before the next attempt
+        params:
+        attempt: number of failed attempts so far
+        current_time_ms: the current clock time
+        hint_ms: time at which the server said it will be back, if known (ignored)
+        """
+        return self.period_ms
+
+
+class BackoffRetryPolicy:
+    def __init__(self, base_delay_ms=5, multiplier=2.0, max_delay_ms=200, jitter=0.5, use_hints=True, seed=None,
+                 rng=None):
+        """
+        Retries with exponential backoff and jitter, waiting for the recovery hint of a server when it reports one
+        The jitter is drawn from a generator of its own, never from the random module, so other draws (fault
+        injection, trial seeding, client code) do not shift the retry schedule; run_simulation(seed=...) reseeds
+        it from the seed of the simulation
+        params:
+        base_delay_ms: delay after the first failed attempt
+        multiplier: growth factor of the delay after each failed attempt
+        max_delay_ms: upper bound of the backoff delay
+        jitter: fraction of the delay removed at random, spreads the retries of different servers
+        use_hints: if True, never retry a server before the recovery time it reported
+        seed: optional seed of the jitter generator (unseeded by default)
+        rng: optional random.Random used for the jitter instead of a generator of the seed
+        """
+        self.base_delay_ms = base_delay_ms
+        self.multiplier = multiplier
+        self.max_delay_ms = max_delay_ms
+        self.jitter = jitter
+        self.use_hints = use_hints
+        self.rng = rng if rng is not None else random.Random(seed)
+
+    def reseed(self, seed):
+        """
+        Restarts the jitter from a stream derived from a seed (e.g. the seed of a simulation)
+        """
+        self.rng = random.Random(f"{seed}:retry")
+
+    def delay_ms(self, attempt, current_time_ms, hint_ms=None):
+        """
+        Return the time to wait before the next attempt
+        params:
+        attempt: number of failed attempts so far
+        current_time_ms: the current clock time
+        hint_ms: time at which the server said it will be back, if known
+        """
+        delay = min(self.base_delay_ms * self.multiplier ** max(attempt - 1, 0), self.max_delay_ms)
+        if self.jitter:
+            delay -= delay * self.jitter * self.rng.random()
+        if self.use_hints and hint_ms is not None:
+            delay = max(delay, hint_ms - current_time_ms)
+        return delay
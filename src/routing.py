@@ -0,0 +1,48 @@
+class ReadRouter:
+    def __init__(self, decay=0.2, latency_scale_ms=1.0):
+        """
+        Ranks the servers for the restore reads from running per-server scores
+        Each read updates an exponentially weighted success rate and latency of the server; the score of a
+        server is its weight times its success rate, divided by 1 + latency / latency_scale_ms. Servers never
+        read start with a perfect score, so they are tried on merit of their weight
+        The latency is measured on the clock of the consensus (zero for in-memory servers on a VirtualClock),
+        so a seeded simulation ranks the servers the same way on every run
+        params:
+        decay: weight of the newest read in the running averages
+        latency_scale_ms: latency at which the score of a server is halved
+        """
+        self.decay = decay
+        self.latency_scale_ms = latency_scale_ms
+        self._success_rate = {}  # server id -> running success rate
+        self._latency_ms = {}  # server id -> running latency of the successful reads
+
+    def record(self, server, success, latency_ms=None):
+        """
+        Updates the scores of a server after a read
+        params:
+        server: the Server that was read
+        success: True if the server answered
+        latency_ms: optional duration of the read in milliseconds
+        """
+        rate = self._success_rate.get(server.id, 1.0)
+        self._success_rate[server.id] = rate + self.decay * ((1.0 if success else 0.0) - rate)
+        if success and latency_ms is not None:
+            latency = self._latency_ms.get(server.id, latency_ms)
+            self._latency_ms[server.id] = latency + self.decay * (latency_ms - latency)
+
+    def score(self, server):
+        """
+        Return the current score of a server, higher is better
+        """
+        latency = self._latency_ms.get(server.id, 0.0)
+        return server.weight * self._success_rate.get(server.id, 1.0) / (1 + latency / self.latency_scale_ms)
+
+    def rank(self, servers, avoid=()):
+        """
+        Return the servers best first; servers in avoid (e.g. known to be unresponsive) come last
+        Equal scores keep the order of the cluster
+        params:
+        servers: the servers of the cluster, in cluster order
+        avoid: servers to query only when the others are not enough
+        """
+        return sorted(servers, key=lambda server: (server in avoid, -self.score(server)))
@@ -1,121 +1,401 @@
-import hashlib
-import random
-
-class Server:
-    def __init__(self, id, failure_prob ,weight, recovery_delay_min, recovery_delay_max):
-        """
-        Represents a server node
-	params:
-        id: a unique identifier for the server
-        """
-        self.id = id
-        self.file_version = None
-        self.file_content = None
-        self.file_hash = None
-        self.file_name = None
-        self.operational = True  # Indicates if the server is currently operational
-        self.recovery_time_ms = 0  # Time in ms when the server will recover if not operational
-        self.failure_prob = failure_prob
-        self.weight = weight
-        self.recovery_delay_min = recovery_delay_min
-        self.recovery_delay_max = recovery_delay_max
-
-    def store_file(self, version, file, sender="client"):
-        """
-        Stores a file initially sent by the client
-	params:
-        version: the version of the file
-        file: a File object
-        """
-        if sender != "client":
-            print(f"Server {self.id}: Store rejected - unauthorized sender.\n")
-            return
-        is_valid, message = file.is_valid()
-        if not is_valid:
-            print(f"Server {self.id}: Validation failed - {message}")
-            return
-        self.file_version = version
-        self.file_content = file.content
-        self.file_hash = hashlib.sha256(file.content.encode()).hexdigest()
-        print(f"Server {self.id}: File stored. Version: {version}, Hash: {self.file_hash}.\n")
-
-    def update_file(self, file, current_time_ms, sender="client"):
-        """
-        Updates the stored file with a new version, if valid and the server is operational
-        If the server is not operational, it simulates a failure
-	Return: True if the update was applied, False otherwise
-	params:
-        file: a File object to update
-        current_time_ms: the current simulation time in milliseconds
-        """
-        if not self.operational:
-            if current_time_ms >= self.recovery_time_ms:
-                # Server becomes operational again
-                self.operational = True
-                print(f"Server {self.id}: Recovered and operational.\n")
-            else:
-                print(f"Server {self.id}: Not operational.\n")
-                return False
-
-        # Validate the file before applying the update
-        if sender != "client":
-            print(f"Server {self.id}: Update rejected - unauthorized sender.\n")
-            return
-        is_valid, message = file.is_valid()
-        if not is_valid:
-            print(f"Server {self.id}: Validation failed - {message}\n")
-            return False
-
-        # Check if the file version is newer than the current version
-        if self.file_version is not None and file.version <= self.file_version:
-            print(f"Server {self.id}: Update rejected - Received version {file.version} "
-                  f"is not newer than current version {self.file_version}.\n")
-            return False
-
-        # Simulate a random failure in applying the update
-        if random.random() < self.failure_prob:
-            self.operational = False
-            random_delay = random.randint(self.recovery_delay_min, self.recovery_delay_max)
-            self.recovery_time_ms = current_time_ms + random_delay
-            print(f"Server {self.id}: Failed to apply the update.\n")
-            return False
-
-        # Apply the update
-        self.file_version = file.version
-        self.file_content = file.content
-        self.file_name = file.file_name
-        self.file_hash = hashlib.sha256(file.content.encode()).hexdigest()
-        print(f"Server {self.id}: File updated successfully. Version: {self.file_version}, Hash: {self.file_hash}.\n")
-        return True
-
-    def send_ack(self):
-        """
-        Sends an acknowledgment only if the update was successfully applied
-        Return: a dictionary representing the ACK status
-        """
-        print(f"Server {self.id}: ACK sent.\n")
-        return {"status": "received", "server_id": self.id}
-
-    def retrieve_file(self):
-        """
-        Returns the current file content and its version
-        Simulates a failure with a configurable probability
-        """
-        if random.random() < 0.2:  # 20% probability of failure
-            print(f"Server {self.id}: Simulated failure. No file returned.\n")
-            return None
-
-        if self.file_version and self.file_content:
-            print(f"Server {self.id}: Returning file. Version: {self.file_version}, Hash: {self.file_hash}.\n")
-            return {
-                "server_id": self.id,
-                "version": self.file_version,
-                "content": self.file_content,
-                "file_name": self.file_name,
-            }
-        else:
-            print(f"Server {self.id}: No valid file available.\n")
-            return None
-
-
-
+import events
+from events import NULL_SINK
+from faults import DEFAULT_FAULTS
+from metrics import NULL_METRICS
+from storage import KeyedStore, VersionLog
+
+class Server:
+    # Slots instead of a per-instance dictionary: simulated clusters hold up to ~10^5 servers
+    __slots__ = ("id", "file_version", "file_hash", "file_name", "operational", "recovery_time_ms", "failure_prob",
+                 "weight", "recovery_delay_min", "recovery_delay_max", "clock", "event_sink", "store", "metrics",
+                 "faults", "bytes_received", "files")
+
+    def __init__(self, id, failure_prob ,weight, recovery_delay_min, recovery_delay_max, clock=None,
+                 event_sink=None, store=None, metrics=None, faults=None, files=None):
+        """
+        Represents a server node
+	params:
+        id: a unique identifier for the server
+        clock: optional Clock used to schedule the recovery after a failure
+        event_sink: optional EventSink receiving the server events (discarded by default)
+        store: the replica storage keeping the recent versions (defaults to a VersionLog); a server given
+               a store that already holds versions (e.g. a reopened DurableVersionLog) starts from its latest one
+        metrics: optional Metrics recording failures, recoveries, hash computations and stored bytes
+        faults: the source of the update and read failures (see faults.py); defaults to draws from the
+                random module
+        files: optional KeyedStore holding the keyed files (see update_files), created on the first keyed
+               update otherwise
+        """
+        self.id = id
+        self.file_version = None
+        self.file_hash = None
+        self.file_name = None
+        self.operational = True  # Indicates if the server is currently operational
+        self.recovery_time_ms = 0  # Time in ms when the server will recover if not operational
+        self.failure_prob = failure_prob
+        self.weight = weight
+        self.recovery_delay_min = recovery_delay_min
+        self.recovery_delay_max = recovery_delay_max
+        self.clock = clock
+        self.event_sink = event_sink if event_sink is not None else NULL_SINK
+        self.store = store if store is not None else VersionLog()
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        self.faults = faults if faults is not None else DEFAULT_FAULTS
+        latest_version = self.store.latest_version()
+        if latest_version is not None:
+            entry = self.store.entry(latest_version)
+            self.file_version = latest_version
+            self.file_hash = entry["hash"]
+            self.file_name = entry["file_name"]
+        self.bytes_received = 0  # Content bytes the replica did not already hold
+        self.files = files
+
+    @property
+    def file_content(self):
+        """
+        The content of the current version, rebuilt from the replica storage
+        """
+        if self.file_version is None:
+            return None
+        return self.store.get(self.file_version)
+
+    def _emit(self, type, time_ms=None, **fields):
+        """
+        Sends an event to the event sink, stamped with the clock time when no time is given
+        Callers check event_sink.enabled first, so disabled events cost no formatting
+        """
+        if time_ms is None and self.clock is not None:
+            time_ms = self.clock.now_ms()
+        self.event_sink.emit(type, f"server {self.id}", time_ms, **fields)
+
+    def store_file(self, version, file, sender="client"):
+        """
+        Stores a file initially sent by the client
+	params:
+        version: the version of the file
+        file: a File object
+        """
+        if sender != "client":
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, operation="store", reason="unauthorized sender")
+            return
+        is_valid, message = file.is_valid()
+        if not is_valid:
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, operation="store", reason=message)
+            return
+        self.file_version = version
+        added_bytes, self.file_hash = self.store.put_chunks(version, file.iter_chunks(self.store.chunk_size),
+                                                            file_name=file.file_name, text=file.is_text)
+        self.bytes_received += added_bytes
+        if self.metrics.enabled:
+            self.metrics.incr("hash_computations")
+            self.metrics.incr("replica_bytes_stored", added_bytes)
+        if self.event_sink.enabled:
+            self._emit(events.STORED, version=version, hash=self.file_hash)
+
+    def update_file(self, file, current_time_ms, sender="client"):
+        """
+        Updates the stored file with a new version, if valid and the server is operational
+        If the server is not operational, it simulates a failure
+	Return: True if the update was applied, False otherwise
+	params:
+        file: a File object to update
+        current_time_ms: the current simulation time in milliseconds
+        """
+        if not self._recover_if_due(current_time_ms):
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, version=file.version, reason="not operational",
+                           recovery_time_ms=self.recovery_time_ms)
+            return False
+
+        # Validate the file before applying the update
+        if sender != "client":
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, version=file.version, reason="unauthorized sender")
+            return
+        is_valid, message = file.is_valid()
+        if not is_valid:
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, version=file.version, reason=message)
+            return False
+
+        # Check if the file version is newer than the current version
+        if self.file_version is not None and file.version <= self.file_version:
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, version=file.version, reason="stale version",
+                           current_version=self.file_version)
+            return False
+
+        # Simulate a random failure in applying the update
+        random_delay = self.faults.update_failure(self)
+        if random_delay is not None:
+            self._fail(current_time_ms, random_delay, version=file.version)
+            return False
+
+        # Apply the update
+        self.file_version = file.version
+        self.file_name = file.file_name
+        # The chunks are hashed and stored as they are received, the content is never copied as a whole
+        added_bytes, self.file_hash = self.store.put_chunks(file.version, file.iter_chunks(self.store.chunk_size),
+                                                            file_name=file.file_name, text=file.is_text)
+        self.bytes_received += added_bytes
+        if self.metrics.enabled:
+            self.metrics.incr("hash_computations")
+            self.metrics.incr("replica_bytes_stored", added_bytes)
+        if self.event_sink.enabled:
+            self._emit(events.UPDATE_APPLIED, current_time_ms, version=self.file_version, hash=self.file_hash)
+        return True
+
+    def update_files(self, files, current_time_ms, sender="client"):
+        """
+        Applies new versions of several keyed files received in one round trip
+        The round trip fails as a whole, with the failure probability of a single update; otherwise every
+        valid file newer than the version held for its key is stored
+        Return the keys whose version was applied (the ACK of the round trip), an empty list if none was
+        params:
+        files: dictionary file key -> File object
+        current_time_ms: the current simulation time in milliseconds
+        """
+        if not self._recover_if_due(current_time_ms):
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, keys=list(files), reason="not operational",
+                           recovery_time_ms=self.recovery_time_ms)
+            return []
+        if sender != "client":
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_REJECTED, current_time_ms, keys=list(files), reason="unauthorized sender")
+            return []
+
+        accepted = {}
+        for key, file in files.items():
+            is_valid, message = file.is_valid()
+            if not is_valid:
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_REJECTED, current_time_ms, key=key, version=file.version, reason=message)
+                continue
+            current_version = self.file_version_of(key)
+            if current_version is not None and file.version <= current_version:
+                if self.event_sink.enabled:
+                    self._emit(events.UPDATE_REJECTED, current_time_ms, key=key, version=file.version,
+                               reason="stale version", current_version=current_version)
+                continue
+            accepted[key] = file
+        if not accepted:
+            return []
+
+        random_delay = self.faults.update_failure(self)
+        if random_delay is not None:
+            self._fail(current_time_ms, random_delay, keys=list(accepted))
+            return []
+
+        if self.files is None:
+            self.files = KeyedStore()
+        for key, file in accepted.items():
+            log = self.files.log(key, create=True)
+            added_bytes, file_hash = log.put_chunks(file.version, file.iter_chunks(log.chunk_size),
+                                                    file_name=file.file_name, text=file.is_text)
+            self.bytes_received += added_bytes
+            if self.metrics.enabled:
+                self.metrics.incr("hash_computations")
+                self.metrics.incr("replica_bytes_stored", added_bytes)
+            if self.event_sink.enabled:
+                self._emit(events.UPDATE_APPLIED, current_time_ms, key=key, version=file.version, hash=file_hash)
+        return list(accepted)
+
+    def file_version_of(self, key):
+        """
+        Return the latest version held for a file key, or None if the key is not held
+        """
+        log = self.files.log(key) if self.files is not None else None
+        return log.latest_version() if log is not None else None
+
+    def apply_repair(self, version, manifest, chunks, entry, current_time_ms):
+        """
+        Installs a version copied from another replica by the anti-entropy task (see AntiEntropy)
+        Return True if the version was installed, False if the server is not operational
+        params:
+        version: the version number
+        manifest: the digests of the chunks of the version
+        chunks: dictionary digest -> data of the chunks this replica did not hold
+        entry: the metadata of the version on the source replica (VersionLog.entry)
+        current_time_ms: the current simulation time in milliseconds
+        """
+        if not self._recover_if_due(current_time_ms):
+            return False
+        added_bytes = self.store.put_manifest(version, manifest, chunks, file_name=entry["file_name"],
+                                              file_hash=entry["hash"], size=entry["size"], text=entry["text"])
+        self.file_version = version
+        self.file_hash = entry["hash"]
+        self.file_name = entry["file_name"]
+        self.bytes_received += added_bytes
+        if self.metrics.enabled:
+            self.metrics.incr("replica_bytes_stored", added_bytes)
+        if self.event_sink.enabled:
+            self._emit(events.UPDATE_APPLIED, current_time_ms, version=version, hash=self.file_hash, repair=True)
+        return True
+
+    def retry_hint_ms(self):
+        """
+        Return the time at which the server expects to be operational again, or None if it is operational
+        """
+        if self.operational:
+            return None
+        return self.recovery_time_ms
+
+    def _recover_if_due(self, current_time_ms):
+        """
+        Brings a failed server back once its recovery time has passed
+        Return True if the server is operational
+        params:
+        current_time_ms: the current simulation time in milliseconds
+        """
+        if self.operational:
+            return True
+        if current_time_ms < self.recovery_time_ms:
+            return False
+        self.operational = True
+        if self.event_sink.enabled:
+            self._emit(events.RECOVERY, current_time_ms)
+        if self.metrics.enabled:
+            self.metrics.incr("server_recoveries")
+        return True
+
+    def _fail(self, current_time_ms, delay_ms, **fields):
+        """
+        Takes the server down for delay_ms after a simulated failure of an update
+        params:
+        current_time_ms: the current simulation time in milliseconds
+        delay_ms: the recovery delay drawn for the failure
+        fields: the update that failed, for the FAILURE event
+        """
+        self.operational = False
+        self.recovery_time_ms = current_time_ms + delay_ms
+        if self.clock is not None:
+            self.clock.call_at(self.recovery_time_ms, self._recover, self.recovery_time_ms)
+        if self.event_sink.enabled:
+            self._emit(events.FAILURE, current_time_ms, **fields, recovery_time_ms=self.recovery_time_ms)
+        if self.metrics.enabled:
+            self.metrics.incr("server_failures")
+            self.metrics.observe("recovery_delay_ms", delay_ms)
+
+    def _recover(self, recovery_time_ms):
+        """
+        Recovery event scheduled on the clock when the server fails
+        Ignored if the server already recovered or failed again in the meantime
+        params:
+        recovery_time_ms: the recovery time the event was scheduled for
+        """
+        if not self.operational and self.recovery_time_ms == recovery_time_ms:
+            self.operational = True
+            if self.event_sink.enabled:
+                self._emit(events.RECOVERY, recovery_time_ms)
+            if self.metrics.enabled:
+                self.metrics.incr("server_recoveries")
+
+    def send_ack(self):
+        """
+        Sends an acknowledgment only if the update was successfully applied
+        Return: a dictionary representing the ACK status
+        """
+        if self.event_sink.enabled:
+            self._emit(events.ACK)
+        return {"status": "received", "server_id": self.id}
+
+    def probe_file(self, version=None, key=None):
+        """
+        Returns the version, name, SHA-256 digest and size of the current file, without its content
+        restore_consensus votes on this metadata and fetches the content from a single server
+        Fails with the same probability as retrieve_file
+        params:
+        version: optional recent version to describe instead of the current one
+        key: optional key of a keyed file (see update_files) to describe instead of the single file
+        """
+        if self.faults.read_failure(self):  # 20% probability of failure by default
+            if self.event_sink.enabled:
+                self._emit(events.READ_FAILURE, reason="simulated failure")
+            return None
+        if key is not None:
+            return self._describe_keyed(key, version)
+        return self._describe(version)
+
+    def retrieve_file(self, version=None, key=None):
+        """
+        Returns the current file content, its version and the SHA-256 digest computed when it was stored
+        Simulates a failure with a configurable probability
+        params:
+        version: optional recent version to return instead of the current one
+        key: optional key of a keyed file (see update_files) to return instead of the single file
+        """
+        if self.faults.read_failure(self):  # 20% probability of failure by default
+            if self.event_sink.enabled:
+                self._emit(events.READ_FAILURE, reason="simulated failure")
+            return None
+        if key is not None:
+            response = self._describe_keyed(key, version)
+            if response is not None:
+                response["content"] = self.files.log(key).get(response["version"])
+            return response
+        response = self._describe(version)
+        if response is not None:
+            response["content"] = self.store.get(response["version"])
+        return response
+
+    def _describe_keyed(self, key, version=None):
+        """
+        Return the metadata of a version of a keyed file (the latest one by default), or None if it is not held
+        """
+        log = self.files.log(key) if self.files is not None else None
+        if version is None and log is not None:
+            version = log.latest_version()
+        entry = log.entry(version) if log is not None and version is not None else None
+        if entry is None:
+            if self.event_sink.enabled:
+                self._emit(events.READ_FAILURE, reason="version not stored", key=key, version=version)
+            return None
+        if self.event_sink.enabled:
+            self._emit(events.READ, key=key, version=version, hash=entry["hash"])
+        return {
+            "server_id": self.id,
+            "key": key,
+            "version": version,
+            "file_name": entry["file_name"],
+            "hash": entry["hash"],
+            "size": entry["size"],
+        }
+
+    def _describe(self, version=None):
+        """
+        Return the metadata of the requested version (the current one by default), or None if it is not held
+        """
+        if version is not None and version != self.file_version:
+            entry = self.store.entry(version)
+            if entry is None:
+                if self.event_sink.enabled:
+                    self._emit(events.READ_FAILURE, reason="version not stored", version=version)
+                return None
+            if self.event_sink.enabled:
+                self._emit(events.READ, version=version, hash=entry["hash"])
+            return {
+                "server_id": self.id,
+                "version": version,
+                "file_name": entry["file_name"],
+                "hash": entry["hash"],
+                "size": entry["size"],
+            }
+
+        entry = self.store.entry(self.file_version) if self.file_version else None
+        if entry is not None and entry["size"]:
+            if self.event_sink.enabled:
+                self._emit(events.READ, version=self.file_version, hash=self.file_hash)
+            return {
+                "server_id": self.id,
+                "version": self.file_version,
+                "file_name": self.file_name,
+                "hash": self.file_hash,
+                "size": entry["size"],
+            }
+        else:
+            if self.event_sink.enabled:
+                self._emit(events.READ_FAILURE, reason="no valid file")
+            return None
@@ -0,0 +1,52 @@
+import bisect
+import hashlib
+
+
+def _ring_point(label):
+    """
+    Return the position of a label on the ring: the first 8 bytes of its SHA-256 digest
+    """
+    return int.from_bytes(hashlib.sha256(label.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, servers, replication=3, virtual_nodes=64):
+        """
+        Places the keyed files on subsets of the servers by consistent hashing
+        Each server owns virtual_nodes points of a hash ring; a file is replicated on the first replication
+        distinct servers found clockwise from the point of its key. Every server holds about
+        replication / len(servers) of the files, and adding or removing a server only moves the files of its
+        neighbouring points
+        params:
+        servers: the servers of the cluster
+        replication: number of servers holding each file (capped to the cluster size)
+        virtual_nodes: number of points of each server on the ring; more points even out the load
+        """
+        if replication < 1:
+            raise ValueError(f"The replication factor must be at least 1: {replication}")
+        self.servers = servers
+        self.replication = min(replication, len(servers))
+        ring = sorted((_ring_point(f"{server.id}#{index}"), position)
+                      for position, server in enumerate(servers) for index in range(virtual_nodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [position for _, position in ring]
+        self._replicas = {}  # file key -> replica servers, computed once per key
+
+    def replicas(self, key):
+        """
+        Return the servers holding a file, in the order of the cluster
+        params:
+        key: the file key
+        """
+        replicas = self._replicas.get(key)
+        if replicas is None:
+            start = bisect.bisect(self._points, _ring_point(str(key)))
+            owners = []
+            for index in range(len(self._owners)):
+                owner = self._owners[(start + index) % len(self._owners)]
+                if owner not in owners:
+                    owners.append(owner)
+                    if len(owners) == self.replication:
+                        break
+            replicas = self._replicas[key] = [self.servers[position] for position in sorted(owners)]
+        return replicas
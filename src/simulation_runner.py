@@ -1,138 +1,483 @@
-import os
-import pandas as pd
-from main import run_simulation
-
-os.makedirs("simulation_results", exist_ok=True)
-
-# Configurations to test
-
-configs = [
-    {
-        "name": "Stress_test", # worst case
-        "retry_limit": 1,
-        "retry_period_ms": 5,
-        "ack_timeout_ms": 2,
-        "server_settings": [
-            {"id": 1, "failure_prob": 0.4, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 50},
-            {"id": 2, "failure_prob": 0.5, "weight": 5,  "recovery_delay_min": 40, "recovery_delay_max": 60},
-            {"id": 3, "failure_prob": 0.6, "weight": 2,  "recovery_delay_min": 50, "recovery_delay_max": 70},
-        ]
-    },
-    {
-            "name": "Higher_retry", # test retry in the worst case
-            "retry_limit": 5,
-            "retry_period_ms": 20,
-            "ack_timeout_ms": 10,
-            "server_settings": [
-                {"id": 1, "failure_prob": 0.4, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 50},
-                {"id": 2, "failure_prob": 0.5, "weight": 5,  "recovery_delay_min": 40, "recovery_delay_max": 60},
-                {"id": 3, "failure_prob": 0.6, "weight": 2,  "recovery_delay_min": 50, "recovery_delay_max": 70},
-            ]
-    },
-    {
-            "name": "Low_retry_High_failure", # bad case
-            "retry_limit": 3,
-            "retry_period_ms": 10,
-            "ack_timeout_ms": 5,
-            "server_settings": [
-                {"id": 1, "failure_prob": 0.2, "weight": 10, "recovery_delay_min": 15, "recovery_delay_max": 25},
-                {"id": 2, "failure_prob": 0.3, "weight": 7,  "recovery_delay_min": 20, "recovery_delay_max": 30},
-                {"id": 3, "failure_prob": 0.5, "weight": 2,  "recovery_delay_min": 25, "recovery_delay_max": 35},
-            ]
-    },
-    {
-        "name": "High_retry_Medium_failure", # medium (realistic) case
-        "retry_limit": 5,
-        "retry_period_ms": 20,
-        "ack_timeout_ms": 10,
-        "server_settings": [
-            {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 5,  "recovery_delay_max": 15},
-            {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 15, "recovery_delay_max": 25},
-            {"id": 3, "failure_prob": 0.3, "weight": 2,  "recovery_delay_min": 20, "recovery_delay_max": 30},
-        ]
-    },
-    {
-        "name": "Reliable", # best case
-        "retry_limit": 3,
-        "retry_period_ms": 10,
-        "ack_timeout_ms": 5,
-        "server_settings": [
-            {"id": 1, "failure_prob": 0.05, "weight": 10, "recovery_delay_min": 5,  "recovery_delay_max": 15},
-            {"id": 2, "failure_prob": 0.1,  "weight": 9,  "recovery_delay_min": 8,  "recovery_delay_max": 18},
-            {"id": 3, "failure_prob": 0.1,  "weight": 8,  "recovery_delay_min": 10, "recovery_delay_max": 20},
-        ]
-    },
-
-    {
-       "name": "Low_retry_Low_failure", # good servers but strict protocol
-       "retry_limit": 1,
-       "retry_period_ms": 5,
-       "ack_timeout_ms": 2,
-       "server_settings": [
-           {"id": 1, "failure_prob": 0.05, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
-           {"id": 2, "failure_prob": 0.1, "weight": 9, "recovery_delay_min": 12, "recovery_delay_max": 30},
-           {"id": 3, "failure_prob": 0.1, "weight": 8, "recovery_delay_min": 15, "recovery_delay_max": 35},
-       ]
-    },
-    {
-       "name": "High_Retry_High_Latency", # latency on recovery
-       "retry_limit": 6,
-       "retry_period_ms": 20,
-       "ack_timeout_ms": 12,
-       "server_settings": [
-           {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 60},
-           {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 25, "recovery_delay_max": 55},
-           {"id": 3, "failure_prob": 0.3, "weight": 5,  "recovery_delay_min": 20, "recovery_delay_max": 50},
-       ]
-    },
-    {
-       "name": "Weight_fallback_test", # with 4 servers is better (majority of 2 and 3 could prevent the wighted fallback)
-       "retry_limit": 3,
-       "retry_period_ms": 10,
-       "ack_timeout_ms": 6,
-       "server_settings": [
-           {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
-           {"id": 2, "failure_prob": 0.5, "weight": 3, "recovery_delay_min": 10, "recovery_delay_max": 20},
-           {"id": 3, "failure_prob": 0.5, "weight": 2, "recovery_delay_min": 10, "recovery_delay_max": 20},
-       ]
-    },
-
-]
-
-
-summary = []
-
-for config in configs:
-    print(f"\n Running configuration: {config['name']}")
-    restore_success_count = 0
-
-    # 100 simulazioni
-    for i in range(100):
-        restored, expected = run_simulation(
-            server_settings=config["server_settings"],
-            retry_limit=config["retry_limit"],
-            retry_period_ms=config["retry_period_ms"],
-            ack_timeout_ms=config["ack_timeout_ms"],
-            num_updates=5
-        )
-
-        if restored and restored["version"] == expected.version:
-            restore_success_count += 1
-
-    accuracy = restore_success_count / 100
-
-    summary.append({
-        "Config": config["name"],
-        "retry_limit": config["retry_limit"],
-        "retry_period_ms": config["retry_period_ms"],
-        "ack_timeout_ms": config["ack_timeout_ms"],
-        "failure_probs": [s["failure_prob"] for s in config["server_settings"]],
-        "recovery_delays": [(s["recovery_delay_min"], s["recovery_delay_max"]) for s in config["server_settings"]],
-        "weights": [s["weight"] for s in config["server_settings"]],
-        "restore_accuracy": round(accuracy, 3)
-    })
-
-# Save CSV
-
-df_summary = pd.DataFrame(summary)
-df_summary.to_csv("simulation_results/summary_accuracy.csv", index=False, sep=";")
+import argparse
+import csv
+import os
+
+RESULTS_DIR = "simulation_results"
+
+
+def default_configs():
+    """
+    Return the configurations to test
+    Built on demand (the module attribute configs builds them on first use), so importing the runner, e.g. for
+    summarize, does not generate the large clusters
+    """
+    # The simulation modules are only needed once configurations are built or run
+    from cluster import generate_server_settings
+    large_cluster = generate_server_settings(101, failure_prob=(0.05, 0.4), weight=(1, 10), recovery_delay_min=(10, 30),
+                                             recovery_delay_spread=(10, 30), seed=2024)
+    return [
+        {
+            "name": "Stress_test", # worst case
+            "retry_limit": 1,
+            "retry_period_ms": 5,
+            "ack_timeout_ms": 2,
+            "server_settings": [
+                {"id": 1, "failure_prob": 0.4, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 50},
+                {"id": 2, "failure_prob": 0.5, "weight": 5,  "recovery_delay_min": 40, "recovery_delay_max": 60},
+                {"id": 3, "failure_prob": 0.6, "weight": 2,  "recovery_delay_min": 50, "recovery_delay_max": 70},
+            ]
+        },
+        {
+                "name": "Higher_retry", # test retry in the worst case
+                "retry_limit": 5,
+                "retry_period_ms": 20,
+                "ack_timeout_ms": 10,
+                "server_settings": [
+                    {"id": 1, "failure_prob": 0.4, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 50},
+                    {"id": 2, "failure_prob": 0.5, "weight": 5,  "recovery_delay_min": 40, "recovery_delay_max": 60},
+                    {"id": 3, "failure_prob": 0.6, "weight": 2,  "recovery_delay_min": 50, "recovery_delay_max": 70},
+                ]
+        },
+        {
+                "name": "Low_retry_High_failure", # bad case
+                "retry_limit": 3,
+                "retry_period_ms": 10,
+                "ack_timeout_ms": 5,
+                "server_settings": [
+                    {"id": 1, "failure_prob": 0.2, "weight": 10, "recovery_delay_min": 15, "recovery_delay_max": 25},
+                    {"id": 2, "failure_prob": 0.3, "weight": 7,  "recovery_delay_min": 20, "recovery_delay_max": 30},
+                    {"id": 3, "failure_prob": 0.5, "weight": 2,  "recovery_delay_min": 25, "recovery_delay_max": 35},
+                ]
+        },
+        {
+            "name": "High_retry_Medium_failure", # medium (realistic) case
+            "retry_limit": 5,
+            "retry_period_ms": 20,
+            "ack_timeout_ms": 10,
+            "server_settings": [
+                {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 5,  "recovery_delay_max": 15},
+                {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 15, "recovery_delay_max": 25},
+                {"id": 3, "failure_prob": 0.3, "weight": 2,  "recovery_delay_min": 20, "recovery_delay_max": 30},
+            ]
+        },
+        {
+            "name": "Reliable", # best case
+            "retry_limit": 3,
+            "retry_period_ms": 10,
+            "ack_timeout_ms": 5,
+            "server_settings": [
+                {"id": 1, "failure_prob": 0.05, "weight": 10, "recovery_delay_min": 5,  "recovery_delay_max": 15},
+                {"id": 2, "failure_prob": 0.1,  "weight": 9,  "recovery_delay_min": 8,  "recovery_delay_max": 18},
+                {"id": 3, "failure_prob": 0.1,  "weight": 8,  "recovery_delay_min": 10, "recovery_delay_max": 20},
+            ]
+        },
+
+        {
+           "name": "Low_retry_Low_failure", # good servers but strict protocol
+           "retry_limit": 1,
+           "retry_period_ms": 5,
+           "ack_timeout_ms": 2,
+           "server_settings": [
+               {"id": 1, "failure_prob": 0.05, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+               {"id": 2, "failure_prob": 0.1, "weight": 9, "recovery_delay_min": 12, "recovery_delay_max": 30},
+               {"id": 3, "failure_prob": 0.1, "weight": 8, "recovery_delay_min": 15, "recovery_delay_max": 35},
+           ]
+        },
+        {
+           "name": "High_Retry_High_Latency", # latency on recovery
+           "retry_limit": 6,
+           "retry_period_ms": 20,
+           "ack_timeout_ms": 12,
+           "server_settings": [
+               {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 30, "recovery_delay_max": 60},
+               {"id": 2, "failure_prob": 0.2, "weight": 7,  "recovery_delay_min": 25, "recovery_delay_max": 55},
+               {"id": 3, "failure_prob": 0.3, "weight": 5,  "recovery_delay_min": 20, "recovery_delay_max": 50},
+           ]
+        },
+        {
+           "name": "Weight_fallback_test", # with 4 servers is better (majority of 2 and 3 could prevent the wighted fallback)
+           "retry_limit": 3,
+           "retry_period_ms": 10,
+           "ack_timeout_ms": 6,
+           "server_settings": [
+               {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+               {"id": 2, "failure_prob": 0.5, "weight": 3, "recovery_delay_min": 10, "recovery_delay_max": 20},
+               {"id": 3, "failure_prob": 0.5, "weight": 2, "recovery_delay_min": 10, "recovery_delay_max": 20},
+           ]
+        },
+        {
+           "name": "Large_cluster_majority", # 101 generated servers, update committed by a majority quorum
+           "retry_limit": 3,
+           "retry_period_ms": 10,
+           "ack_timeout_ms": 5,
+           "quorum": "majority",
+           "server_settings": large_cluster,
+        },
+        {
+           "name": "Large_cluster_routed", # same cluster, the restore reads only the best-ranked servers
+           "retry_limit": 3,
+           "retry_period_ms": 10,
+           "ack_timeout_ms": 5,
+           "quorum": "majority",
+           "read_routing": "adaptive",
+           "server_settings": large_cluster,
+        },
+
+    ]
+
+
+def __getattr__(name):
+    if name == "configs":
+        globals()["configs"] = default_configs()  # Built once, later lookups find the module attribute
+        return globals()["configs"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def sweep(configs, trials=100, workers=None, base_seed=0, num_updates=5, chunk_size=25, collect_metrics=True,
+          skip=None):
+    """
+    Runs every (config, trial) work unit on a process pool
+    Trials are grouped in chunks to amortise the inter-process overhead
+    Yields (config_name, trial, success, metrics) tuples as soon as each chunk finishes
+    params:
+    configs: list of configuration dictionaries
+    trials: number of trials per configuration
+    workers: number of worker processes (None uses all the CPUs, 1 runs in-process)
+    base_seed: the seed of the whole sweep
+    num_updates: number of updates per simulation
+    chunk_size: number of trials sent to a worker at once
+    collect_metrics: if True, each trial records its Metrics
+    skip: optional dictionary config name -> trial indices not to run (e.g. found in a ResultCache)
+    """
+    chunks = []
+    for config in configs:
+        done = skip.get(config["name"], ()) if skip else ()
+        missing = [trial for trial in range(trials) if trial not in done]
+        chunks.extend((config, missing[start:start + chunk_size]) for start in range(0, len(missing), chunk_size))
+
+    from trials import run_trials
+    if workers == 1:
+        for config, chunk in chunks:
+            yield from run_trials(config, chunk, base_seed, num_updates, collect_metrics)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_trials, config, chunk, base_seed, num_updates, collect_metrics)
+            for config, chunk in chunks
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def metrics_columns(metrics, trials):
+    """
+    Return the summary columns of the merged metrics of a configuration: each counter averaged per trial
+    (<counter>_per_trial), and the count, mean, p50, p95, p99 and max of each histogram
+    params:
+    metrics: the Metrics merged over all the trials
+    trials: number of trials run
+    """
+    columns = {f"{name}_per_trial": round(value / trials, 3) for name, value in sorted(metrics.counters.items())}
+    for name in sorted(metrics.histograms):
+        for statistic, value in metrics.histograms[name].summary().items():
+            columns[f"{name}_{statistic}"] = round(value, 4) if isinstance(value, float) else value
+    return columns
+
+
+def summary_row(config, success_count, trials, metrics=None):
+    """
+    Builds the summary_accuracy.csv row of a configuration
+    params:
+    config: a configuration dictionary
+    success_count: number of trials that restored the expected version
+    trials: number of trials run
+    metrics: optional Metrics merged over the trials, added as extra columns
+    """
+    row = {
+        "Config": config["name"],
+        "retry_limit": config["retry_limit"],
+        "retry_period_ms": config["retry_period_ms"],
+        "ack_timeout_ms": config["ack_timeout_ms"],
+        "failure_probs": [s["failure_prob"] for s in config["server_settings"]],
+        "recovery_delays": [(s["recovery_delay_min"], s["recovery_delay_max"]) for s in config["server_settings"]],
+        "weights": [s["weight"] for s in config["server_settings"]],
+        "restore_accuracy": round(success_count / trials, 3)
+    }
+    if metrics is not None:
+        row.update(metrics_columns(metrics, trials))
+    return row
+
+
+def iter_summary_rows(configs, trials=100, workers=None, base_seed=0, num_updates=5, collect_metrics=True,
+                      cache=None, progress=None):
+    """
+    Runs the sweep and yields the summary row of each configuration as soon as all its trials are done,
+    so the rows can be written while the other configurations are still running
+    With a ResultCache, the trials already cached are loaded instead of run, and the new ones are added to it
+    params: see sweep; cache: optional ResultCache; progress: optional function called with each progress
+    message (e.g. print, as the command line does), nothing is reported by default
+    """
+    if trials < 1:
+        raise ValueError(f"The number of trials must be at least 1, got {trials}")
+    from metrics import Metrics
+    success_counts = {config["name"]: 0 for config in configs}
+    completed = {config["name"]: 0 for config in configs}
+    merged_metrics = {config["name"]: Metrics() for config in configs} if collect_metrics else {}
+    configs_by_name = {config["name"]: config for config in configs}
+
+    def finished(config_name):
+        if progress is not None:
+            progress(f"Completed configuration: {config_name} "
+                     f"(accuracy {success_counts[config_name] / trials:.3f})")
+        return summary_row(configs_by_name[config_name], success_counts[config_name], trials,
+                           merged_metrics.get(config_name))
+
+    skip = {}
+    if cache is not None:
+        for config in configs:
+            cached = cache.load(config, num_updates, base_seed, collect_metrics)
+            skip[config["name"]] = done = {trial for trial in cached if trial < trials}
+            for trial in done:
+                success, metrics = cached[trial]
+                success_counts[config["name"]] += success
+                if metrics is not None:
+                    merged_metrics[config["name"]].merge(metrics)
+            completed[config["name"]] = len(done)
+            if done and progress is not None:
+                progress(f"Loaded {len(done)} cached trials of {config['name']}")
+            if len(done) == trials:
+                yield finished(config["name"])
+
+    for config_name, trial, success, metrics in sweep(configs, trials, workers, base_seed, num_updates,
+                                                      collect_metrics=collect_metrics, skip=skip):
+        success_counts[config_name] += success
+        completed[config_name] += 1
+        if metrics is not None:
+            merged_metrics[config_name].merge(metrics)
+        if cache is not None:
+            cache.append(configs_by_name[config_name], num_updates, base_seed, trial, success, metrics)
+        if completed[config_name] == trials:
+            if cache is not None:
+                cache.flush()
+            yield finished(config_name)
+
+
+def run_batch(configs, trials=100, workers=None, base_seed=0, num_updates=5, collect_metrics=True, cache=None,
+              progress=None):
+    """
+    Runs the sweep and merges the per-trial results into one summary row per configuration
+    Return the summary rows, in the order of the configurations
+    """
+    rows = {row["Config"]: row for row in iter_summary_rows(configs, trials, workers, base_seed, num_updates,
+                                                            collect_metrics, cache, progress)}
+    return [rows[config["name"]] for config in configs]
+
+
+class CsvRowWriter:
+    def __init__(self, path, delimiter=";"):
+        """
+        Writes summary rows to a CSV file one at a time, flushing each row, with the standard csv module
+        Rows may have different columns (the metrics columns depend on what each configuration recorded):
+        the columns are the union of the keys in order of appearance. New columns are appended at the end of
+        the header, which is rewritten on close if it grew, so earlier rows stay aligned
+        params:
+        path: path of the CSV file
+        delimiter: the field delimiter
+        """
+        self.path = path
+        self.fieldnames = []
+        self._header_columns = 0
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file, delimiter=delimiter)
+        self._delimiter = delimiter
+
+    def write(self, row):
+        for key in row:
+            if key not in self.fieldnames:
+                self.fieldnames.append(key)
+        if not self._header_columns:
+            self._writer.writerow(self.fieldnames)
+            self._header_columns = len(self.fieldnames)
+        self._writer.writerow(["" if row.get(key) is None else row.get(key) for key in self.fieldnames])
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+        if len(self.fieldnames) > self._header_columns:
+            with open(self.path, newline="") as f:
+                lines = f.readlines()
+            with open(self.path, "w", newline="") as f:
+                csv.writer(f, delimiter=self._delimiter).writerow(self.fieldnames)
+                f.writelines(lines[1:])
+
+
+class ParquetRowWriter:
+    def __init__(self, path):
+        """
+        Collects the summary rows and writes them to a Parquet file on close (needs pandas and pyarrow,
+        imported only here)
+        params:
+        path: path of the Parquet file
+        """
+        import pandas as pd
+        self._pd = pd
+        self.path = path
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        self._pd.DataFrame(self.rows).to_parquet(self.path, index=False)
+
+
+def open_writer(path, output_format="csv"):
+    """
+    Return the row writer of an output format: "csv" (standard library, default) or "parquet" (pandas)
+    """
+    if output_format == "csv":
+        return CsvRowWriter(path)
+    if output_format == "parquet":
+        return ParquetRowWriter(path)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def read_summary(path):
+    """
+    Return the rows of a summary file written by the sweep command, as dictionaries of strings
+    """
+    if path.endswith(".parquet"):
+        import pandas as pd
+        return pd.read_parquet(path).astype(str).to_dict("records")
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f, delimiter=";"))
+
+
+def _select_configs(names):
+    configs = default_configs()
+    if not names:
+        return configs
+    by_name = {config["name"]: config for config in configs}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise SystemExit(f"Unknown configuration: {', '.join(unknown)} (available: {', '.join(by_name)})")
+    return [by_name[name] for name in names]
+
+
+def _sweep_command(args, cache):
+    selected = _select_configs(args.config)
+    output = args.output or os.path.join(RESULTS_DIR, f"summary_accuracy.{args.format}")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    writer = open_writer(output, args.format)
+    try:
+        # Each row is written as soon as its configuration completes
+        for row in iter_summary_rows(selected, args.trials, args.workers, args.seed, args.num_updates,
+                                     collect_metrics=not args.no_metrics, cache=cache, progress=print):
+            writer.write(row)
+    finally:
+        writer.close()
+    print(f"Summary written to {output}")
+
+
+def _run_command(args, cache):
+    [row] = run_batch(_select_configs([args.name]), args.trials, args.workers, args.seed, args.num_updates,
+                      collect_metrics=not args.no_metrics, cache=cache, progress=print)
+    width = max(len(key) for key in row)
+    for key, value in row.items():
+        print(f"{key:<{width}}  {value}")
+
+
+def _summarize_command(args):
+    rows = read_summary(args.path)
+    columns = ["Config", "restore_accuracy"] + (args.columns or [])
+    widths = [max([len(column)] + [len(str(row.get(column, ""))) for row in rows]) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row.get(column, "")).ljust(width) for column, width in zip(columns, widths)))
+
+
+def _trial_count(value):
+    """
+    argparse type of --trials: an integer of at least 1
+    """
+    trials = int(value)
+    if trials < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {trials}")
+    return trials
+
+
+def _global_options(argument_default=None):
+    """
+    Return a parent parser holding the options shared by every command
+    params:
+    argument_default: argparse.SUPPRESS for the copy given to each subcommand, so an option given before the
+                      subcommand is not reset by the subcommand defaults
+    """
+    options = argparse.ArgumentParser(add_help=False, argument_default=argument_default)
+    options.add_argument("--trials", type=_trial_count, help="Number of simulations per configuration")
+    options.add_argument("--workers", type=int, help="Worker processes (default: all CPUs)")
+    options.add_argument("--seed", type=int, help="Seed of the sweep")
+    options.add_argument("--num-updates", type=int, help="Number of updates per simulation")
+    options.add_argument("--no-metrics", action="store_true", help="Do not record the protocol metrics")
+    options.add_argument("--cache-dir", help="Directory of the cached trial results")
+    options.add_argument("--no-cache", action="store_true", help="Run every trial, without reading or writing the cache")
+    return options
+
+
+def parse_args(argv=None):
+    """
+    Parses the command line; the global options (--trials, --seed, ...) go before or after the command
+    Without a command, the arguments are those of a sweep of every configuration
+    params:
+    argv: the arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="Run the simulation batch and collect accuracy metrics.",
+                                     parents=[_global_options()])
+    parser.set_defaults(trials=100, workers=None, seed=0, num_updates=5, no_metrics=False,
+                        cache_dir=os.path.join(RESULTS_DIR, "cache"), no_cache=False)
+    commands = parser.add_subparsers(dest="command")
+    subcommand_options = _global_options(argparse.SUPPRESS)
+
+    sweep_parser = commands.add_parser("sweep", parents=[subcommand_options],
+                                       help="Run the configurations and write the summary (default)")
+    sweep_parser.add_argument("--config", action="append", help="Configuration to run (repeatable, default: all)")
+    sweep_parser.add_argument("--output", help="Summary file (default: simulation_results/summary_accuracy.<format>)")
+    sweep_parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                              help="csv (standard library) or parquet (needs pandas and pyarrow)")
+
+    run_parser = commands.add_parser("run", parents=[subcommand_options],
+                                     help="Run one configuration and print its summary")
+    run_parser.add_argument("name", help="Name of the configuration")
+
+    summarize_parser = commands.add_parser("summarize", parents=[subcommand_options],
+                                           help="Print the accuracy of a summary file")
+    summarize_parser.add_argument("path", nargs="?", default=os.path.join(RESULTS_DIR, "summary_accuracy.csv"),
+                                  help="Summary file written by the sweep command")
+    summarize_parser.add_argument("--columns", nargs="+", help="Additional columns to print")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = sweep_parser.parse_args([], namespace=args)  # Default command: a sweep of every configuration
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == "summarize":
+        _summarize_command(args)
+        return
+
+    from result_cache import ResultCache
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    try:
+        if args.command == "run":
+            _run_command(args, cache)
+        else:
+            _sweep_command(args, cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import hashlib
+import mmap
+import os
+import sys
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class MappedChunkStore:
+    def __init__(self, path=None):
+        """
+        Chunk store keeping the chunks in a file on disk, read back through a memory map
+        Used in place of the in-memory dictionary of a VersionLog, so a replica of a large file holds its
+        chunks in the page cache instead of the process heap; reads return memoryviews of the map
+        Chunks are appended to the file; the space of the removed chunks is reclaimed by rewriting the
+        file once it exceeds the live chunks
+        params:
+        path: path of the chunk file (defaults to a new temporary file, deleted by close())
+        """
+        if path is None:
+            import tempfile  # Only the stores without a path need it
+            descriptor, path = tempfile.mkstemp(prefix="replica-", suffix=".chunks")
+            os.close(descriptor)
+            self._temporary = True
+        else:
+            self._temporary = False
+        self.path = path
+        self._file = open(path, "w+b")
+        self._index = {}  # digest -> (offset, length)
+        self._end = 0  # Size of the file
+        self._live_bytes = 0
+        self._map = None
+
+    def __contains__(self, digest):
+        return digest in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __setitem__(self, digest, chunk):
+        if digest in self._index:
+            return
+        self._file.seek(self._end)
+        self._file.write(chunk)
+        self._index[digest] = (self._end, len(chunk))
+        self._end += len(chunk)
+        self._live_bytes += len(chunk)
+
+    def __getitem__(self, digest):
+        offset, length = self._index[digest]
+        if self._map is None or len(self._map) < offset + length:
+            # Map the chunks appended since the last read; views of the previous map stay valid
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), self._end, access=mmap.ACCESS_READ)
+        return memoryview(self._map)[offset:offset + length]
+
+    def __delitem__(self, digest):
+        _, length = self._index.pop(digest)
+        self._live_bytes -= length
+        if self._end > 2 * self._live_bytes and self._end > mmap.PAGESIZE:
+            self._compact()
+
+    def values(self):
+        return (self[digest] for digest in self._index)
+
+    def stored_bytes(self):
+        """
+        Return the size of the live chunks
+        """
+        return self._live_bytes
+
+    def _compact(self):
+        """
+        Rewrites the live chunks into a new file, dropping the space of the removed ones
+        """
+        compact_path = self.path + ".compact"
+        index = {}
+        end = 0
+        with open(compact_path, "wb") as compact_file:
+            for digest in list(self._index):
+                chunk = self[digest]
+                compact_file.write(chunk)
+                index[digest] = (end, len(chunk))
+                end += len(chunk)
+        os.replace(compact_path, self.path)
+        self._file.close()
+        self._file = open(self.path, "r+b")
+        self._index = index
+        self._end = end
+        self._map = None
+
+    def close(self):
+        """
+        Closes the chunk file, deleting it if it is temporary
+        """
+        self._map = None
+        self._file.close()
+        if self._temporary and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class _Entry:
+    """
+    Metadata of a stored version: the digests of its chunks and the file name, hash, size and text flag
+    """
+    __slots__ = ("manifest", "file_name", "hash", "size", "text")
+
+    def __init__(self, manifest, file_name, file_hash, size, text):
+        self.manifest = manifest
+        self.file_name = file_name
+        self.hash = file_hash
+        self.size = size
+        self.text = text
+
+
+class VersionLog:
+    # Every server of a simulated cluster has its own log, the slots keep the empty ones small
+    __slots__ = ("max_versions", "chunk_size", "chunks", "_refcounts", "_entries")
+
+    def __init__(self, max_versions=8, chunk_size=DEFAULT_CHUNK_SIZE, chunk_store=None):
+        """
+        Replica storage keeping the most recent versions of a file as content-addressed chunks
+        A chunk shared by several versions is stored once, so a version that changes a small part
+        of a large file only adds the chunks that changed
+        params:
+        max_versions: number of versions kept, older versions are evicted
+        chunk_size: size of each chunk in bytes
+        chunk_store: where the chunks are kept: a dictionary by default, or a MappedChunkStore
+        """
+        self.max_versions = max_versions
+        self.chunk_size = chunk_size
+        self.chunks = chunk_store if chunk_store is not None else {}  # digest -> bytes
+        self._refcounts = {}  # digest -> number of versions using the chunk
+        self._entries = {}  # version -> _Entry
+
+    def put_chunks(self, version, chunks, file_name=None, text=True):
+        """
+        Stores a new version received as a stream of chunks of chunk_size bytes
+        The digest of the whole content is computed incrementally while the chunks are stored, so the
+        content is never held in memory as a whole
+        Return a (added_bytes, file_hash) tuple: the bytes of the chunks that were not already stored and
+        the SHA-256 digest of the content
+        params:
+        version: the version number
+        chunks: iterable of bytes-like chunks (e.g. File.iter_chunks(chunk_size))
+        file_name: name of the file for this version
+        text: True if the content is UTF-8 text, returned as str by get()
+        """
+        if version in self._entries:
+            self._release(version)
+        manifest = []
+        added_bytes = 0
+        size = 0
+        file_digest = None
+        first_chunk = None
+        for chunk in chunks:
+            # Interned, so the replicas of a cluster share one string per chunk instead of a copy each
+            digest = sys.intern(hashlib.sha256(chunk).hexdigest())
+            if first_chunk is None:
+                first_chunk = chunk
+            else:
+                if file_digest is None:
+                    file_digest = hashlib.sha256(first_chunk)
+                file_digest.update(chunk)
+            added_bytes += self._add_chunk(digest, chunk)
+            manifest.append(digest)
+            size += len(chunk)
+        if file_digest is not None:
+            file_hash = sys.intern(file_digest.hexdigest())
+        elif manifest:
+            file_hash = manifest[0]  # A single chunk has the digest of the whole file
+        else:
+            file_hash = hashlib.sha256(b"").hexdigest()
+        self._add_entry(version, tuple(manifest), file_name, file_hash, size, text)
+        return added_bytes, file_hash
+
+    def put_manifest(self, version, manifest, chunks, file_name=None, file_hash=None, size=0, text=True):
+        """
+        Stores a version copied from another replica: only the chunks missing here are given
+        Return the number of bytes added
+        params:
+        version: the version number
+        manifest: the digests of the chunks of the version, in order
+        chunks: dictionary digest -> data of the chunks of the manifest not stored here (see missing_chunks)
+        file_name: name of the file for this version
+        file_hash: SHA-256 digest of the whole content
+        size: size of the content in bytes
+        text: True if the content is UTF-8 text
+        """
+        if version in self._entries:
+            self._release(version)
+        added_bytes = 0
+        for digest in manifest:
+            added_bytes += self._add_chunk(digest, chunks.get(digest))
+        self._add_entry(version, tuple(manifest), file_name, file_hash, size, text)
+        return added_bytes
+
+    def _add_chunk(self, digest, chunk):
+        """
+        Stores a chunk unless it is already stored, and counts one more version using it
+        Return the number of bytes added
+        """
+        added_bytes = 0
+        if digest not in self.chunks:
+            # A dictionary keeps its own copy: a view would keep the whole sender buffer alive
+            self.chunks[digest] = chunk if isinstance(self.chunks, MappedChunkStore) else bytes(chunk)
+            self._refcounts[digest] = 0
+            added_bytes = len(chunk)
+        self._refcounts[digest] += 1
+        return added_bytes
+
+    def _add_entry(self, version, manifest, file_name, file_hash, size, text):
+        self._entries[version] = _Entry(manifest, file_name, file_hash, size, text)
+
+        # Evict the oldest versions beyond the limit
+        while len(self._entries) > self.max_versions:
+            self._release(min(self._entries))
+
+    def missing_chunks(self, digests):
+        """
+        Return the digests that are not stored yet, i.e. the chunks a sender has to transfer
+        params:
+        digests: iterable of chunk digests of a version
+        """
+        return [digest for digest in digests if digest not in self.chunks]
+
+    def get(self, version=None):
+        """
+        Return the content of a version (the latest one by default), or None if it is not stored
+        Text versions are returned as str, binary versions as bytes
+        params:
+        version: the version number
+        """
+        if version is None:
+            version = self.latest_version()
+        entry = self._entries.get(version)
+        if entry is None:
+            return None
+        data = b"".join(self.chunks[digest] for digest in entry.manifest)
+        return data.decode("utf-8") if entry.text else data
+
+    def iter_chunks(self, version=None):
+        """
+        Yields the chunks of a version (the latest one by default) without joining them
+        params:
+        version: the version number
+        """
+        if version is None:
+            version = self.latest_version()
+        for digest in self._entries[version].manifest:
+            yield self.chunks[digest]
+
+    def entry(self, version):
+        """
+        Return the metadata of a version (file_name, hash, size, text), or None if it is not stored
+        params:
+        version: the version number
+        """
+        entry = self._entries.get(version)
+        if entry is None:
+            return None
+        return {"version": version, "file_name": entry.file_name, "hash": entry.hash, "size": entry.size,
+                "text": entry.text}
+
+    def manifest(self, version):
+        """
+        Return the digests of the chunks of a version, in order, or None if it is not stored
+        params:
+        version: the version number
+        """
+        entry = self._entries.get(version)
+        return None if entry is None else list(entry.manifest)
+
+    def latest_version(self):
+        """
+        Return the most recent stored version, or None if the log is empty
+        """
+        return max(self._entries) if self._entries else None
+
+    def versions(self):
+        """
+        Return the stored versions, oldest first
+        """
+        return sorted(self._entries)
+
+    def stored_bytes(self):
+        """
+        Return the number of content bytes held by the replica
+        """
+        if isinstance(self.chunks, MappedChunkStore):
+            return self.chunks.stored_bytes()
+        return sum(len(chunk) for chunk in self.chunks.values())
+
+    def _release(self, version):
+        """
+        Removes a version, dropping the chunks no other version uses
+        """
+        for digest in self._entries.pop(version).manifest:
+            self._refcounts[digest] -= 1
+            if self._refcounts[digest] == 0:
+                del self._refcounts[digest]
+                del self.chunks[digest]
+
+
+class KeyedStore:
+    __slots__ = ("log_factory", "_logs")
+
+    def __init__(self, log_factory=None):
+        """
+        Replica storage of several files, one VersionLog per file key
+        The logs are created on the first version of each key; each key keeps its own recent versions
+        params:
+        log_factory: optional callable taking a file key and returning its log (defaults to a VersionLog)
+        """
+        self.log_factory = log_factory
+        self._logs = {}  # file key -> VersionLog
+
+    def log(self, key, create=False):
+        """
+        Return the log of a file key, or None if no version of it is stored
+        params:
+        key: the file key
+        create: if True, creates the log of a new key
+        """
+        log = self._logs.get(key)
+        if log is None and create:
+            log = self._logs[key] = self.log_factory(key) if self.log_factory is not None else VersionLog()
+        return log
+
+    def keys(self):
+        """
+        Return the keys of the stored files
+        """
+        return list(self._logs)
+
+    def __len__(self):
+        return len(self._logs)
+
+    def stored_bytes(self):
+        """
+        Return the number of content bytes held for all the keys
+        """
+        return sum(log.stored_bytes() for log in self._logs.values())
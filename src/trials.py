@@ -0,0 +1,50 @@
+import hashlib
+import random
+
+from main import run_simulation
+from metrics import Metrics
+from routing import ReadRouter
+
+
+def trial_seed(base_seed, config_name, trial):
+    """
+    Derives the RNG seed of a single trial
+    The seed depends only on the sweep seed, the configuration and the trial index,
+    so results do not depend on which worker runs the trial or in which order
+    params:
+    base_seed: the seed of the whole sweep
+    config_name: name of the configuration
+    trial: index of the trial within the configuration
+    """
+    digest = hashlib.sha256(f"{base_seed}:{config_name}:{trial}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def run_trials(config, trials, base_seed=0, num_updates=5, collect_metrics=True):
+    """
+    Runs a group of trials of one configuration, each with its own seed
+    Return a list of (config_name, trial, success, metrics) tuples
+    params:
+    config: a configuration dictionary
+    trials: iterable of trial indices to run
+    base_seed: the seed of the whole sweep
+    num_updates: number of updates per simulation
+    collect_metrics: if True, each trial records its Metrics (None otherwise)
+    """
+    results = []
+    for trial in trials:
+        random.seed(trial_seed(base_seed, config["name"], trial))
+        metrics = Metrics() if collect_metrics else None
+        restored, expected = run_simulation(
+            server_settings=config["server_settings"],
+            retry_limit=config["retry_limit"],
+            retry_period_ms=config["retry_period_ms"],
+            ack_timeout_ms=config["ack_timeout_ms"],
+            num_updates=num_updates,
+            quorum=config.get("quorum", "all"),
+            metrics=metrics,
+            read_router=ReadRouter() if config.get("read_routing") == "adaptive" else None
+        )
+        success = bool(restored and restored["version"] == expected.version)
+        results.append((config["name"], trial, success, metrics))
+    return results
@@ -0,0 +1,252 @@
+import os
+import struct
+import time
+import zlib
+
+from storage import DEFAULT_CHUNK_SIZE, VersionLog
+
+# Record: type (1 byte), body length (4 bytes), CRC-32 of the body (4 bytes), then the body
+RECORD = struct.Struct("!BII")
+CHUNK = 1  # body: raw chunk digest (32 bytes) + chunk data
+PUT = 2  # body: _PUT fields + file name + raw digests of the chunks of the version
+GENERATION = 3  # body: _GENERATION, first record of a snapshot
+
+_PUT = struct.Struct("!Q?H32sQI")  # version, text flag, file name length (0xFFFF if unknown), file digest, size,
+                                   # number of chunks
+_GENERATION = struct.Struct("!Q")  # generation of the log that continues the snapshot
+NO_NAME = 0xFFFF
+SNAPSHOT_FILE = "snapshot"
+
+
+def _encode_record(record_type, body):
+    return RECORD.pack(record_type, len(body), zlib.crc32(body)) + body
+
+
+def _put_body(version, manifest, file_name, file_hash, size, text):
+    name = b"" if file_name is None else file_name.encode()
+    return (_PUT.pack(version, text, NO_NAME if file_name is None else len(name), bytes.fromhex(file_hash), size,
+                      len(manifest))
+            + name + b"".join(bytes.fromhex(digest) for digest in manifest))
+
+
+def _read_records(path):
+    """
+    Reads the records of a log file, stopping at the first incomplete or corrupted record (a torn write)
+    Return a (records, valid_length) tuple: the list of (type, body) and the length of the valid prefix
+    """
+    records = []
+    if not os.path.exists(path):
+        return records, 0
+    with open(path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset + RECORD.size <= len(data):
+        record_type, length, checksum = RECORD.unpack_from(data, offset)
+        body = data[offset + RECORD.size:offset + RECORD.size + length]
+        if len(body) < length or zlib.crc32(body) != checksum:
+            break
+        records.append((record_type, body))
+        offset += RECORD.size + length
+    return records, offset
+
+
+class DurableVersionLog(VersionLog):
+    def __init__(self, directory, max_versions=8, chunk_size=DEFAULT_CHUNK_SIZE, sync_every=1,
+                 snapshot_bytes=64 * 1024 * 1024, chunk_store=None):
+        """
+        VersionLog persisted in a directory with a write-ahead log, reloaded when it is opened again
+        Every chunk not already stored is appended to the log before its version is committed by a
+        put record; the log is fsynced once every sync_every commits (group fsync) and compacted into a
+        snapshot of the retained versions once it exceeds snapshot_bytes
+        On startup the snapshot is loaded and the log replayed; a torn record at the end of the log and
+        the chunks of uncommitted versions are discarded
+        Each snapshot starts a new generation of the log (wal-<generation>.log), so a crash during a
+        checkpoint never replays a log that the snapshot already includes
+        params:
+        directory: directory holding the log and the snapshot (created if needed)
+        max_versions: number of versions kept, older versions are evicted
+        chunk_size: size of each chunk in bytes
+        sync_every: number of commits per fsync (1 makes every acknowledged update durable, 0 never syncs)
+        snapshot_bytes: log size above which it is compacted into a snapshot
+        chunk_store: where the chunks are kept in memory: a dictionary by default, or a MappedChunkStore
+        """
+        super().__init__(max_versions, chunk_size, chunk_store)
+        self.directory = directory
+        self.sync_every = sync_every
+        self.snapshot_bytes = snapshot_bytes
+        self.fsync_count = 0
+        self.fsync_time_s = 0.0  # Time spent waiting for fsync
+        self.replayed_records = 0
+        self.replay_time_s = 0.0  # Time spent loading the snapshot and replaying the log
+        self._unsynced_commits = 0
+        self._replaying = True
+        os.makedirs(directory, exist_ok=True)
+        self._snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.generation = 0
+        self._replay()
+        self._replaying = False
+        new_log = not os.path.exists(self._wal_path)
+        self._wal = open(self._wal_path, "ab")
+        if new_log:
+            self._sync_directory()
+        self._wal_bytes = self._wal.tell()
+        self._synced_bytes = self._wal_bytes
+
+    def _replay(self):
+        """
+        Loads the snapshot, then applies the committed versions of the log
+        """
+        started = time.perf_counter()
+        snapshot_records, _ = _read_records(self._snapshot_path)
+        if snapshot_records and snapshot_records[0][0] == GENERATION:
+            (self.generation,) = _GENERATION.unpack(snapshot_records[0][1])
+        self._remove_old_logs()
+        wal_records, valid_length = _read_records(self._wal_path)
+        if os.path.exists(self._wal_path) and os.path.getsize(self._wal_path) > valid_length:
+            with open(self._wal_path, "r+b") as f:
+                f.truncate(valid_length)  # Drop the torn tail, new records are appended after the valid prefix
+        pending_chunks = {}  # Chunks written for a version that is not committed yet
+        for record_type, body in snapshot_records + wal_records:
+            if record_type == GENERATION:
+                pass
+            elif record_type == CHUNK:
+                pending_chunks[body[:32].hex()] = body[32:]
+            elif record_type == PUT:
+                self._apply_put(body, pending_chunks)
+                pending_chunks = {}
+            self.replayed_records += 1
+        self.replay_time_s = time.perf_counter() - started
+
+    @property
+    def _wal_path(self):
+        return os.path.join(self.directory, f"wal-{self.generation:08d}.log")
+
+    def _remove_old_logs(self):
+        """
+        Deletes the logs of the previous generations, already included in the snapshot
+        """
+        current = os.path.basename(self._wal_path)
+        for name in os.listdir(self.directory):
+            if name.startswith("wal-") and name.endswith(".log") and name != current:
+                os.unlink(os.path.join(self.directory, name))
+
+    def _apply_put(self, body, pending_chunks):
+        version, text, name_length, file_digest, size, chunk_count = _PUT.unpack_from(body)
+        offset = _PUT.size
+        file_name = None
+        if name_length != NO_NAME:
+            file_name = body[offset:offset + name_length].decode()
+            offset += name_length
+        if version in self._entries:
+            self._release(version)
+        manifest = []
+        for index in range(chunk_count):
+            digest = body[offset + 32 * index:offset + 32 * (index + 1)].hex()
+            self._add_chunk(digest, pending_chunks[digest] if digest not in self.chunks else None)
+            manifest.append(digest)
+        self._add_entry(version, tuple(manifest), file_name, file_digest.hex(), size, text)
+
+    def _add_chunk(self, digest, chunk):
+        if not self._replaying and digest not in self.chunks:
+            self._append(CHUNK, bytes.fromhex(digest) + bytes(chunk))
+        return super()._add_chunk(digest, chunk)
+
+    def _add_entry(self, version, manifest, file_name, file_hash, size, text):
+        if self._replaying:
+            super()._add_entry(version, manifest, file_name, file_hash, size, text)
+            return
+        self._append(PUT, _put_body(version, manifest, file_name, file_hash, size, text))
+        super()._add_entry(version, manifest, file_name, file_hash, size, text)
+        self._commit()
+
+    def _append(self, record_type, body):
+        record = _encode_record(record_type, body)
+        self._wal.write(record)
+        self._wal_bytes += len(record)
+
+    def _commit(self):
+        """
+        Counts a committed version, syncing the log once sync_every versions are waiting
+        """
+        self._unsynced_commits += 1
+        if self.sync_every and self._unsynced_commits >= self.sync_every:
+            self.sync()
+        if self._wal_bytes > self.snapshot_bytes:
+            self.checkpoint()
+
+    def sync(self):
+        """
+        Flushes the log and waits until it is on disk
+        """
+        started = time.perf_counter()
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self.fsync_time_s += time.perf_counter() - started
+        self.fsync_count += 1
+        self._synced_bytes = self._wal_bytes
+        self._unsynced_commits = 0
+
+    def _sync_directory(self):
+        """
+        Waits until the entries of the directory (renamed and created files) are on disk
+        A rename is durable only once the directory itself is fsynced
+        """
+        if os.name == "nt":
+            return  # Directories cannot be opened on Windows, NTFS journals the renames
+        started = time.perf_counter()
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.fsync_time_s += time.perf_counter() - started
+        self.fsync_count += 1
+
+    def checkpoint(self):
+        """
+        Writes the retained versions into a new snapshot and starts the log of the next generation
+        The snapshot is written to a temporary file and renamed, so a crash leaves either the old snapshot
+        and its log, or the new snapshot; the old logs are deleted only once the rename is on disk
+        """
+        temporary_path = self._snapshot_path + ".tmp"
+        written = set()
+        with open(temporary_path, "wb") as f:
+            f.write(_encode_record(GENERATION, _GENERATION.pack(self.generation + 1)))
+            for version in self.versions():
+                entry = self._entries[version]
+                for digest in entry.manifest:
+                    if digest not in written:
+                        f.write(_encode_record(CHUNK, bytes.fromhex(digest) + bytes(self.chunks[digest])))
+                        written.add(digest)
+                f.write(_encode_record(PUT, _put_body(version, entry.manifest, entry.file_name, entry.hash,
+                                                      entry.size, entry.text)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self._snapshot_path)
+        self._sync_directory()
+        self._wal.close()
+        self.generation += 1
+        self._remove_old_logs()
+        self._wal = open(self._wal_path, "wb")
+        self._sync_directory()  # The versions committed to the new log must not lose their file
+        self._wal_bytes = 0
+        self._synced_bytes = 0
+        self._unsynced_commits = 0
+
+    def simulate_crash(self):
+        """
+        Simulates a power loss: the log loses everything written after the last fsync and is closed
+        The directory can then be opened again with a new DurableVersionLog to test the recovery
+        """
+        self._wal.flush()
+        self._wal.close()
+        with open(self._wal_path, "r+b") as f:
+            f.truncate(self._synced_bytes)
+
+    def close(self):
+        """
+        Syncs and closes the log
+        """
+        if self._unsynced_commits or self._wal_bytes != self._synced_bytes:
+            self.sync()
+        self._wal.close()
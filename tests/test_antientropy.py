@@ -0,0 +1,22 @@
+import events
+from events import RingBufferSink
+from main import run_simulation
+
+SERVERS = [
+    {"id": 1, "failure_prob": 0.3, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+    {"id": 2, "failure_prob": 0.3, "weight": 7, "recovery_delay_min": 20, "recovery_delay_max": 35},
+    {"id": 3, "failure_prob": 0.4, "weight": 2, "recovery_delay_min": 25, "recovery_delay_max": 45},
+]
+
+
+def test_anti_entropy_with_enabled_sink():
+    repairs = []
+    for seed in range(20):
+        sink = RingBufferSink()
+        restored, expected = run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5,
+                                            quorum="majority", repair="anti-entropy", event_sink=sink, seed=seed)
+        repairs.extend(sink.of_type(events.REPAIR))
+    assert repairs
+    for event in repairs:
+        assert event.source == "anti-entropy"
+        assert event.fields["source_server"] != event.fields["server"]
@@ -0,0 +1,36 @@
+import pytest
+
+import benchmark
+
+
+def test_quorum_option_accepts_only_the_quorum_modes(capsys):
+    for mode in ("all", "majority", "weighted"):
+        assert benchmark.parse_args(["run", "--quorum", mode]).quorum == mode
+    with pytest.raises(SystemExit):
+        benchmark.parse_args(["run", "--quorum", "most"])
+    assert "invalid choice: 'most'" in capsys.readouterr().err
+
+
+def test_percentile_and_summary():
+    assert benchmark.percentile([], 0.5) is None
+    assert benchmark.percentile([1, 2, 3, 4], 0.5) == 2
+    assert benchmark.percentile([1, 2, 3, 4], 0.99) == 4
+    summary = benchmark.summarize([0.001, 0.003])
+    assert summary["iterations"] == 2 and summary["ops_per_sec"] == pytest.approx(500)
+    assert summary["mean_ms"] == pytest.approx(2) and summary["p50_ms"] == pytest.approx(1)
+
+
+def test_bench_case_and_compare():
+    rows = benchmark.bench_case(3, 64, 0.0, 3, 5, iterations=5, quorum="majority")
+    assert [row["operation"] for row in rows] == benchmark.OPERATIONS
+    assert all(row["iterations"] == 5 and row["quorum"] == "majority" for row in rows)
+    assert len(benchmark.make_content(2, 64)) == 64
+    [restore] = [row for row in rows if row["operation"] == "restore_consensus"]
+    assert 0 <= restore["restore_accuracy"] <= 1
+
+    baseline = {"results": rows}
+    slower = {"results": [dict(row, p50_ms=row["p50_ms"] * 2) for row in rows]}
+    comparison = benchmark.compare(baseline, slower, threshold=0.10)
+    assert len(comparison) == len(rows)
+    assert all(regressed for _, _, _, _, regressed in comparison)
+    assert not any(regressed for _, _, _, _, regressed in benchmark.compare(baseline, baseline))
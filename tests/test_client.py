@@ -0,0 +1,92 @@
+import events
+from client import Client
+from clock import VirtualClock
+from cluster import Cluster
+from consensus import ConsensusAlgorithm
+from events import RingBufferSink
+
+SERVERS = [
+    {"id": server_id, "failure_prob": 0.2, "weight": 1, "recovery_delay_min": 10, "recovery_delay_max": 20}
+    for server_id in (1, 2, 3)
+]
+
+
+class NoFaults:
+    """
+    Updates and reads never fail
+    """
+
+    def update_failure(self, server):
+        return None
+
+    def read_failure(self, server):
+        return False
+
+    def wait_ms(self, low, high):
+        return low
+
+
+def make_client(batch_size, batch_window_ms=None):
+    clock = VirtualClock()
+    sink = RingBufferSink()
+    servers = Cluster(SERVERS, clock=clock, faults=NoFaults())
+    consensus = ConsensusAlgorithm(servers=servers, clock=clock, event_sink=sink)
+    client = Client(servers=servers, consensus=consensus, batch_size=batch_size, batch_window_ms=batch_window_ms)
+    client.create_initial_file(file_name="initial_file.txt", content="This is the initial content.")
+    client.distribute_file()
+    return client, clock, sink
+
+
+def queue_update(client):
+    client.update_file()
+    return client.apply_update()
+
+
+def test_batch_is_committed_when_full():
+    client, clock, sink = make_client(batch_size=3)
+    assert queue_update(client) is None
+    assert queue_update(client) is None
+    assert queue_update(client) is not None
+    assert client.pending_updates == []
+    # Only the newest version of the batch is sent
+    [batch] = sink.of_type(events.UPDATE_BATCH)
+    assert batch.fields == {"versions": [2, 3, 4], "sent": 4}
+    assert {server.file_version for server in client.servers} == {4}
+
+
+def test_window_commits_the_last_partial_batch():
+    client, clock, sink = make_client(batch_size=10, batch_window_ms=50)
+    queue_update(client)
+    clock.sleep(20)
+    queue_update(client)
+    clock.sleep(29)
+    assert len(client.pending_updates) == 2
+    clock.sleep(1)
+    # The window of the oldest version expired without another write
+    assert client.pending_updates == []
+    [batch] = sink.of_type(events.UPDATE_BATCH)
+    assert batch.time_ms == 50 and batch.fields["sent"] == 3
+
+
+def test_window_event_of_a_committed_batch_is_ignored():
+    client, clock, sink = make_client(batch_size=10, batch_window_ms=50)
+    queue_update(client)
+    client.flush_updates()
+    clock.sleep(30)
+    queue_update(client)
+    # The event of the first batch fires at 50 ms and must not commit the second one early
+    clock.sleep(40)
+    assert len(client.pending_updates) == 1
+    clock.sleep(10)
+    assert client.pending_updates == []
+    assert [event.time_ms for event in sink.of_type(events.UPDATE_BATCH)] == [0, 80]
+
+
+def test_flush_and_restore_commit_the_queue():
+    client, clock, sink = make_client(batch_size=10)
+    assert client.flush_updates() is None
+    queue_update(client)
+    queue_update(client)
+    restored = client.restore_file()
+    assert client.pending_updates == []
+    assert restored["version"] == client.current_file.version == 3
@@ -0,0 +1,58 @@
+from clock import VirtualClock, WallClock
+from main import run_simulation
+
+SERVERS = [
+    {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+    {"id": 2, "failure_prob": 0.2, "weight": 7, "recovery_delay_min": 20, "recovery_delay_max": 35},
+    {"id": 3, "failure_prob": 0.4, "weight": 2, "recovery_delay_min": 25, "recovery_delay_max": 45},
+]
+
+
+def test_sleep_advances_the_time_and_runs_the_due_events_in_order():
+    clock = VirtualClock(start_ms=100)
+    calls = []
+    clock.call_later(20, calls.append, "b")
+    clock.call_at(110, calls.append, "a")
+    clock.call_later(20, lambda: calls.append(("c", clock.now_ms())))  # Same time as "b": FIFO order
+    clock.call_later(50, calls.append, "d")
+    clock.sleep(30)
+    assert clock.now_ms() == 130
+    assert calls == ["a", "b", ("c", 120)]
+    assert clock.pending_events() == 1
+    clock.sleep(-5)
+    assert clock.now_ms() == 130
+
+
+def test_events_scheduled_by_an_event_and_run_pending():
+    clock = VirtualClock()
+    times = []
+
+    def tick():
+        times.append(clock.now_ms())
+        if len(times) < 3:
+            clock.call_later(10, tick)
+
+    clock.call_later(10, tick)
+    clock.run_pending()
+    assert times == [10, 20, 30] and clock.now_ms() == 30
+    clock.advance_to(45)
+    assert clock.now_ms() == 45 and clock.pending_events() == 0
+
+
+def test_wall_clock_runs_the_events_that_are_due():
+    clock = WallClock()
+    calls = []
+    clock.call_later(0, calls.append, "due")
+    clock.call_later(60_000, calls.append, "later")
+    clock.sleep(0)
+    assert calls == ["due"] and clock.pending_events() == 1
+
+
+def test_simulated_time_does_not_depend_on_the_wall_clock():
+    ends = []
+    for _ in range(2):
+        clock = VirtualClock()
+        restored, expected = run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5,
+                                            clock=clock, seed=3)
+        ends.append((clock.now_ms(), restored and restored["version"], expected.version))
+    assert ends[0] == ends[1] and ends[0][0] >= 50
@@ -0,0 +1,70 @@
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+from clock import VirtualClock
+from cluster import Cluster, generate_server_settings
+from consensus import ConsensusAlgorithm
+from file import File
+from quorum import Quorum
+from storage import KeyedStore
+
+
+def test_generated_settings_are_reproducible():
+    settings = generate_server_settings(200, failure_prob=(0.1, 0.2), weight=(1, 3), recovery_delay_min=(5, 10),
+                                        recovery_delay_spread=4, seed=9)
+    assert settings == generate_server_settings(200, failure_prob=(0.1, 0.2), weight=(1, 3),
+                                                recovery_delay_min=(5, 10), recovery_delay_spread=4, seed=9)
+    assert [s["id"] for s in settings] == list(range(1, 201))
+    assert all(0.1 <= s["failure_prob"] <= 0.2 and 1 <= s["weight"] <= 3 for s in settings)
+    assert all(s["recovery_delay_max"] - s["recovery_delay_min"] == 4 for s in settings)
+    servers = Cluster(settings)
+    assert [server.weight for server in servers] == [s["weight"] for s in settings]
+
+
+def test_quorum_tally():
+    servers = [SimpleNamespace(weight=weight) for weight in (6, 1, 1, 1, 1)]
+    expected = {"all": [False, False, False, False, True], "majority": [False, False, True, True, True],
+                "weighted": [True, True, True, True, True]}
+    for mode, reached in expected.items():
+        tally = Quorum(servers, mode).tally()
+        for server, expected_reached in zip(servers, reached):
+            tally.add(server)
+            assert tally.reached() == expected_reached
+        assert (tally.count, tally.weight) == (5, 10)
+    # Exactly half of the weight is not a quorum
+    assert not Quorum(servers, "weighted").reached(1, 5)
+    try:
+        Quorum(servers, "most")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("An unknown quorum mode was accepted")
+
+
+def test_server_state_has_no_instance_dictionary():
+    server = Cluster(generate_server_settings(1, seed=0))[0]
+    for state in (server, server.store, KeyedStore()):
+        assert not hasattr(state, "__dict__")
+    with pytest.raises(AttributeError):
+        server.nickname = "replica"
+
+
+def test_large_cluster_is_compact():
+    settings = generate_server_settings(10_000, seed=1)
+    tracemalloc.start()
+    try:
+        servers = Cluster(settings, clock=VirtualClock())
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # An empty server and its version log take well under a kilobyte
+    assert allocated / len(servers) < 1024
+
+    initial = File("file.txt", "v1", version=1)
+    for server in servers:
+        server.store_file(version=1, file=initial)
+    consensus = ConsensusAlgorithm(servers, clock=servers[0].clock, quorum="majority")
+    assert consensus.update_consensus(File("file.txt", "v2", version=2))
+    assert consensus.restore_consensus()["version"] == 2
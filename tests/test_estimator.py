@@ -0,0 +1,38 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import estimator
+import simulation_runner
+
+
+def test_wilson_interval_bounds():
+    low, high = estimator.wilson_interval(50, 100)
+    assert low == pytest.approx(0.4038, abs=1e-4) and high == pytest.approx(0.5962, abs=1e-4)
+    # The interval stays within [0, 1] and is not empty at the extremes
+    low, high = estimator.wilson_interval(0, 20)
+    assert low == 0.0 and 0 < high < 0.2
+    low, high = estimator.wilson_interval(20, 20)
+    assert 0.8 < low < 1 and high == 1.0
+    assert estimator.wilson_interval(0, 0) == (0.0, 1.0)
+    # More trials give a narrower interval around the same rate
+    narrow = estimator.wilson_interval(5000, 10000)
+    assert narrow[1] - narrow[0] < high - low
+
+
+def test_estimate_is_reproducible_and_holds_its_rate():
+    config = simulation_runner.default_configs()[2]
+    first = estimator.estimate_accuracy(config["server_settings"], config["retry_limit"], trials=2000, seed=4)
+    second = estimator.estimate_accuracy(config["server_settings"], config["retry_limit"], trials=2000, seed=4)
+    assert first == second
+    assert first["trials"] == 2000 and first["restore_accuracy"] == first["successes"] / 2000
+    assert first["ci_low"] <= first["restore_accuracy"] <= first["ci_high"]
+
+
+def test_estimate_matches_the_object_simulator():
+    configs = [config for config in simulation_runner.default_configs()
+               if config["name"] in ("Low_retry_High_failure", "Reliable")]
+    rows = simulation_runner.run_batch(configs, trials=200, workers=1, collect_metrics=False)
+    for config, row in zip(configs, rows):
+        estimate = estimator.estimate_accuracy(config["server_settings"], config["retry_limit"], trials=20_000)
+        assert estimate["restore_accuracy"] == pytest.approx(row["restore_accuracy"], abs=0.08), config["name"]
@@ -0,0 +1,76 @@
+import io
+import json
+
+import events
+from events import NULL_SINK, ConsoleSink, EventSink, JsonLinesSink, RingBufferSink
+from main import run_simulation
+
+SERVERS = [
+    {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+    {"id": 2, "failure_prob": 0.2, "weight": 7, "recovery_delay_min": 20, "recovery_delay_max": 35},
+    {"id": 3, "failure_prob": 0.4, "weight": 2, "recovery_delay_min": 25, "recovery_delay_max": 45},
+]
+
+
+class DisabledSink(EventSink):
+    enabled = False
+
+    def emit(self, type, source, time_ms=None, **fields):
+        raise AssertionError("an event was built for a disabled sink")
+
+
+def test_disabled_sinks_receive_no_event(capsys):
+    restored, expected = run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5,
+                                        event_sink=DisabledSink(), seed=1)
+    assert expected.version == 6
+    assert capsys.readouterr().out == ""
+    assert not NULL_SINK.enabled
+
+
+def test_ring_buffer_keeps_the_latest_events():
+    sink = RingBufferSink(capacity=3)
+    for version in range(5):
+        sink.emit(events.ACK, "consensus", version * 10, server=1, version=version)
+    assert [event.fields["version"] for event in sink.events] == [2, 3, 4]
+    assert sink.of_type(events.ACK)[-1] == events.Event(events.ACK, "consensus", 40, {"server": 1, "version": 4})
+    assert sink.of_type(events.TIMEOUT) == []
+
+
+def test_simulation_events_are_stamped_with_the_clock():
+    sink = RingBufferSink()
+    run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5, event_sink=sink, seed=1)
+    times = [event.time_ms for event in sink.events if event.source in ("client", "consensus")]
+    assert times == sorted(times)
+    assert len(sink.of_type(events.UPDATE_STARTED)) == 5
+    assert [event.fields["version"] for event in sink.of_type(events.FILE_CREATED)] == [1, 2, 3, 4, 5, 6]
+
+
+def test_json_lines_sink_writes_in_batches(tmp_path):
+    stream = io.StringIO()
+    sink = JsonLinesSink(stream, buffer_size=2)
+    sink.emit(events.ACK, "consensus", 1.5, server=2)
+    assert stream.getvalue() == ""
+    sink.emit(events.TIMEOUT, "consensus", 3, server=3, waiting_for="ack")
+    sink.emit(events.ERROR, "server 1", error=ValueError("boom"))
+    sink.close()
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert records == [
+        {"type": "ack", "source": "consensus", "time_ms": 1.5, "server": 2},
+        {"type": "timeout", "source": "consensus", "time_ms": 3, "server": 3, "waiting_for": "ack"},
+        {"type": "error", "source": "server 1", "time_ms": None, "error": "boom"},
+    ]
+
+    path = tmp_path / "events.jsonl"
+    sink = JsonLinesSink(str(path))
+    sink.emit(events.ACK, "consensus", 0)
+    sink.close()
+    assert sink.stream.closed and json.loads(path.read_text())["type"] == "ack"
+
+
+def test_console_sink_format():
+    stream = io.StringIO()
+    sink = ConsoleSink(stream)
+    sink.emit(events.ACK, "consensus", 12, server=2, version=3)
+    sink.emit(events.FILE_CREATED, "client")
+    assert stream.getvalue().splitlines() == ["[    12.0 ms] Consensus: ack (server=2, version=3)",
+                                              "Client: file_created"]
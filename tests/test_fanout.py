@@ -0,0 +1,71 @@
+import pytest
+
+import events
+from clock import VirtualClock
+from cluster import Cluster
+from consensus import ConsensusAlgorithm
+from events import RingBufferSink
+from file import File
+
+
+class FailingUpdates:
+    def __init__(self, failures):
+        """
+        The first update of each listed server id fails, with a recovery delay of 10 ms; reads never fail
+        """
+        self.failures = list(failures)
+
+    def update_failure(self, server):
+        if server.id in self.failures:
+            self.failures.remove(server.id)
+            return 10
+        return None
+
+    def read_failure(self, server):
+        return False
+
+    def wait_ms(self, low, high):
+        return low
+
+
+def run_update(fanout, quorum="all", failures=()):
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 10, "recovery_delay_max": 10}
+                for i in range(1, 6)]
+    clock = VirtualClock()
+    sink = RingBufferSink()
+    servers = Cluster(settings, clock=clock, faults=FailingUpdates(failures))
+    consensus = ConsensusAlgorithm(servers, clock=clock, fanout=fanout, quorum=quorum, event_sink=sink)
+    try:
+        committed = consensus.update_consensus(File("file.txt", "content v1", version=1), retry_period_ms=10)
+        restored = consensus.restore_consensus()
+    finally:
+        consensus.close()
+    return committed, restored, servers, sink
+
+
+def test_concurrent_fan_out_gives_the_sequential_results():
+    for failures in ((), (2, 4)):
+        sequential = run_update("sequential", failures=failures)
+        concurrent = run_update("concurrent", failures=failures)
+        for committed, restored, servers, _ in (sequential, concurrent):
+            assert committed and restored["version"] == 1 and restored["content"] == "content v1"
+            assert [server.file_version for server in servers] == [1] * 5
+        # Both retry the failed servers once, after the retry period
+        for _, _, _, sink in (sequential, concurrent):
+            assert [event.fields["server"] for event in sink.of_type(events.UPDATE_SENT)][5:] == list(failures)
+
+
+def test_concurrent_round_sends_every_update_before_the_acks():
+    _, _, _, sink = run_update("concurrent")
+    types = [event.type for event in sink.events if event.source == "consensus"
+             and event.type in (events.UPDATE_SENT, events.ACK)]
+    assert types == [events.UPDATE_SENT] * 5 + [events.ACK] * 5
+    _, _, _, sink = run_update("sequential")
+    types = [event.type for event in sink.events if event.source == "consensus"
+             and event.type in (events.UPDATE_SENT, events.ACK)]
+    assert types == [events.UPDATE_SENT, events.ACK] * 5
+
+
+def test_unknown_fan_out_is_rejected():
+    with pytest.raises(ValueError, match="Unknown fan-out mode"):
+        ConsensusAlgorithm([], fanout="parallel")
@@ -0,0 +1,70 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from events import RingBufferSink
+from faults import FailureTrace, FaultRecorder, RandomFaults, TraceReplay
+from main import run_simulation
+
+SERVERS = [
+    {"id": 1, "failure_prob": 0.3, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+    {"id": 2, "failure_prob": 0.3, "weight": 7, "recovery_delay_min": 20, "recovery_delay_max": 35},
+    {"id": 3, "failure_prob": 0.4, "weight": 2, "recovery_delay_min": 25, "recovery_delay_max": 45},
+]
+
+
+def run(**options):
+    sink = RingBufferSink(capacity=100_000)
+    restored, expected = run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5,
+                                        event_sink=sink, **options)
+    return restored, [(event.type, event.source, event.time_ms, event.fields) for event in sink.events]
+
+
+def test_each_server_draws_from_its_own_stream():
+    servers = [SimpleNamespace(id=i, failure_prob=0.5, recovery_delay_min=1, recovery_delay_max=50) for i in (1, 2)]
+    alone = RandomFaults(seed=11)
+    expected = [alone.update_failure(servers[1]) for _ in range(20)]
+    interleaved = RandomFaults(seed=11)
+    draws = []
+    for _ in range(20):
+        interleaved.update_failure(servers[0])
+        interleaved.read_failure(servers[0])
+        draws.append(interleaved.update_failure(servers[1]))
+    assert draws == expected
+    other_seed = RandomFaults(seed=12)
+    assert [other_seed.update_failure(servers[1]) for _ in range(20)] != expected
+
+
+def test_seeded_runs_do_not_depend_on_the_random_module():
+    random.seed(1)
+    first = run(seed=5)
+    random.seed(2)
+    assert run(seed=5) == first
+    assert run(seed=6) != first
+
+
+def test_recorded_trace_replays_the_run(tmp_path):
+    recorder = FaultRecorder(RandomFaults(seed=8))
+    recorded = run(faults=recorder)
+    path = str(tmp_path / "trace.jsonl")
+    recorder.trace.save(path)
+    trace = FailureTrace.load(path)
+    assert trace.records == recorder.trace.records and len(trace) > 0
+    replay = TraceReplay(trace)
+    assert run(faults=replay) == recorded
+    assert replay.remaining() == 0
+
+
+def test_a_diverging_run_is_reported(tmp_path):
+    recorder = FaultRecorder(RandomFaults(seed=8))
+    run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5, num_updates=2, faults=recorder)
+    with pytest.raises(ValueError, match="diverged from the trace"):
+        run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5, num_updates=5,
+                       faults=TraceReplay(recorder.trace))
+    with pytest.raises(ValueError, match="Unknown trace record"):
+        TraceReplay(FailureTrace([{"op": "crash", "server": 1}]))
+    path = tmp_path / "other.jsonl"
+    path.write_text('{"format": "events"}\n')
+    with pytest.raises(ValueError, match="Not a failure trace"):
+        FailureTrace.load(str(path))
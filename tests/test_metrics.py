@@ -0,0 +1,72 @@
+import json
+import pickle
+
+from clock import VirtualClock
+from main import run_simulation
+from metrics import NULL_METRICS, Histogram, Metrics
+
+SERVERS = [
+    {"id": 1, "failure_prob": 0.1, "weight": 10, "recovery_delay_min": 10, "recovery_delay_max": 25},
+    {"id": 2, "failure_prob": 0.2, "weight": 7, "recovery_delay_min": 20, "recovery_delay_max": 35},
+    {"id": 3, "failure_prob": 0.4, "weight": 2, "recovery_delay_min": 25, "recovery_delay_max": 45},
+]
+
+
+def test_histogram_quantiles_and_merge():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) is None and histogram.summary()["mean"] is None
+    for value in range(1, 101):
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert (summary["count"], summary["mean"], summary["max"]) == (100, 50.5, 100)
+    # Quantiles are bucket upper bounds: within a quarter decade of the exact value, capped to the maximum
+    assert 50 <= summary["p50"] <= 50 * 10 ** 0.25
+    assert 95 <= summary["p95"] <= 100 and summary["p99"] == 100
+
+    other = Histogram()
+    other.observe(0.5)
+    other.observe(1000)
+    histogram.merge(other)
+    assert (histogram.count, histogram.min, histogram.max) == (102, 0.5, 1000)
+    assert Histogram.from_dict(json.loads(json.dumps(histogram.to_dict()))).summary() == histogram.summary()
+
+
+def test_counters_spans_and_snapshot():
+    metrics = Metrics()
+    clock = VirtualClock()
+    metrics.incr("acks")
+    metrics.incr("acks", 2)
+    with metrics.span("update_phase", clock):
+        clock.sleep(15)
+    snapshot = metrics.snapshot()
+    assert snapshot["acks"] == 3 and snapshot["update_phase_count"] == 1
+    assert snapshot["update_phase_sim_ms_max"] == 15 and snapshot["update_phase_ms_count"] == 1
+
+    other = Metrics()
+    other.incr("acks")
+    other.observe("update_phase_sim_ms", 5)
+    metrics.merge(other)
+    assert metrics.counters["acks"] == 4 and metrics.histograms["update_phase_sim_ms"].count == 2
+    restored = pickle.loads(pickle.dumps(metrics))
+    assert restored.snapshot() == metrics.snapshot()
+    assert Metrics.from_dict(json.loads(json.dumps(metrics.to_dict()))).snapshot() == metrics.snapshot()
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_null_metrics_record_nothing():
+    with NULL_METRICS.span("update_phase", VirtualClock()):
+        NULL_METRICS.incr("acks")
+        NULL_METRICS.observe("update_rpc_ms", 1)
+    assert not NULL_METRICS.enabled and NULL_METRICS.snapshot() == {}
+
+
+def test_simulation_records_every_phase():
+    metrics = Metrics()
+    run_simulation(SERVERS, retry_limit=3, retry_period_ms=10, ack_timeout_ms=5, metrics=metrics, seed=2)
+    counters = metrics.counters
+    assert counters["update_phase_count"] == 5 and counters["retry_phase_count"] == 5
+    assert counters["restore_phase_count"] == 1
+    assert counters["update_rpcs"] >= 15 and 0 < counters["acks"] <= counters["update_rpcs"]
+    assert counters["restore_votes"] <= counters["restore_reads"]
+    assert metrics.histograms["update_rpc_ms"].count == counters["update_rpcs"]
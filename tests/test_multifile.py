@@ -0,0 +1,79 @@
+import random
+from types import SimpleNamespace
+
+from clock import VirtualClock
+from cluster import Cluster, generate_server_settings
+from consensus import ConsensusAlgorithm
+from file import File
+from main import run_multi_file_simulation
+from sharding import HashRing
+
+
+def test_sharded_files_are_restored():
+    for replication in (1, 2, 3, None):
+        settings = generate_server_settings(12, failure_prob=(0.05, 0.3), seed=replication or 0)
+        random.seed(replication)
+        restored, expected = run_multi_file_simulation(settings, 3, 10, num_files=30, num_updates=3,
+                                                       replication=replication, quorum="all")
+        assert all(restored[key]["version"] == file.version for key, file in expected.items())
+
+
+def test_stragglers_are_retried():
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 5}
+                for i in range(1, 4)]
+    servers = Cluster(settings)
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), quorum="majority")
+    files = {key: File(f"{key}.txt", key) for key in ("a", "b")}
+    servers[2].operational, servers[2].recovery_time_ms = False, 8  # Down during the update phase
+    assert consensus.update_files(files, retry_limit=1) == {"a": True, "b": True}
+    assert consensus.unresponsive_files == {servers[2]: ["a", "b"]}
+    consensus.retry_unresponsive_files(files)
+    assert consensus.unresponsive_files == {}
+    assert [servers[2].file_version_of(key) for key in files] == [1, 1]
+
+
+class NoFaults:
+    """
+    Updates and reads never fail
+    """
+
+    def update_failure(self, server):
+        return None
+
+    def read_failure(self, server):
+        return False
+
+    def wait_ms(self, low, high):
+        return low
+
+
+def test_keyed_restores_do_not_share_unresponsive_servers():
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 10 if i == 3 else 1, "recovery_delay_min": 5,
+                 "recovery_delay_max": 5} for i in range(1, 6)]
+    servers = Cluster(settings, faults=NoFaults())
+    # Servers 1 and 2 do not hold "a": their reads of it fail
+    for server in servers[2:]:
+        server.update_files({"a": File("a.txt", "a")}, 0)
+    # "b": version 1 on servers 1 and 2, version 3 on the heavy server 3, version 2 on servers 4 and 5
+    for server, version in zip(servers, [1, 1, 3, 2, 2]):
+        server.update_files({"b": File(f"b_v{version}.txt", f"b{version}", version=version)}, 0)
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock())
+    assert consensus.restore_consensus(key="a", retry_limit=1)["version"] == 1
+    assert consensus.unresponsive_servers == set()
+    # No version of "b" is held by a majority of its five replicas, the weighted fallback decides
+    assert consensus.restore_consensus(key="b", retry_limit=1)["version"] == 3
+
+
+def test_hash_ring_spreads_and_keeps_the_files():
+    servers = [SimpleNamespace(id=index) for index in range(50)]
+    ring = HashRing(servers, replication=3)
+    load = dict.fromkeys(range(50), 0)
+    for key in range(5000):
+        replicas = [server.id for server in ring.replicas(f"file-{key}")]
+        assert len(set(replicas)) == 3
+        for server_id in replicas:
+            load[server_id] += 1
+    assert max(load.values()) < 1.5 * 300 and min(load.values()) > 0.5 * 300
+    smaller = HashRing(servers[:-1], replication=3)
+    moved = sum(ring.replicas(f"file-{key}") != smaller.replicas(f"file-{key}") for key in range(5000))
+    assert moved < 5000 * 3 * 2 / 50
@@ -0,0 +1,106 @@
+import socket
+
+from clock import VirtualClock
+from consensus import ConsensusAlgorithm
+from file import File
+from network import HEADER, NetworkedCluster, recv_frame, send_frame
+from retry import BackoffRetryPolicy
+
+SERVERS = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 10}
+           for i in range(1, 4)]
+
+
+def test_frame_round_trip():
+    left, right = socket.socketpair()
+    with left, right:
+        payloads = [b"", b"x", bytes(range(256)) * 300]
+        for message_type, payload in enumerate(payloads, start=1):
+            send_frame(left, message_type, payload)
+        for message_type, payload in enumerate(payloads, start=1):
+            assert recv_frame(right) == (message_type, payload)
+        # A frame cut short by the peer is an error, not a truncated payload
+        left.sendall(HEADER.pack(2, 10) + b"abc")
+        left.shutdown(socket.SHUT_WR)
+        try:
+            recv_frame(right)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("A truncated frame was accepted")
+
+
+def test_update_with_a_dead_server():
+    cluster = NetworkedCluster(SERVERS, family="unix")
+    try:
+        for server in cluster.servers:
+            server.store_file(1, File("initial_file.txt", "v1"))
+        cluster.processes[0].terminate()
+        cluster.processes[0].join()
+        for policy in (None, BackoffRetryPolicy(jitter=0)):
+            consensus = ConsensusAlgorithm(cluster.servers, clock=VirtualClock(), quorum="majority",
+                                           retry_policy=policy)
+            version = 2 if policy is None else 3
+            assert consensus.update_consensus(File("updated_file.txt", f"v{version}", version=version))
+            consensus.retry_unresponsive_servers(File("updated_file.txt", f"v{version}", version=version))
+            assert consensus.unavailable_servers == {cluster.servers[0]}
+            restored = consensus.restore_consensus()
+            assert restored["version"] == version
+    finally:
+        cluster.close()
+
+
+def test_update_sends_only_the_missing_chunks():
+    chunk_size = 4096
+    base = "".join(chr(ord("a") + index) * chunk_size for index in range(10))  # Ten chunks
+    cluster = NetworkedCluster(SERVERS, family="unix", max_file_size=len(base) + chunk_size)
+    try:
+        consensus = ConsensusAlgorithm(cluster.servers, clock=VirtualClock())
+        assert consensus.update_consensus(File("data.txt", base, version=1))
+        assert [server.content_bytes_sent for server in cluster.servers] == [len(base)] * 3
+        # One chunk changes and one is appended, the other nine are not sent again
+        changed = base[:chunk_size] + "x" * chunk_size + base[2 * chunk_size:] + "tail"
+        assert consensus.update_consensus(File("data.txt", changed, version=2))
+        assert [server.content_bytes_sent for server in cluster.servers] == [len(base) + chunk_size + 4] * 3
+        restored = consensus.restore_consensus()
+        assert (restored["version"], restored["content"]) == (2, changed)
+    finally:
+        cluster.close()
+
+
+def read(server, attempts=20):
+    """
+    Return the first successful retrieve of a server (reads fail at random), or None
+    """
+    for _ in range(attempts):
+        response = server.retrieve_file()
+        if response is not None:
+            return response
+    return None
+
+
+def test_size_limit_of_the_server_process():
+    cluster = NetworkedCluster(SERVERS[:1], family="unix", max_file_size=1000)
+    try:
+        [server] = cluster.servers
+        server.store_file(1, File("big.txt", "x" * 5000))
+        assert read(server) is None
+        assert not server.update_file(File("big.txt", "x" * 5000, version=2, max_size=10_000), 0)
+        # The rejected content was drained, the connection serves the next request
+        assert server.update_file(File("small.txt", "small", version=3), 0)
+        assert read(server)["content"] == "small"
+    finally:
+        cluster.close()
+
+
+def test_retrieve_streams_the_content():
+    content = bytes(range(256)) * 4096  # 1 MB, 256 chunks
+    cluster = NetworkedCluster(SERVERS[:1], family="unix", max_file_size=len(content))
+    try:
+        [server] = cluster.servers
+        assert server.update_file(File("data.txt", content), 0)
+        received = server.bytes_received
+        retrieved = read(server)
+        assert (retrieved["version"], retrieved["content"], retrieved["file_name"]) == (1, content, "data.txt")
+        assert server.bytes_received - received > len(content)
+    finally:
+        cluster.close()
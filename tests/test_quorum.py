@@ -0,0 +1,134 @@
+import random
+
+import events
+from clock import VirtualClock
+from cluster import Cluster
+from consensus import ConsensusAlgorithm
+from events import RingBufferSink
+from file import File
+from metrics import Metrics
+from routing import ReadRouter
+from server import Server
+
+
+class ScriptedFaults:
+    def __init__(self, read_failures=()):
+        """
+        No update failures; the reads of the listed server ids fail once each
+        """
+        self.read_failures = list(read_failures)
+
+    def update_failure(self, server):
+        return None
+
+    def read_failure(self, server):
+        if server.id in self.read_failures:
+            self.read_failures.remove(server.id)
+            return True
+        return False
+
+    def wait_ms(self, low, high):
+        return low
+
+
+def make_cluster(weights, versions, faults):
+    """
+    Return servers with the given weights, server i holding version versions[i] (None for no file)
+    """
+    settings = [{"id": index + 1, "failure_prob": 0.0, "weight": weight, "recovery_delay_min": 1,
+                 "recovery_delay_max": 1} for index, weight in enumerate(weights)]
+    servers = Cluster(settings, faults=faults)
+    for server, version in zip(servers, versions):
+        if version is not None:
+            server.store_file(version, File(f"file_v{version}.txt", f"content {version}", version=version))
+    return servers
+
+
+def restore(weights, versions, quorum, read_failures=(), **options):
+    servers = make_cluster(weights, versions, ScriptedFaults(read_failures))
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), quorum=quorum, **options)
+    restored = consensus.restore_consensus(retry_limit=3)
+    return restored["version"] if restored else None
+
+
+def test_weighted_restore_does_not_depend_on_read_failures():
+    # Server 1 alone holds more than half of the weight
+    assert restore([10, 3, 2], [6, 5, 5], "weighted") == 6
+    assert restore([10, 3, 2], [6, 5, 5], "weighted", read_failures=[3]) == 6
+    assert restore([10, 3, 2], [6, 5, 5], "weighted", fanout="concurrent") == 6
+
+
+def test_restore_stops_as_soon_as_the_quorum_is_reached():
+    servers = make_cluster([1] * 5, [4] * 5, ScriptedFaults())
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), quorum="majority", metrics=Metrics())
+    assert consensus.restore_consensus()["version"] == 4
+    assert consensus.metrics.counters["restore_reads"] == 3
+
+
+def test_routed_restore_matches_full_restore():
+    rng = random.Random(0)
+    for quorum in ("all", "majority", "weighted"):
+        for case in range(300):
+            size = rng.randint(1, 7)
+            weights = [rng.randint(1, 10) for _ in range(size)]
+            versions = [rng.choice([None, 4, 5, 6]) for _ in range(size)]
+            read_failures = [rng.randint(1, size) for _ in range(rng.randint(0, size))]
+            full = restore(weights, versions, quorum, read_failures)
+            routed = restore(weights, versions, quorum, read_failures, read_router=ReadRouter())
+            assert routed == full, (quorum, weights, versions, read_failures)
+
+
+def test_majority_by_hash_then_weighted_fallback():
+    # Two of three servers agree: the majority wins over the heavier server
+    assert restore([1, 1, 10], [5, 5, 4], "all") == 5
+    # No group holds more than half of the servers: the heavier group wins
+    assert restore([1, 1, 3, 1], [5, 5, 4, 4], "all") == 4
+    # Equal weights and counts go to the newer version, whatever the order of the answers
+    assert restore([2, 2], [5, 4], "all") == restore([2, 2], [4, 5], "all") == 5
+    assert restore([1, 1], [None, None], "all") is None
+
+
+def test_restore_tallies_the_stored_digests():
+    metrics = Metrics()
+    servers = make_cluster([1] * 5, [3, 3, 3, 2, 2], ScriptedFaults())
+    for server in servers:
+        server.metrics = metrics
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), metrics=metrics)
+    restored = consensus.restore_consensus()
+    assert restored["version"] == 3 and restored["content"] == "content 3"
+    # One vote per server, two hash groups, and no file hashed again
+    assert metrics.counters["restore_votes"] == 5
+    assert metrics.histograms["restore_hash_groups"].summary()["max"] == 2
+    assert "hash_computations" not in metrics.counters
+
+
+def test_restore_probes_then_fetches_the_content_once():
+    servers = make_cluster([1] * 5, [4] * 5, ScriptedFaults())
+    sink = RingBufferSink()
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), metrics=Metrics(), event_sink=sink)
+    restored = consensus.restore_consensus()
+    assert (restored["version"], restored["content"]) == (4, "content 4")
+    counters = consensus.metrics.counters
+    assert (counters["restore_reads"], counters["restore_fetches"]) == (5, 1)
+    assert counters["restore_bytes_received"] == len("content 4")
+    assert [event.fields["server"] for event in sink.of_type(events.RESTORE_FETCH)] == [1]
+
+
+def test_fetch_fails_over_within_the_winning_group(monkeypatch):
+    servers = make_cluster([1] * 3, [4] * 3, ScriptedFaults())
+    retrieve_file = Server.retrieve_file
+
+    def retrieve(server, version=None, key=None):
+        response = retrieve_file(server, version, key)
+        if server.id == 1:
+            return None
+        if server.id == 2:
+            # Moved on to another content since its vote
+            return dict(response, hash="0" * 64, content="other content")
+        return response
+
+    monkeypatch.setattr(Server, "retrieve_file", retrieve)
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), metrics=Metrics())
+    assert consensus.restore_consensus()["content"] == "content 4"
+    counters = consensus.metrics.counters
+    assert (counters["restore_fetches"], counters["restore_fetch_failures"]) == (3, 2)
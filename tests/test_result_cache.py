@@ -0,0 +1,72 @@
+import simulation_runner
+import trials as trials_module
+from metrics import Metrics
+from result_cache import ResultCache, code_version
+
+
+def test_code_version_covers_the_trial_code(tmp_path):
+    for name in ("main.py", "trials.py", "simulation_runner.py"):
+        (tmp_path / name).write_text(f"# {name}\n")
+    version = code_version(tmp_path)
+    (tmp_path / "simulation_runner.py").write_text("# presentation only\n")
+    assert code_version(tmp_path) == version
+    (tmp_path / "trials.py").write_text("# trials seeded differently\n")
+    assert code_version(tmp_path) != version
+
+
+def cached_run(cache, config, trials, monkeypatch):
+    """
+    Runs the sweep of one configuration with the cache, return its row and the trial indices that were run
+    """
+    ran = []
+    run_trials = trials_module.run_trials
+
+    def recording_run_trials(config, chunk, *args):
+        ran.extend(chunk)
+        return run_trials(config, chunk, *args)
+
+    monkeypatch.setattr(trials_module, "run_trials", recording_run_trials)
+    [row] = simulation_runner.run_batch([config], trials=trials, workers=1, cache=cache)
+    cache.flush()
+    return row, ran
+
+
+def test_cached_trials_are_not_run_again(tmp_path, monkeypatch):
+    config = simulation_runner.default_configs()[4]
+    with ResultCache(str(tmp_path), version="v1") as cache:
+        row, ran = cached_run(cache, config, 4, monkeypatch)
+        assert ran == [0, 1, 2, 3]
+        cached_row, ran = cached_run(cache, config, 4, monkeypatch)
+        assert ran == [] and cached_row == row
+        # More trials only run the missing ones
+        _, ran = cached_run(cache, config, 6, monkeypatch)
+        assert ran == [4, 5]
+    # A new cache object reads the same files
+    with ResultCache(str(tmp_path), version="v1") as cache:
+        assert sorted(cache.load(config, 5, 0)) == list(range(6))
+
+
+def test_cache_key_invalidation(tmp_path):
+    cache = ResultCache(str(tmp_path), version="v1")
+    config = simulation_runner.default_configs()[4]
+    key = cache.key(config, 5, 0)
+    assert key == cache.key(dict(reversed(list(config.items()))), 5, 0)
+    changed_server = dict(config, server_settings=[dict(config["server_settings"][0], weight=99)]
+                          + config["server_settings"][1:])
+    for other in (cache.key(dict(config, retry_limit=config["retry_limit"] + 1), 5, 0),
+                  cache.key(changed_server, 5, 0),
+                  cache.key(config, 6, 0),
+                  cache.key(config, 5, 1),
+                  ResultCache(str(tmp_path), version="v2").key(config, 5, 0)):
+        assert other != key
+
+
+def test_load_skips_torn_lines_and_trials_without_metrics(tmp_path):
+    config = simulation_runner.default_configs()[4]
+    with ResultCache(str(tmp_path), version="v1") as cache:
+        cache.append(config, 5, 0, 0, True, Metrics())
+        cache.append(config, 5, 0, 1, False)
+    with open(cache._path(cache.key(config, 5, 0)), "a") as f:
+        f.write('{"trial": 2, "succ')
+    assert list(cache.load(config, 5, 0)) == [0]
+    assert cache.load(config, 5, 0, with_metrics=False) == {0: (True, None), 1: (False, None)}
@@ -0,0 +1,113 @@
+import random
+
+from clock import VirtualClock
+from cluster import Cluster
+from consensus import ConsensusAlgorithm
+from events import RingBufferSink
+from file import File
+from main import run_simulation
+from retry import BackoffRetryPolicy, FixedRetryPolicy
+from server import Server
+
+
+class CountingPolicy(BackoffRetryPolicy):
+    def __init__(self):
+        super().__init__(jitter=0)
+        self.calls = 0
+
+    def delay_ms(self, attempt, current_time_ms, hint_ms=None):
+        self.calls += 1
+        return super().delay_ms(attempt, current_time_ms, hint_ms)
+
+
+def test_backoff_grows_up_to_the_cap():
+    policy = BackoffRetryPolicy(base_delay_ms=5, multiplier=2.0, max_delay_ms=30, jitter=0)
+    assert [policy.delay_ms(attempt, 0) for attempt in range(1, 6)] == [5, 10, 20, 30, 30]
+
+
+def test_backoff_jitter_stays_in_range():
+    policy = BackoffRetryPolicy(base_delay_ms=8, max_delay_ms=8, jitter=0.5, rng=random.Random(1))
+    delays = [policy.delay_ms(1, 0) for _ in range(200)]
+    assert all(4 <= delay <= 8 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_recovery_hints():
+    # A server is never retried before the time it reported, unless the policy ignores the hints
+    assert BackoffRetryPolicy(base_delay_ms=5, jitter=0).delay_ms(1, 100, hint_ms=140) == 40
+    assert BackoffRetryPolicy(base_delay_ms=5, jitter=0).delay_ms(1, 100, hint_ms=102) == 5
+    assert BackoffRetryPolicy(base_delay_ms=5, jitter=0, use_hints=False).delay_ms(1, 100, hint_ms=140) == 5
+    assert FixedRetryPolicy(10).delay_ms(3, 100, hint_ms=140) == 10
+    assert not FixedRetryPolicy.use_hints
+
+
+def test_no_retry_is_scheduled_once_the_quorum_is_reached(monkeypatch):
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 5}
+                for i in range(1, 6)]
+    servers = Cluster(settings)
+    hints = []
+    monkeypatch.setattr(Server, "retry_hint_ms", lambda server: hints.append(server.id))
+    policy = CountingPolicy()
+    consensus = ConsensusAlgorithm(servers, clock=VirtualClock(), quorum="majority", retry_policy=policy)
+    assert consensus.update_consensus(File("file.txt", "v2", version=2))
+    assert consensus.update_files({"a": File("a.txt", "a")})["a"]
+    # Servers 4 and 5 were never contacted, the stragglers are left to the long retries
+    assert (policy.calls, hints) == (0, [])
+    assert consensus.unresponsive_servers == set(servers[3:])
+
+
+def test_jitter_does_not_draw_from_the_random_module():
+    settings = [{"id": i, "failure_prob": 0.5, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 20}
+                for i in range(1, 6)]
+    runs = []
+    for module_seed in (1, 2):
+        random.seed(module_seed)
+        sink = RingBufferSink(capacity=100000)
+        run_simulation(settings, 3, 10, 5, retry_policy=BackoffRetryPolicy(), seed=7, event_sink=sink)
+        runs.append([(event.type, event.time_ms, event.fields) for event in sink.events])
+    assert any(event[0] == "retry_wait" for event in runs[0])
+    assert runs[0] == runs[1]
+    first, second = BackoffRetryPolicy(seed=3), BackoffRetryPolicy(seed=3)
+    delays = [first.delay_ms(2, 0)]
+    random.random()
+    assert delays == [second.delay_ms(2, 0)]
+
+
+def test_background_retries_run_on_the_clock(monkeypatch):
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 5}
+                for i in range(1, 6)]
+    servers = Cluster(settings)
+    clock = VirtualClock()
+    sink = RingBufferSink()
+    consensus = ConsensusAlgorithm(servers, clock=clock, quorum="majority", event_sink=sink,
+                                   retry_policy=FixedRetryPolicy(10))
+    update_file = Server.update_file
+    monkeypatch.setattr(Server, "update_file",
+                        lambda server, file, time_ms: server.id != 5 and update_file(server, file, time_ms))
+    assert consensus.update_consensus(File("file.txt", "v2", version=2))
+    consensus.retry_unresponsive_servers_later(File("file.txt", "v2", version=2))
+    # The caller is not held up: nothing is sent until the clock moves
+    assert clock.now_ms() == 0 and [server.file_version for server in servers[3:]] == [None, None]
+    clock.sleep(0)
+    assert servers[3].file_version == 2 and consensus.unresponsive_servers == {servers[4]}
+    consensus.wait_for_background_retries()
+    # Server 5 rejects every attempt and is unavailable after the five attempts
+    assert clock.now_ms() == 40
+    assert (consensus.unresponsive_servers, consensus.unavailable_servers) == (set(), {servers[4]})
+    assert [event.time_ms for event in sink.of_type("update_sent") if event.fields["server"] == 5][-5:] == \
+        [0, 10, 20, 30, 40]
+
+
+def test_a_new_update_cancels_the_background_retries(monkeypatch):
+    settings = [{"id": i, "failure_prob": 0.0, "weight": 1, "recovery_delay_min": 5, "recovery_delay_max": 5}
+                for i in range(1, 4)]
+    servers = Cluster(settings)
+    clock = VirtualClock()
+    sink = RingBufferSink()
+    consensus = ConsensusAlgorithm(servers, clock=clock, quorum="majority", event_sink=sink)
+    assert consensus.update_consensus(File("file.txt", "v2", version=2))
+    consensus.retry_unresponsive_servers_later(File("file.txt", "v2", version=2))
+    assert consensus.update_consensus(File("file.txt", "v3", version=3))
+    clock.sleep(100)
+    assert [event.fields["version"] for event in sink.of_type("update_sent")].count(2) == 2
+    assert consensus.unresponsive_servers == {servers[2]} and not consensus.unavailable_servers
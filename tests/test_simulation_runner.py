@@ -0,0 +1,60 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import simulation_runner
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+def test_import_loads_no_simulation_module():
+    # A fresh interpreter, the other tests have already imported the simulation modules
+    code = ("import sys, simulation_runner; "
+            "print(sorted({'main', 'cluster', 'consensus', 'metrics', 'result_cache', 'routing', 'trials'}"
+            " & set(sys.modules)), 'configs' in vars(simulation_runner))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=SRC, capture_output=True, text=True, check=True)
+    assert output.stdout.split() == ["[]", "False"]
+
+
+def test_global_options_before_or_after_the_command():
+    for argv in (["--trials", "7", "--no-cache", "run", "Reliable"], ["run", "Reliable", "--trials", "7", "--no-cache"]):
+        args = simulation_runner.parse_args(argv)
+        assert (args.command, args.name, args.trials, args.no_cache, args.seed) == ("run", "Reliable", 7, True, 0)
+    args = simulation_runner.parse_args(["--seed", "3", "sweep", "--config", "Reliable"])
+    assert (args.seed, args.trials, args.config) == (3, 100, ["Reliable"])
+    args = simulation_runner.parse_args([])
+    assert (args.command, args.trials, args.config, args.format) == (None, 100, None, "csv")
+
+
+def test_the_api_reports_progress_only_on_request(capsys):
+    config = dict(simulation_runner.default_configs()[4], name="Quiet")
+    [row] = simulation_runner.run_batch([config], trials=4, workers=1)
+    assert row["Config"] == "Quiet" and 0 <= row["restore_accuracy"] <= 1
+    assert capsys.readouterr().out == ""
+    messages = []
+    simulation_runner.run_batch([config], trials=4, workers=1, progress=messages.append)
+    assert messages == [f"Completed configuration: Quiet (accuracy {row['restore_accuracy']:.3f})"]
+
+
+def test_a_sweep_needs_at_least_one_trial(capsys):
+    for argv in (["--trials", "0"], ["run", "Reliable", "--trials", "-2"]):
+        with pytest.raises(SystemExit):
+            simulation_runner.parse_args(argv)
+        assert "--trials: must be at least 1" in capsys.readouterr().err
+    with pytest.raises(ValueError, match="at least 1"):
+        simulation_runner.run_batch(simulation_runner.default_configs()[:1], trials=0, workers=1)
+
+
+def test_results_do_not_depend_on_the_workers():
+    configs = simulation_runner.default_configs()[:2]
+    in_process = simulation_runner.run_batch(configs, trials=6, workers=1, base_seed=5)
+    pooled = simulation_runner.run_batch(configs, trials=6, workers=2, base_seed=5)
+    # The "_ms_" span columns are wall-clock durations; the accuracy, the counters and the simulated times
+    # follow from the trial seeds only
+    def outcome(rows):
+        return [{name: value for name, value in row.items()
+                 if name == "restore_accuracy" or name.endswith("_per_trial") or "_sim_ms_" in name} for row in rows]
+    assert outcome(in_process) == outcome(pooled)
+    assert "update_rpcs_per_trial" in outcome(pooled)[0]
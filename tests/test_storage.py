@@ -0,0 +1,39 @@
+import hashlib
+import os
+
+from file import File
+from storage import MappedChunkStore, VersionLog
+
+
+def put(log, version, content):
+    return log.put_chunks(version, File("file.txt", content, version=version).iter_chunks(log.chunk_size),
+                          file_name="file.txt", text=isinstance(content, str))
+
+
+def test_versions_share_their_chunks():
+    log = VersionLog(max_versions=2, chunk_size=4)
+    assert put(log, 1, "aaaabbbbcccc") == (12, hashlib.sha256(b"aaaabbbbcccc").hexdigest())
+    # Only the changed chunk is added
+    assert put(log, 2, "aaaaXXXXcccc")[0] == 4
+    assert (log.get(1), log.get(2), log.get()) == ("aaaabbbbcccc", "aaaaXXXXcccc", "aaaaXXXXcccc")
+    assert log.stored_bytes() == 16
+    assert log.missing_chunks(log.manifest(1) + [hashlib.sha256(b"new!").hexdigest()]) == \
+        [hashlib.sha256(b"new!").hexdigest()]
+    # Evicting version 1 drops the chunk only it used
+    put(log, 3, "aaaaXXXXdddd")
+    assert (log.versions(), log.get(1), log.stored_bytes()) == ([2, 3], None, 16)
+
+
+def test_mapped_chunks_round_trip():
+    store = MappedChunkStore()
+    log = VersionLog(max_versions=2, chunk_size=4096, chunk_store=store)
+    contents = [os.urandom(4096 * 5 + 100) for _ in range(4)]
+    for version, content in enumerate(contents, start=1):
+        put(log, version, content)
+    assert log.get(3) == contents[2] and log.get(4) == contents[3]
+    assert store.stored_bytes() == log.stored_bytes() == 2 * len(contents[0])
+    # The chunk file is compacted once it holds more than twice the live chunks
+    assert os.path.getsize(store.path) <= 2 * store.stored_bytes()
+    assert b"".join(log.iter_chunks(4)) == contents[3]
+    store.close()
+    assert not os.path.exists(store.path)
@@ -0,0 +1,61 @@
+import os
+
+import wal
+from file import File
+from server import Server
+from wal import DurableVersionLog
+
+
+def make_server(directory, **options):
+    return Server(1, 0.0, 1, 1, 2, store=DurableVersionLog(directory, chunk_size=1024, **options))
+
+
+def test_reopen_replays_committed_versions(tmp_path):
+    server = make_server(tmp_path)
+    server.store_file(1, File("a.txt", "initial"))
+    for version in range(2, 6):
+        assert server.update_file(File(f"f{version}.txt", "x" * 3000 + str(version), version=version), 0)
+    expected = (server.file_version, server.file_hash, server.store.versions(), server.store.get())
+    server.store.close()
+    reopened = make_server(tmp_path)
+    assert (reopened.file_version, reopened.file_hash, reopened.store.versions(), reopened.store.get()) == expected
+    assert reopened.file_name == "f5.txt"
+
+
+def test_crash_loses_only_unsynced_versions(tmp_path):
+    server = make_server(tmp_path, sync_every=3)
+    server.store_file(1, File("a.txt", "initial"))
+    for version in range(2, 6):
+        server.update_file(File(f"f{version}.txt", f"content {version}", version=version), 0)
+    server.store.simulate_crash()  # Versions 1-3 were synced by the group fsync, 4 and 5 were not
+    assert DurableVersionLog(tmp_path, chunk_size=1024).versions() == [1, 2, 3]
+
+
+def test_torn_tail_is_dropped(tmp_path):
+    log = DurableVersionLog(tmp_path)
+    log.put_chunks(1, [b"abc"], file_name="t.txt")
+    log.close()
+    with open(log._wal_path, "ab") as f:
+        f.write(wal.RECORD.pack(wal.PUT, 80, 0) + b"garbage")  # A record cut short by the power loss
+    reopened = DurableVersionLog(tmp_path)
+    assert reopened.versions() == [1] and reopened.get(1) == "abc"
+    # New records are appended after the valid prefix and replayed
+    reopened.put_chunks(2, [b"def"], file_name="t.txt")
+    reopened.close()
+    assert DurableVersionLog(tmp_path).versions() == [1, 2]
+
+
+def test_checkpoint_syncs_the_rename_before_deleting_the_log(tmp_path, monkeypatch):
+    log = DurableVersionLog(tmp_path, snapshot_bytes=1)
+    calls = []
+    sync_directory = log._sync_directory
+    monkeypatch.setattr(log, "_sync_directory", lambda: (calls.append("sync directory"), sync_directory()))
+    unlink = os.unlink
+    monkeypatch.setattr(os, "unlink", lambda path: (calls.append("unlink"), unlink(path)))
+    log.put_chunks(1, [b"abc"], file_name="t.txt")  # Exceeds snapshot_bytes: checkpoints
+    assert log.generation == 1
+    assert calls.index("sync directory") < calls.index("unlink")
+    log.put_chunks(2, [b"def"], file_name="t.txt")
+    log.close()
+    assert DurableVersionLog(tmp_path).versions() == [1, 2]
+    assert sorted(os.listdir(tmp_path)) == ["snapshot", "wal-00000002.log"]